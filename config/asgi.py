@@ -3,6 +3,19 @@ ASGI config for config project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+The catalog status feed (/api/status/stream/) is a long-lived SSE response
+and the accounting exports stream large bodies, so run the project through
+this ASGI app, e.g.:
+
+    uvicorn config.asgi:application --host 0.0.0.0 --port $PORT --workers 4
+
+Each worker keeps its own in-memory feed, but while clients are listening it
+polls Instrument.updated_at once a second, so status changes made by other
+workers, run_worker jobs and the admin reach every stream.
+
+Under WSGI (gunicorn config.wsgi) the site still works: the feed answers 204
+and the catalog falls back to polling, exports stream from a sync generator.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
@@ -1,5 +1,6 @@
 from pathlib import Path
 import os
+import sys
 import dj_database_url
 
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -24,8 +25,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'rentals.middleware.QueryMetricsMiddleware', # <--- МЕТРИКИ (первым, чтобы видеть все запросы)
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware', # <--- ДЛЯ СТАТИКИ НА RENDER
+    'rentals.middleware.AsyncWhiteNoiseMiddleware', # <--- ДЛЯ СТАТИКИ НА RENDER (WhiteNoise, но без потока под ASGI)
+    'rentals.middleware.ReplicaPinMiddleware', # <--- после записи клиент читает с основной базы
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -62,6 +65,76 @@ DATABASES = {
     )
 }
 
+# КЭШ: по умолчанию в памяти процесса (LRU с лимитом записей). Если задан
+# REDIS_URL — общий Redis (нужен пакет redis), тогда сбросы кэша из воркера и
+# команд видны всем процессам веба
+REDIS_URL = os.environ.get('REDIS_URL', '')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+            'TIMEOUT': 300,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'muzrent',
+            'TIMEOUT': 300,
+            'OPTIONS': {'MAX_ENTRIES': int(os.environ.get('CACHE_MAX_ENTRIES', '10000'))},
+        }
+    }
+
+# БРОНИРОВАНИЕ: ответы на повтор с тем же Idempotency-Key живут столько секунд
+BOOKING_IDEMPOTENCY_TTL = 10 * 60
+# Token bucket до блокировки строки: (токенов в секунду, размер ведра)
+BOOKING_RATE_LIMITS = {
+    'user': (0.5, 5),
+    'instrument': (2.0, 10),
+}
+# 'local' — ведра в памяти процесса, 'cache' — в общем кэше (Redis)
+BOOKING_RATE_LIMIT_STORE = os.environ.get('BOOKING_RATE_LIMIT_STORE', 'local')
+
+# Сессии читаются из кэша, в БД идет только запись (и чтение при промахе)
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
+# РЕПЛИКИ ДЛЯ ЧТЕНИЯ: DATABASE_REPLICA_URLS="postgres://...,postgres://..."
+# Читают с них только вьюхи с @replica_reads (см. rentals/db_routing.py).
+# Локально можно проверить на копии SQLite-файла или второй базе PostgreSQL
+DATABASE_REPLICAS = []
+for _number, _url in enumerate(filter(None, os.environ.get('DATABASE_REPLICA_URLS', '').split(',')), 1):
+    DATABASES[f'replica{_number}'] = dj_database_url.parse(
+        _url.strip(), conn_max_age=600, conn_health_checks=True,
+    )
+    # В тестах реплика смотрит в тестовую default, а не в отдельную базу
+    DATABASES[f'replica{_number}']['TEST'] = {'MIRROR': 'default'}
+    DATABASE_REPLICAS.append(f'replica{_number}')
+# Тесты роутинга (rentals/tests.py) включают реплику через override_settings:
+# алиас replica — второе соединение к той же тестовой базе (зеркало default)
+if sys.argv[1:2] == ['test']:
+    DATABASES['replica'] = {**DATABASES['default'], 'TEST': {'MIRROR': 'default'}}
+DATABASE_ROUTERS = ['rentals.db_routing.ReplicaRouter']
+# Сколько секунд после своей записи клиент читает с основной базы (отставание реплик)
+REPLICA_PIN_SECONDS = int(os.environ.get('REPLICA_PIN_SECONDS', '10'))
+# Через сколько секунд снова пробовать реплику после ошибки
+REPLICA_RETRY_SECONDS = 30
+
+# На PostgreSQL поиск использует pg_trgm и полнотекстовые индексы
+if DATABASES['default']['ENGINE'] == 'django.db.backends.postgresql':
+    INSTALLED_APPS.append('django.contrib.postgres')
+
+# Поиск инструментов: 'auto' (PostgreSQL, если он есть), 'postgres' или 'memory'
+SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND', 'auto')
+
+# Тарифы аренды: скидка в % начиная с N суток и коэффициент за сутки просрочки
+RENTAL_DISCOUNTS = [(7, 10), (30, 20)]
+RENTAL_OVERDUE_RATE = 1.5
+
+# Закрытые аренды старше стольких дней переносятся в архив (archive_rentals)
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', '365'))
+
 AUTH_PASSWORD_VALIDATORS = [] # Отключаем сложные пароли для удобства
 
 LANGUAGE_CODE = 'ru-ru'
@@ -78,4 +151,12 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # Медиа-данные 
 MEDIA_URL = '/media/'
-MEDIA_ROOT = BASE_DIR / 'media'
\ No newline at end of file
+MEDIA_ROOT = BASE_DIR / 'media'
+# Сколько процессов делают уменьшенные копии картинок
+IMAGE_VARIANT_WORKERS = int(os.environ.get('IMAGE_VARIANT_WORKERS', '2'))
+
+# Метрики запросов (/metrics, заголовок Server-Timing)
+# Доля запросов, для которых считаем SQL и время шаблонов
+METRICS_SAMPLE_RATE = float(os.environ.get('METRICS_SAMPLE_RATE', '1.0' if DEBUG else '0.1'))
+# Если задан, /metrics требует заголовок "Authorization: Bearer <токен>"
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
@@ -1,8 +1,5 @@
 from django.contrib import admin
 from django.urls import path, re_path
-from django.conf import settings
-from django.conf.urls.static import static
-from django.views.static import serve # <--- Важный импорт для раздачи файлов
 from django.contrib.auth import views as auth_views
 from rentals import views
 
@@ -12,6 +9,7 @@ urlpatterns = [
     # Главная и профиль
     path('', views.catalog, name='catalog'),
     path('profile/', views.profile, name='profile'),
+    path('api/profile/history/', views.api_profile_history, name='api_profile_history'),
     path('register/', views.register, name='register'),
     
     # Вход/Выход
@@ -20,19 +18,26 @@ urlpatterns = [
     
     # API
     path('api/book/', views.create_booking_async, name='book_api'),
+    path('api/book/batch/', views.create_batch_booking_async, name='book_batch_api'),
     path('api/v1/instruments/', views.api_instruments, name='api_instruments'),
     path('api/status/', views.api_check_availability, name='api_check_status'),
+    path('api/status/stream/', views.api_status_stream, name='api_status_stream'),
+    path('api/availability/', views.api_free_instruments, name='api_free_instruments'),
+    path('api/stock/', views.api_branch_stock, name='api_branch_stock'),
+    path('api/search/', views.api_search, name='api_search'),
+    path('api/reports/revenue/', views.api_report_revenue, name='api_report_revenue'),
+    path('api/reports/utilization/', views.api_report_utilization, name='api_report_utilization'),
+    path('api/exports/<str:kind>/', views.api_accounting_export, name='api_accounting_export'),
+
+    # Метрики для Prometheus
+    path('metrics', views.metrics, name='metrics'),
 
     # Новые функции (отмена, детали)
     path('rental/cancel/<int:rental_id>/', views.cancel_rental, name='cancel_rental'),
     path('instrument/<int:pk>/', views.instrument_detail, name='instrument_detail'),
+    path('api/instruments/<int:pk>/recommendations/', views.api_recommendations, name='api_recommendations'),
 
     # --- медиа ---
-    re_path(r'^media/(?P<path>.*)$', serve, {
-        'document_root': settings.MEDIA_ROOT,
-    }),
-] 
-
-# Дополнительная страховка для локальной разработки
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+    # Отдаем через FileResponse с заголовками кэширования (см. views.media_file)
+    re_path(r'^media/(?P<path>.*)$', views.media_file, name='media'),
+] 
\ No newline at end of file
@@ -0,0 +1,328 @@
+"""
+Выгрузки для бухгалтерии: аренды, платежи и ТО за период (и по филиалу)
+в CSV или XLSX.
+
+Строки читаются через .iterator()/.aiterator(chunk_size) — на PostgreSQL
+это серверный курсор, — и сразу кодируются в байты пачками, так что память
+не зависит от размера выгрузки, а заголовок уходит клиенту до первого
+запроса к БД. Связанные поля (инструмент, филиал, клиент) приходят тем же
+запросом через JOIN (values() по связям), без моделей и без N+1.
+
+Архивные аренды и платежи (ArchivedRental/ArchivedPayment) идут следом за
+рабочими, колонка archived их отличает: за год почти все закрытые аренды
+уже в архиве.
+
+XLSX пишется потоково: zipfile умеет писать в поток без seek (размеры
+файлов — в дескрипторах после данных), лист — построчный XML с inline-
+строками, без стилей. CSV можно сжимать на лету (gzip).
+"""
+import csv
+import datetime
+import io
+import re
+import zipfile
+import zlib
+from xml.sax.saxutils import escape
+
+from django.utils import timezone
+
+from .models import ArchivedPayment, ArchivedRental, Instrument, Maintenance, Payment, Rental
+
+FORMATS = ('csv', 'xlsx')
+CHUNK = 2000
+
+# Вид выгрузки -> колонки
+KIND_FIELDS = {
+    'rentals': [
+        'id', 'created_at', 'start_date', 'end_date', 'returned_at', 'total_price', 'is_active', 'is_overdue',
+        'archived', 'inventory_number', 'instrument', 'category', 'brand', 'location', 'username', 'email',
+    ],
+    'payments': [
+        'id', 'payment_date', 'amount', 'is_successful', 'archived', 'rental_id', 'rental_start', 'rental_end',
+        'inventory_number', 'instrument', 'location', 'username',
+    ],
+    'maintenance': [
+        'id', 'date', 'cost', 'description', 'inventory_number', 'instrument', 'category', 'brand', 'location',
+    ],
+}
+
+# Колонка выгрузки -> поле values() (остальные совпадают с именем колонки)
+RENTAL_COLUMNS = {
+    'inventory_number': 'instrument__inventory_number', 'instrument': 'instrument__name',
+    'category': 'instrument__category__name', 'brand': 'instrument__brand__name',
+    'location': 'instrument__location__name', 'username': 'user__username', 'email': 'user__email',
+}
+PAYMENT_COLUMNS = {
+    'rental_start': 'rental__start_date', 'rental_end': 'rental__end_date',
+    'inventory_number': 'rental__instrument__inventory_number', 'instrument': 'rental__instrument__name',
+    'location': 'rental__instrument__location__name', 'username': 'rental__user__username',
+}
+MAINTENANCE_COLUMNS = {
+    'inventory_number': 'instrument__inventory_number', 'instrument': 'instrument__name',
+    'category': 'instrument__category__name', 'brand': 'instrument__brand__name',
+    'location': 'instrument__location__name',
+}
+
+
+def _day_bounds(start, end):
+    """Полуинтервал [start, end + 1 день) в aware datetime — фильтр идет по индексу."""
+    tz = timezone.get_current_timezone()
+    lower = timezone.make_aware(datetime.datetime.combine(start, datetime.time.min), tz) if start else None
+    upper = (timezone.make_aware(datetime.datetime.combine(end + datetime.timedelta(days=1), datetime.time.min), tz)
+             if end else None)
+    return lower, upper
+
+
+def _query(qs, columns, fields, constants, date_field, start, end, location_field, location, ordering=('id',)):
+    if start:
+        qs = qs.filter(**{f'{date_field}__gte': start})
+    if end:
+        qs = qs.filter(**{f'{date_field}__lt' if isinstance(end, datetime.datetime) else f'{date_field}__lte': end})
+    if location:
+        # Строки филиала достаются по индексу instrument_id; сортирует БД только эту выборку
+        qs = qs.filter(**{location_field: Instrument.objects.filter(location_id=location).values('id')})
+    # values(), а не values_list(): у последнего aiterator() выполняет запрос прямо в event loop
+    lookups = [columns.get(name, name) for name in fields if name not in constants]
+    return qs.order_by(*ordering).values(*lookups), columns, constants
+
+
+def export_sources(kind, start=None, end=None, location=None):
+    """
+    Запросы выгрузки по порядку: [(queryset values, колонка -> поле,
+    константы)]. Константы — колонки, которых в этой таблице нет.
+    """
+    fields = KIND_FIELDS[kind]
+    if kind == 'rentals':
+        # Аренды — по дате начала
+        args = ('start_date', start, end, 'instrument_id__in', location)
+        return [
+            _query(Rental.objects.all(), RENTAL_COLUMNS, fields, {'archived': False}, *args),
+            _query(ArchivedRental.objects.all(), RENTAL_COLUMNS, fields,
+                   {'archived': True, 'is_active': False, 'is_overdue': False}, *args),
+        ]
+    if kind == 'payments':
+        lower, upper = _day_bounds(start, end)
+        # Порядок по дате платежа: диапазон и сортировка идут по одному индексу.
+        # Архив — в порядке чтения: планировщик там любит зайти с клиентов
+        # и отсортировать все целиком, а это задержка до первого байта
+        args = ('payment_date', lower, upper, 'rental__instrument_id__in', location)
+        return [
+            _query(Payment.objects.all(), PAYMENT_COLUMNS, fields, {'archived': False}, *args, ('payment_date', 'id')),
+            _query(ArchivedPayment.objects.all(), PAYMENT_COLUMNS, fields, {'archived': True}, *args, ()),
+        ]
+    args = ('date', start, end, 'instrument_id__in', location)
+    return [_query(Maintenance.objects.all(), MAINTENANCE_COLUMNS, fields, {}, *args)]
+
+
+def _row(fields, columns, constants, values):
+    return [constants[name] if name in constants else values[columns.get(name, name)] for name in fields]
+
+
+def export_batches(kind, start=None, end=None, location=None, chunk_size=CHUNK):
+    """Пачки строк выгрузки (списки в порядке KIND_FIELDS[kind]) — для команды."""
+    fields = KIND_FIELDS[kind]
+    batch = []
+    for qs, columns, constants in export_sources(kind, start, end, location):
+        for values in qs.iterator(chunk_size=chunk_size):
+            batch.append(_row(fields, columns, constants, values))
+            if len(batch) >= chunk_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+async def aexport_batches(kind, start=None, end=None, location=None, chunk_size=CHUNK):
+    """То же для async-вьюхи."""
+    fields = KIND_FIELDS[kind]
+    batch = []
+    for qs, columns, constants in export_sources(kind, start, end, location):
+        async for values in qs.aiterator(chunk_size=chunk_size):
+            batch.append(_row(fields, columns, constants, values))
+            if len(batch) >= chunk_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+# --- КОДИРОВЩИКИ: строки -> байты пачками ---
+def _cell(value):
+    if isinstance(value, datetime.datetime):
+        return timezone.localtime(value).strftime('%Y-%m-%d %H:%M:%S') if timezone.is_aware(value) else value.isoformat(' ')
+    if isinstance(value, bool):
+        return int(value)
+    return value
+
+
+class CsvEncoder:
+    content_type = 'text/csv; charset=utf-8'
+    extension = 'csv'
+
+    def __init__(self, fields):
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer)
+        self.fields = fields
+
+    def _take(self):
+        data = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return data.encode('utf-8')
+
+    def start(self):
+        # BOM — чтобы Excel сам понял UTF-8
+        self.writer.writerow(self.fields)
+        return b'\xef\xbb\xbf' + self._take()
+
+    def rows(self, rows):
+        self.writer.writerows([_cell(v) for v in row] for row in rows)
+        return self._take()
+
+    def finish(self):
+        return b''
+
+
+class _Sink:
+    """Поток без seek/tell: zipfile пишет в него, мы забираем накопленное."""
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+# Символы, запрещенные в XML 1.0 (встречаются в описаниях из импорта)
+_XML_ILLEGAL = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+_XLSX_STATIC = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="xl/workbook.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+        '</Relationships>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="worksheets/sheet1.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"/>'
+        '</Relationships>'
+    ),
+}
+
+
+class XlsxEncoder:
+    content_type = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    extension = 'xlsx'
+
+    def __init__(self, fields, sheet='Export'):
+        self.fields = fields
+        self.sheet = sheet
+        self.sink = _Sink()
+        self.zip = None
+        self.sheet_file = None
+        self.row_no = 0
+
+    def _row_xml(self, values):
+        self.row_no += 1
+        cells = []
+        for value in map(_cell, values):
+            if value is None or value == '':
+                cells.append('<c/>')
+            elif isinstance(value, (int, float)) or hasattr(value, 'as_integer_ratio'):
+                cells.append(f'<c><v>{value}</v></c>')
+            else:
+                text = escape(_XML_ILLEGAL.sub('', str(value)))
+                cells.append(f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>')
+        return f'<row r="{self.row_no}">{"".join(cells)}</row>'
+
+    def start(self):
+        self.zip = zipfile.ZipFile(self.sink, 'w', compression=zipfile.ZIP_DEFLATED)
+        for name, content in _XLSX_STATIC.items():
+            self.zip.writestr(name, content)
+        self.zip.writestr('xl/workbook.xml', (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+            'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+            f'<sheets><sheet name="{escape(self.sheet)}" sheetId="1" r:id="rId1"/></sheets></workbook>'
+        ))
+        # Размер листа заранее неизвестен — сразу ZIP64
+        self.sheet_file = self.zip.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True)
+        self.sheet_file.write((
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+            + self._row_xml(self.fields)
+        ).encode('utf-8'))
+        return self.sink.take()
+
+    def rows(self, rows):
+        self.sheet_file.write(''.join(self._row_xml(row) for row in rows).encode('utf-8'))
+        return self.sink.take()
+
+    def finish(self):
+        self.sheet_file.write(b'</sheetData></worksheet>')
+        self.sheet_file.close()
+        self.zip.close()
+        return self.sink.take()
+
+
+ENCODERS = {'csv': CsvEncoder, 'xlsx': XlsxEncoder}
+
+
+def gzip_compressor():
+    # wbits=31 — формат gzip (заголовок и CRC), как у модуля gzip
+    return zlib.compressobj(6, zlib.DEFLATED, 31)
+
+
+def _gzip_out(gz):
+    # Сброс на каждой пачке: клиент получает данные сразу, а не когда наполнится блок
+    return lambda chunk: gz.compress(chunk) + gz.flush(zlib.Z_SYNC_FLUSH) if gz else chunk
+
+
+def encode_stream(encoder, batches, compress=False):
+    """Байты выгрузки по пачкам строк (команда, WSGI): заголовок отдается сразу."""
+    gz = gzip_compressor() if compress else None
+    out = _gzip_out(gz)
+    yield out(encoder.start())
+    for batch in batches:
+        chunk = out(encoder.rows(batch))
+        if chunk:
+            yield chunk
+    tail = encoder.finish()
+    yield (gz.compress(tail) + gz.flush()) if gz else tail
+
+
+async def aencode_stream(encoder, batches, compress=False):
+    """То же для StreamingHttpResponse под ASGI."""
+    gz = gzip_compressor() if compress else None
+    out = _gzip_out(gz)
+    yield out(encoder.start())
+    async for batch in batches:
+        chunk = out(encoder.rows(batch))
+        if chunk:
+            yield chunk
+    tail = encoder.finish()
+    yield (gz.compress(tail) + gz.flush()) if gz else tail
@@ -1,5 +1,6 @@
-from django.contrib import admin
+from django.contrib import admin, messages
 from .models import *
+from .search import search_instruments
 
 # Простой способ зарегистрировать всё
 @admin.register(Category)
@@ -19,8 +20,61 @@ class InstrumentAdmin(admin.ModelAdmin):
     list_display = ('name', 'brand', 'category', 'price_per_day', 'status', 'location')
     list_filter = ('status', 'brand', 'category')
     search_fields = ('name', 'inventory_number')
+    # Поиск идет через индекс с допуском опечаток и отдает только лучшие
+    # совпадения: id уходят в запрос одним IN (...), без лимита он разрастется
+    SEARCH_LIMIT = 500
+    search_help_text = (
+        f"Ищет по названию, бренду, категории, описанию и номеру с учетом опечаток; "
+        f"показывает {SEARCH_LIMIT} лучших совпадений — уточните запрос, если нужного нет"
+    )
+
+    def get_search_results(self, request, queryset, search_term):
+        # Вместо icontains-сканирования идем в поисковый индекс
+        if not search_term:
+            return super().get_search_results(request, queryset, search_term)
+        ids = [hit.id for hit in search_instruments(search_term, limit=self.SEARCH_LIMIT)]
+        if len(ids) == self.SEARCH_LIMIT:
+            messages.warning(request, f"Показаны только {self.SEARCH_LIMIT} лучших совпадений — уточните запрос.")
+        return queryset.filter(id__in=ids), False
 
 @admin.register(Rental)
 class RentalAdmin(admin.ModelAdmin):
-    list_display = ('instrument', 'user', 'start_date', 'total_price', 'is_active')
-    list_filter = ('is_active',)
\ No newline at end of file
+    list_display = ('instrument', 'user', 'start_date', 'end_date', 'returned_at', 'total_price', 'is_active', 'is_overdue')
+    list_filter = ('is_active', 'is_overdue')
+
+@admin.register(InstrumentDailyStats)
+class InstrumentDailyStatsAdmin(admin.ModelAdmin):
+    list_display = ('day', 'instrument', 'location', 'revenue', 'rentals_started', 'rented', 'maintenance_cost')
+    list_filter = ('location', 'category', 'brand', 'rented')
+    date_hierarchy = 'day'
+    raw_id_fields = ('instrument',)
+    list_select_related = ('instrument', 'location')
+
+
+@admin.register(ArchivedRental)
+class ArchivedRentalAdmin(admin.ModelAdmin):
+    list_display = ('id', 'instrument', 'user', 'start_date', 'returned_at', 'total_price', 'archived_at')
+    raw_id_fields = ('instrument', 'user')
+    list_select_related = ('instrument', 'user')
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'status', 'run_at', 'attempts', 'worker', 'finished_at')
+    list_filter = ('status', 'name')
+    readonly_fields = ('result', 'last_error', 'started_at', 'finished_at', 'worker')
+
+
+@admin.register(InstrumentRecommendation)
+class InstrumentRecommendationAdmin(admin.ModelAdmin):
+    list_display = ('instrument', 'rank', 'recommended', 'score')
+    raw_id_fields = ('instrument', 'recommended')
+    list_select_related = ('instrument', 'recommended')
+
+
+@admin.register(LocationStock)
+class LocationStockAdmin(admin.ModelAdmin):
+    list_display = ('location', 'name', 'brand', 'category', 'status', 'count')
+    list_filter = ('location', 'status', 'category')
+    search_fields = ('name',)
+    list_select_related = ('location', 'brand', 'category')
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class RentalsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'rentals'
+
+    def ready(self):
+        # Подключаем обработчики сигналов (сброс кэшей и т.п.)
+        from . import signals  # noqa: F401
@@ -0,0 +1,63 @@
+"""
+Перенос старых закрытых аренд и их платежей в архивные таблицы.
+
+Вместо секционирования по датам (на SQLite его нет, а на PostgreSQL оно
+потребовало бы пересоздать таблицы с составным ключом) используем отдельные
+таблицы ArchivedRental/ArchivedPayment. Каждая пачка переносится в одной
+транзакции: копия (ignore_conflicts) и удаление оригиналов. Если процесс
+прервать, следующий запуск просто продолжит с оставшихся записей.
+Профиль и отчеты читают архив наравне с рабочими таблицами.
+"""
+import datetime
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from .models import ArchivedPayment, ArchivedRental, Payment, Rental
+
+RENTAL_FIELDS = ('id', 'instrument_id', 'user_id', 'start_date', 'end_date', 'returned_at',
+                 'total_price', 'created_at')
+PAYMENT_FIELDS = ('id', 'rental_id', 'amount', 'payment_date', 'is_successful')
+
+
+def archive_candidates(older_than_days=None, today=None):
+    """Закрытые аренды, завершившиеся раньше чем older_than_days дней назад."""
+    if older_than_days is None:
+        older_than_days = settings.ARCHIVE_AFTER_DAYS
+    cutoff = (today or datetime.date.today()) - datetime.timedelta(days=older_than_days)
+    # Дата окончания: фактический возврат, иначе плановый, иначе начало
+    return Rental.objects.filter(is_active=False).filter(
+        Q(returned_at__lt=cutoff)
+        | Q(returned_at__isnull=True, end_date__lt=cutoff)
+        | Q(returned_at__isnull=True, end_date__isnull=True, start_date__lt=cutoff)
+    )
+
+
+def archive_batch(rental_ids):
+    """Переносит аренды с указанными id (и их платежи) в архив. Возвращает (аренд, платежей)."""
+    with transaction.atomic():
+        # Перечитываем под транзакцией: вдруг кто-то успел вернуть аренду в работу
+        rentals = list(Rental.objects.filter(id__in=rental_ids, is_active=False).values(*RENTAL_FIELDS))
+        ids = [row['id'] for row in rentals]
+        payments = list(Payment.objects.filter(rental_id__in=ids).values(*PAYMENT_FIELDS))
+
+        ArchivedRental.objects.bulk_create([ArchivedRental(**row) for row in rentals], ignore_conflicts=True)
+        ArchivedPayment.objects.bulk_create([ArchivedPayment(**row) for row in payments], ignore_conflicts=True)
+        # Платежи удалятся каскадом одним DELETE ... WHERE rental_id IN (...)
+        Rental.objects.filter(id__in=ids).delete()
+    return len(rentals), len(payments)
+
+
+def archive_rentals(older_than_days=None, batch_size=1000, max_batches=None):
+    """Архивирует пачками по id. Генератор: после каждой пачки отдает (аренд, платежей)."""
+    candidates = archive_candidates(older_than_days).order_by('id').values_list('id', flat=True)
+    batches = 0
+    last_id = 0
+    while max_batches is None or batches < max_batches:
+        ids = list(candidates.filter(id__gt=last_id)[:batch_size])
+        if not ids:
+            return
+        last_id = ids[-1]
+        yield archive_batch(ids)
+        batches += 1
@@ -0,0 +1,64 @@
+"""
+Доступность инструментов по датам.
+
+Аренда занимает интервал [start_date, end_date] включительно, end_date=None
+означает открытую аренду (до возврата). Два интервала пересекаются, если
+start_date <= конец_запроса и (end_date пустой или end_date >= начало_запроса).
+Просроченная аренда (активна, end_date уже прошел) держит инструмент до
+возврата — считаем, что она длится по сегодня включительно.
+Все запросы идут по частичным индексам на активных арендах (см. Rental.Meta),
+поэтому проверка и поиск не берут блокировок и не зависят от размера архива.
+"""
+import datetime
+
+from django.db.models import Q
+
+from .models import Instrument, Rental
+
+
+def overlapping_rentals(start, end=None):
+    """Активные аренды, пересекающиеся с периодом [start, end] (end=None — бессрочно)."""
+    rentals = Rental.objects.filter(is_active=True)
+    if end is not None:
+        rentals = rentals.filter(start_date__lte=end)
+    still_out = Q(end_date__isnull=True) | Q(end_date__gte=start)
+    if start <= datetime.date.today():
+        # Просроченные аренды: инструмент еще не вернули
+        still_out |= Q(end_date__lt=datetime.date.today())
+    return rentals.filter(still_out)
+
+
+def has_conflict(instrument_id, start, end=None):
+    return overlapping_rentals(start, end).filter(instrument_id=instrument_id).exists()
+
+
+def is_busy_today(instrument_id):
+    today = datetime.date.today()
+    return has_conflict(instrument_id, today, today)
+
+
+def free_instruments(start, end=None, queryset=None):
+    """Инструменты, свободные весь период (на обслуживании — не выдаем)."""
+    if queryset is None:
+        queryset = Instrument.objects.all()
+    busy = overlapping_rentals(start, end).values('instrument_id')
+    return queryset.exclude(status='maintenance').exclude(id__in=busy)
+
+
+def parse_period(start_raw, end_raw):
+    """
+    Разбирает даты из запроса (YYYY-MM-DD). Пустое начало — сегодня,
+    пустой конец — открытая аренда. Возвращает (start, end, ошибка).
+    """
+    today = datetime.date.today()
+    try:
+        start = datetime.date.fromisoformat(start_raw) if start_raw else today
+        end = datetime.date.fromisoformat(end_raw) if end_raw else None
+    except ValueError:
+        return None, None, "Ошибка: даты должны быть в формате ГГГГ-ММ-ДД"
+
+    if start < today:
+        return None, None, "Ошибка: нельзя забронировать на прошедшие даты"
+    if end is not None and end < start:
+        return None, None, "Ошибка: дата возврата раньше даты начала"
+    return start, end, None
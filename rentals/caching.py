@@ -0,0 +1,167 @@
+"""
+Кэширование справочников каталога.
+
+Списки категорий, брендов и филиалов для фильтров меняются редко, а нужны на каждом
+открытии каталога. Держим их в кэше Django и сбрасываем сигналами
+при сохранении/удалении (см. signals.py). Там же — версионный кэш объектов
+по pk и счетчики попаданий для /metrics.
+"""
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Value
+
+from .metrics import registry
+from .models import Brand, Category, Location
+
+FILTER_LISTS_KEY = 'catalog:filter_lists'
+FILTER_LISTS_TIMEOUT = 60 * 60
+FILTER_LIST_MODELS = {'categories': Category, 'brands': Brand, 'locations': Location}
+
+
+def get_filter_lists():
+    data = cache.get(FILTER_LISTS_KEY)
+    cache_stats.record('filter_lists', hit=data is not None)
+    if data is None:
+        # Три справочника одним запросом (UNION ALL), разбираем по метке kind
+        data = {kind: [] for kind in FILTER_LIST_MODELS}
+        lists = [
+            model.objects.annotate(kind=Value(kind)).values('kind', 'id', 'name')
+            for kind, model in FILTER_LIST_MODELS.items()
+        ]
+        # Сортируем сами: ORDER BY по UNION — это временное B-дерево в БД
+        for row in sorted(lists[0].union(*lists[1:], all=True), key=lambda r: (r['kind'], r['id'])):
+            data[row.pop('kind')].append(row)
+        cache.set(FILTER_LISTS_KEY, data, FILTER_LISTS_TIMEOUT)
+    return data
+
+
+def invalidate_filter_lists():
+    cache.delete(FILTER_LISTS_KEY)
+    transaction.on_commit(lambda: _bump_version(REFERENCE_VERSION_KEY))
+
+
+# Версия справочников для ключей кэша, куда вшиты их названия (карточки
+# каталога): поднимается при любой правке категории, бренда или филиала
+REFERENCE_VERSION_KEY = 'catalog:reference_version'
+
+
+def reference_version():
+    return _current_version(REFERENCE_VERSION_KEY)
+
+
+async def areference_version():
+    version = await cache.aget(REFERENCE_VERSION_KEY)
+    return version if version is not None else await sync_to_async(reference_version)()
+
+# Карточки инструментов кэшируются во фрагментах шаблона по id, статусу,
+# updated_at и версии справочников, поэтому любое сохранение инструмента
+# или переименование категории/бренда/филиала дает новый ключ
+CATALOG_CARD_CACHE_TIMEOUT = 10 * 60
+
+
+# --- КЭШ ОБЪЕКТОВ ПО PK ---
+# Ключ содержит версию модели: invalidate_model() поднимает ее, и все старые
+# ключи разом становятся недостижимыми (их потом вытеснит LRU или TTL).
+# Справочники вшиты в кэшированный инструмент через select_related, поэтому
+# правка филиала/бренда/категории сбрасывает и версию Instrument (см. signals.py).
+# LocMem живет внутри процесса: сброс из воркера или команды дойдет до веба
+# только через общий бэкенд (Redis), а до тех пор спасает короткий TTL.
+OBJECT_CACHE_TIMEOUT = 5 * 60
+
+
+class CacheStats:
+    """Счетчики попаданий/промахов по пространствам имен (для /metrics)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {}
+
+    def record(self, namespace, hit):
+        with self._lock:
+            counts = self._counts.setdefault(namespace, [0, 0])
+            counts[0 if hit else 1] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {name: tuple(counts) for name, counts in self._counts.items()}
+
+    def prometheus_lines(self):
+        lines = [
+            '# HELP muzrent_cache_requests_total Cache lookups, by namespace and result.',
+            '# TYPE muzrent_cache_requests_total counter',
+        ]
+        for name, (hits, misses) in sorted(self.snapshot().items()):
+            lines.append(f'muzrent_cache_requests_total{{namespace="{name}",result="hit"}} {hits}')
+            lines.append(f'muzrent_cache_requests_total{{namespace="{name}",result="miss"}} {misses}')
+        return lines
+
+
+cache_stats = CacheStats()
+registry.register_collector(cache_stats.prometheus_lines)
+
+
+def _version_key(model):
+    return f'obj:{model._meta.label_lower}:version'
+
+
+def _current_version(key):
+    version = cache.get(key)
+    if version is None:
+        # Начинаем с текущего времени, а не с 1: если ключ версии вытеснили,
+        # старые объекты с маленькой версией не "оживут"
+        cache.add(key, int(time.time() * 1000), None)
+        version = cache.get(key)
+    return version
+
+
+def _bump_version(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        _current_version(key)  # ключа не было: заведется новая версия
+
+
+def model_version(model):
+    return _current_version(_version_key(model))
+
+
+def _object_key(model, version, pk):
+    return f'obj:{model._meta.label_lower}:v{version}:{pk}'
+
+
+def get_object(model, pk, queryset=None):
+    """
+    Объект по pk из кэша, при промахе — из queryset (по умолчанию все объекты модели).
+    Если объекта нет, летит model.DoesNotExist, как у обычного get().
+    """
+    namespace = f'object:{model._meta.model_name}'
+    key = _object_key(model, model_version(model), pk)
+    obj = cache.get(key)
+    if obj is not None:
+        cache_stats.record(namespace, hit=True)
+        return obj
+    cache_stats.record(namespace, hit=False)
+    obj = (queryset if queryset is not None else model.objects).get(pk=pk)
+    cache.set(key, obj, OBJECT_CACHE_TIMEOUT)
+    return obj
+
+
+def invalidate_objects(model, pks):
+    """Сбрасывает кэш конкретных объектов после коммита (иначе читатель закэширует старое)."""
+    pks = list(pks)
+    if not pks:
+        return
+
+    def drop():
+        version = model_version(model)
+        cache.delete_many([_object_key(model, version, pk) for pk in pks])
+    transaction.on_commit(drop)
+
+
+def invalidate_model(model):
+    """Сбрасывает кэш всех объектов модели (после массовых UPDATE)."""
+    transaction.on_commit(lambda: _bump_version(_version_key(model)))
@@ -0,0 +1,179 @@
+"""
+Чтение с реплик для вьюх, которые ничего не пишут.
+
+Реплики описываются в settings.DATABASE_REPLICAS (алиасы из DATABASES,
+см. DATABASE_REPLICA_URLS). Вьюха, помеченная @replica_reads, на время
+обработки GET/HEAD выбирает здоровую реплику (по кругу) и кладет ее в
+contextvar; ReplicaRouter отправляет туда все чтения. Запись всегда идет
+в default, как и любые запросы вне помеченных вьюх (бронирование, фоновые
+задачи, команды).
+
+Свои записи клиент должен видеть сразу, а реплика отстает: после POST и
+других изменяющих запросов ReplicaPinMiddleware ставит cookie, и пока она
+жива (REPLICA_PIN_SECONDS), чтения этого клиента идут в основную базу.
+
+Отказ реплики: если вьюха на реплике упала с OperationalError/InterfaceError,
+реплика помечается нерабочей на REPLICA_RETRY_SECONDS, ее постоянное
+соединение закрывается, а запрос повторяется на основной базе (GET можно
+повторять). Счетчики по алиасам видны в /metrics.
+"""
+import functools
+import itertools
+import threading
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, InterfaceError, OperationalError, connections
+from django.db.backends.signals import connection_created
+
+from .metrics import _label, registry
+
+PIN_COOKIE = 'pin_primary'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_read_alias = ContextVar('read_alias', default=None)
+
+
+class ReplicaPool:
+    """Выбор реплики по кругу с учетом здоровья + счетчики для метрик."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._turn = itertools.count()
+        self._down_until = {}
+        self.routed = {}
+        self.failovers = {}
+        self.connections = {}
+
+    @property
+    def aliases(self):
+        return list(getattr(settings, 'DATABASE_REPLICAS', []))
+
+    def healthy(self):
+        now = time.monotonic()
+        with self._lock:
+            return [alias for alias in self.aliases if self._down_until.get(alias, 0) <= now]
+
+    def choose(self):
+        """Алиас для чтения: здоровая реплика или default, если таких нет."""
+        candidates = self.healthy()
+        alias = candidates[next(self._turn) % len(candidates)] if candidates else DEFAULT_DB_ALIAS
+        self._count(self.routed, alias)
+        return alias
+
+    def mark_down(self, alias):
+        retry = getattr(settings, 'REPLICA_RETRY_SECONDS', 30)
+        with self._lock:
+            self._down_until[alias] = time.monotonic() + retry
+            self.failovers[alias] = self.failovers.get(alias, 0) + 1
+        # Постоянное соединение (conn_max_age) после сбоя больше не годится
+        connections[alias].close()
+
+    def connection_opened(self, alias):
+        self._count(self.connections, alias)
+
+    def _count(self, counter, alias):
+        with self._lock:
+            counter[alias] = counter.get(alias, 0) + 1
+
+    def prometheus_lines(self):
+        aliases = [DEFAULT_DB_ALIAS] + self.aliases
+        healthy = set(self.healthy())
+        with self._lock:
+            routed, failovers, opened = dict(self.routed), dict(self.failovers), dict(self.connections)
+        lines = [
+            '# HELP muzrent_db_routed_requests_total Read-only requests routed, by database alias.',
+            '# TYPE muzrent_db_routed_requests_total counter',
+        ]
+        lines += [f'muzrent_db_routed_requests_total{{alias="{_label(a)}"}} {routed.get(a, 0)}' for a in aliases]
+        lines += [
+            '# HELP muzrent_db_connections_opened_total New database connections, by alias.',
+            '# TYPE muzrent_db_connections_opened_total counter',
+        ]
+        lines += [f'muzrent_db_connections_opened_total{{alias="{_label(a)}"}} {opened.get(a, 0)}' for a in aliases]
+        lines += [
+            '# HELP muzrent_db_replica_failovers_total Requests retried on the primary after a replica error.',
+            '# TYPE muzrent_db_replica_failovers_total counter',
+        ]
+        lines += [f'muzrent_db_replica_failovers_total{{alias="{_label(a)}"}} {failovers.get(a, 0)}' for a in self.aliases]
+        lines += [
+            '# HELP muzrent_db_replica_healthy Whether the replica is currently used for reads.',
+            '# TYPE muzrent_db_replica_healthy gauge',
+        ]
+        lines += [f'muzrent_db_replica_healthy{{alias="{_label(a)}"}} {int(a in healthy)}' for a in self.aliases]
+        return lines
+
+
+replica_pool = ReplicaPool()
+registry.register_collector(replica_pool.prometheus_lines)
+
+
+def _on_connection_created(sender, connection, **kwargs):
+    replica_pool.connection_opened(connection.alias)
+
+
+connection_created.connect(_on_connection_created, dispatch_uid='replica_pool_connections')
+
+
+class ReplicaRouter:
+    """Чтения — туда, куда указал @replica_reads; запись и миграции — только default."""
+
+    def db_for_read(self, model, **hints):
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики — копии default, объекты с них можно связывать между собой
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+def read_alias():
+    """Куда сейчас идут чтения (None — основная база). Для потоков, которые читают после выхода из вьюхи."""
+    return _read_alias.get()
+
+
+def _read_target(request):
+    if not replica_pool.aliases or request.method not in SAFE_METHODS or PIN_COOKIE in request.COOKIES:
+        return None
+    return replica_pool.choose()
+
+
+def replica_reads(view):
+    """Отправляет чтения вьюхи на реплику (только GET/HEAD и без свежей записи клиента)."""
+    if iscoroutinefunction(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            alias = _read_target(request)
+            if alias in (None, DEFAULT_DB_ALIAS):
+                return await view(request, *args, **kwargs)
+            token = _read_alias.set(alias)
+            try:
+                return await view(request, *args, **kwargs)
+            except (OperationalError, InterfaceError):
+                # Соединение живет в потоке, где async ORM выполняет запросы
+                await sync_to_async(replica_pool.mark_down)(alias)
+            finally:
+                _read_alias.reset(token)
+            return await view(request, *args, **kwargs)
+    else:
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            alias = _read_target(request)
+            if alias in (None, DEFAULT_DB_ALIAS):
+                return view(request, *args, **kwargs)
+            token = _read_alias.set(alias)
+            try:
+                return view(request, *args, **kwargs)
+            except (OperationalError, InterfaceError):
+                replica_pool.mark_down(alias)
+            finally:
+                _read_alias.reset(token)
+            return view(request, *args, **kwargs)
+    return wrapper
@@ -0,0 +1,82 @@
+"""
+Аренды пользователя для личного кабинета.
+
+Активные аренды показываются целиком (их немного), завершенные — страницами
+по курсору (created_at, id), новые сверху, без OFFSET. Оплаченная сумма
+считается подзапросом прямо в выборке, платежи в память не грузятся.
+Перенесенные в архив аренды (archive.py) подмешиваются в ту же ленту.
+"""
+import datetime
+
+from django.db.models import OuterRef, Q
+from django.db.models.functions import Coalesce
+
+from .models import ArchivedPayment, ArchivedRental, Rental
+from .pricing import ZERO, paid_subquery
+
+HISTORY_PAGE_SIZE = 20
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def encode_cursor(created_at, rental_id):
+    micros = (created_at - _EPOCH) // datetime.timedelta(microseconds=1)
+    return f"{micros}_{rental_id}"
+
+
+def decode_cursor(raw):
+    """'<микросекунды>_<id>' -> (datetime, id) или None, если курсор битый."""
+    micros, _, rental_id = (raw or '').partition('_')
+    if not micros.isdigit() or not rental_id.isdigit():
+        return None
+    return _EPOCH + datetime.timedelta(microseconds=int(micros)), int(rental_id)
+
+
+def _with_paid(rentals, payments=None):
+    return (
+        rentals.select_related('instrument')
+        .annotate(paid=Coalesce(paid_subquery(payments, rental=OuterRef('pk')), ZERO))
+        .order_by('-created_at', '-id')
+    )
+
+
+def active_rentals(user):
+    return _with_paid(Rental.objects.filter(user=user, is_active=True))
+
+
+def rental_history(user, cursor=None, limit=HISTORY_PAGE_SIZE):
+    """
+    Страница завершенных аренд. Возвращает (аренды, курсор следующей страницы или None).
+    Берем по limit + 1 строк из рабочей таблицы и из архива и сливаем их:
+    id у архива прежние, так что порядок (created_at, id) общий.
+    """
+    live = Rental.objects.filter(user=user, is_active=False)
+    archived = ArchivedRental.objects.filter(user=user)
+    if cursor is not None:
+        created_at, rental_id = cursor
+        after = Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=rental_id)
+        live, archived = live.filter(after), archived.filter(after)
+
+    page = list(_with_paid(live)[:limit + 1]) + list(_with_paid(archived, ArchivedPayment)[:limit + 1])
+    page.sort(key=lambda r: (r.created_at, r.id), reverse=True)
+    next_cursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        next_cursor = encode_cursor(page[-1].created_at, page[-1].id)
+    return page, next_cursor
+
+
+def rental_row(rental):
+    """Аренда в виде словаря для JSON."""
+    return {
+        'id': rental.id,
+        'instrument': {'id': rental.instrument_id, 'name': rental.instrument.name},
+        'start_date': rental.start_date,
+        'end_date': rental.end_date,
+        'returned_at': rental.returned_at,
+        'is_active': rental.is_active,
+        'archived': isinstance(rental, ArchivedRental),
+        'created_at': rental.created_at,
+        'total_price': rental.total_price,
+        'paid': rental.paid,
+        'outstanding': rental.total_price - rental.paid,
+    }
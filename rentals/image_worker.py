@@ -0,0 +1,60 @@
+"""
+Генерация уменьшенных копий картинок в отдельном процессе.
+
+Модуль намеренно не импортирует Django: его функции выполняются
+в ProcessPoolExecutor со spawn-процессами, которым не нужна настройка проекта.
+"""
+import hashlib
+import os
+
+from PIL import Image, ImageOps
+
+VARIANTS_DIR = 'variants'
+
+# формат -> (имя для Pillow, расширение, параметры сохранения)
+FORMATS = {
+    'webp': ('WEBP', 'webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+
+def render_variants(media_root, source_name, sizes, overwrite=False):
+    """
+    Делает копии source_name (путь относительно media_root) для каждого
+    размера из sizes ({'thumb': 320, ...}) во всех форматах.
+    Имя файла содержит хэш исходника, поэтому его можно кэшировать навсегда;
+    готовые копии пропускаются, overwrite=True пересоздает их (например,
+    после смены параметров сжатия).
+    Возвращает {'source': source_name, 'thumb': {'webp': путь, 'jpeg': путь}, ...}.
+    """
+    source_path = os.path.join(media_root, source_name)
+    with open(source_path, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()[:16]
+
+    os.makedirs(os.path.join(media_root, VARIANTS_DIR), exist_ok=True)
+    result = {'source': source_name}
+    with Image.open(source_path) as original:
+        image = ImageOps.exif_transpose(original)
+        if image.mode in ('RGBA', 'LA', 'P'):
+            # У JPEG нет прозрачности — подкладываем белый фон
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, 'white')
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        elif image.mode != 'RGB':
+            image = image.convert('RGB')
+
+        for size_name, width in sizes.items():
+            resized = image.copy()
+            resized.thumbnail((width, width), Image.Resampling.LANCZOS)
+            result[size_name] = {}
+            for fmt, (pil_format, ext, params) in FORMATS.items():
+                name = f'{VARIANTS_DIR}/{digest}_{size_name}_{width}.{ext}'
+                path = os.path.join(media_root, name)
+                if overwrite or not os.path.exists(path):
+                    # Пишем во временный файл и переименовываем атомарно
+                    tmp_path = f'{path}.{os.getpid()}.tmp'
+                    resized.save(tmp_path, pil_format, **params)
+                    os.replace(tmp_path, path)
+                result[size_name][fmt] = name
+    return result
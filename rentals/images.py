@@ -0,0 +1,66 @@
+"""
+Уменьшенные копии фото инструментов и аватаров.
+
+При загрузке картинки сигнал ставит задачу в пул процессов, результат
+(пути к копиям) сохраняется в поле variants модели. Пока копий нет,
+шаблоны показывают оригинал (см. templatetags/media_tags.py).
+"""
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from .image_worker import render_variants
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=settings.IMAGE_VARIANT_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+        return _pool
+
+
+def needs_variants(instance):
+    image = getattr(instance, instance.variant_source_field)
+    return bool(image) and (instance.variants or {}).get('source') != image.name
+
+
+def schedule_variants(instance):
+    """Ставит генерацию копий после коммита (файл к этому моменту уже сохранен)."""
+    model = type(instance)
+    pk = instance.pk
+    source_name = getattr(instance, instance.variant_source_field).name
+
+    def submit():
+        future = get_pool().submit(
+            render_variants, str(settings.MEDIA_ROOT), source_name, model.VARIANT_SIZES
+        )
+        future.add_done_callback(lambda f: _store_variants(model, pk, source_name, f))
+
+    transaction.on_commit(submit)
+
+
+def _store_variants(model, pk, source_name, future):
+    # Колбэк выполняется в служебном потоке пула — со своим соединением к БД
+    try:
+        variants = future.result()
+    except Exception:
+        logger.exception("Не удалось сделать копии для %s #%s", model.__name__, pk)
+        return
+    try:
+        # Если картинку успели заменить, старый результат не записываем
+        model.objects.filter(pk=pk, **{model.variant_source_field: source_name}).update(variants=variants)
+    finally:
+        close_old_connections()
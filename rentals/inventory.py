@@ -0,0 +1,216 @@
+"""
+Массовый импорт и экспорт каталога (инструменты, бренды, категории, филиалы)
+в CSV и JSONL.
+
+Файл читается и пишется построчно, поэтому память не зависит от его размера.
+Инструменты при импорте сопоставляются по inventory_number: новые создаются,
+существующие обновляются пачками через bulk_create(update_conflicts=True).
+Бренды, категории и филиалы ищутся по названию (категории — по slug) в
+словарях в памяти и создаются, если их еще нет. Статус из файла ставится
+только новым инструментам: у существующих его ведут бронь, возврат и ТО
+(повторный импорт не должен "освобождать" выданный инструмент).
+"""
+import csv
+import json
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.utils.text import slugify
+
+from .caching import invalidate_model, invalidate_objects
+from .models import Brand, Category, Instrument, Location
+
+FORMATS = ('csv', 'jsonl')
+
+# Поля экспорта/импорта по видам данных
+KIND_FIELDS = {
+    'instruments': [
+        'inventory_number', 'name', 'description', 'price_per_day', 'status',
+        'category', 'category_slug', 'brand', 'brand_country', 'location',
+    ],
+    'brands': ['name', 'country'],
+    'categories': ['slug', 'name'],
+    'locations': ['name', 'address', 'phone'],
+}
+KIND_MODELS = {'instruments': Instrument, 'brands': Brand, 'categories': Category, 'locations': Location}
+# Поле, по которому справочник ищется при импорте
+KIND_KEYS = {'instruments': 'inventory_number', 'brands': 'name', 'categories': 'slug', 'locations': 'name'}
+
+STATUSES = {code for code, _ in Instrument.STATUS_CHOICES}
+
+
+class RowError(ValueError):
+    pass
+
+
+# --- ЧТЕНИЕ/ЗАПИСЬ ---
+def read_rows(f, fmt):
+    """Построчно отдает (номер строки, словарь) из открытого файла."""
+    if fmt == 'csv':
+        for line_no, row in enumerate(csv.DictReader(f), start=2):
+            yield line_no, row
+    else:
+        for line_no, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield line_no, row if isinstance(row, dict) else {'_raw': line.rstrip('\n')}
+
+
+class RowWriter:
+    def __init__(self, f, fmt, fields):
+        self.f, self.fmt, self.fields = f, fmt, fields
+        if fmt == 'csv':
+            self.csv = csv.DictWriter(f, fieldnames=fields, extrasaction='ignore')
+            self.csv.writeheader()
+
+    def write(self, row):
+        if self.fmt == 'csv':
+            self.csv.writerow(row)
+        else:
+            self.f.write(json.dumps({k: row.get(k) for k in self.fields}, ensure_ascii=False, default=str) + '\n')
+
+
+# --- ЭКСПОРТ ---
+def export_rows(kind, chunk_size=2000):
+    """Строки для экспорта. .iterator() не держит всю таблицу в памяти."""
+    if kind != 'instruments':
+        model = KIND_MODELS[kind]
+        yield from model.objects.order_by('id').values(*KIND_FIELDS[kind]).iterator(chunk_size=chunk_size)
+        return
+
+    rows = Instrument.objects.order_by('id').values(
+        'inventory_number', 'name', 'description', 'price_per_day', 'status',
+        'category__name', 'category__slug', 'brand__name', 'brand__country', 'location__name',
+    )
+    for row in rows.iterator(chunk_size=chunk_size):
+        yield {
+            'inventory_number': row['inventory_number'], 'name': row['name'],
+            'description': row['description'], 'price_per_day': row['price_per_day'], 'status': row['status'],
+            'category': row['category__name'], 'category_slug': row['category__slug'],
+            'brand': row['brand__name'], 'brand_country': row['brand__country'],
+            'location': row['location__name'],
+        }
+
+
+# --- ИМПОРТ ---
+class References:
+    """Словари "название -> id" для брендов, категорий и филиалов; недостающие создаются."""
+
+    def __init__(self):
+        self.brands = {name.casefold(): pk for pk, name in Brand.objects.values_list('id', 'name')}
+        self.categories = dict(Category.objects.values_list('slug', 'id'))
+        self.locations = {name.casefold(): pk for pk, name in Location.objects.values_list('id', 'name')}
+        self.created = 0
+
+    def brand(self, name, country=''):
+        if not name:
+            return None
+        key = name.casefold()
+        if key not in self.brands:
+            self.brands[key] = Brand.objects.create(name=name, country=country or '').id
+            self.created += 1
+        return self.brands[key]
+
+    def category(self, name, slug=''):
+        if not name and not slug:
+            return None
+        slug = slug or slugify(name, allow_unicode=True)
+        if not slug:
+            raise RowError(f"не удалось получить slug категории из '{name}'")
+        if slug not in self.categories:
+            self.categories[slug] = Category.objects.create(name=name or slug, slug=slug).id
+            self.created += 1
+        return self.categories[slug]
+
+    def location(self, name):
+        if not name:
+            return None
+        key = name.casefold()
+        if key not in self.locations:
+            # Адрес и телефон заполнит администратор (или импорт locations)
+            self.locations[key] = Location.objects.create(name=name, address='', phone='').id
+            self.created += 1
+        return self.locations[key]
+
+
+def _clean(row, field):
+    value = row.get(field)
+    return value.strip() if isinstance(value, str) else value
+
+
+def parse_instrument(row, refs):
+    inventory_number = _clean(row, 'inventory_number')
+    name = _clean(row, 'name')
+    if not inventory_number:
+        raise RowError("пустой inventory_number")
+    if not name:
+        raise RowError("пустое название")
+    try:
+        price = Decimal(str(_clean(row, 'price_per_day')))
+    except InvalidOperation:
+        raise RowError("некорректная цена")
+    if not price.is_finite() or price < 0:
+        raise RowError("некорректная цена")
+    status = _clean(row, 'status') or 'available'
+    if status not in STATUSES:
+        raise RowError(f"неизвестный статус '{status}'")
+
+    return Instrument(
+        inventory_number=inventory_number[:50], name=name[:100],
+        description=_clean(row, 'description') or '', price_per_day=price, status=status,
+        category_id=refs.category(_clean(row, 'category'), _clean(row, 'category_slug')),
+        brand_id=refs.brand(_clean(row, 'brand'), _clean(row, 'brand_country')),
+        location_id=refs.location(_clean(row, 'location')),
+    )
+
+
+# Без status: он берется из файла только при вставке
+INSTRUMENT_UPDATE_FIELDS = [
+    'name', 'description', 'price_per_day', 'category', 'brand', 'location', 'updated_at',
+]
+
+
+def upsert_instruments(objs):
+    """Одна пачка: вставка новых и обновление существующих по inventory_number."""
+    # Повтор номера в одной пачке ломает ON CONFLICT — оставляем последнюю строку
+    unique = list({obj.inventory_number: obj for obj in objs}.values())
+    with transaction.atomic():
+        Instrument.objects.bulk_create(
+            unique, update_conflicts=True,
+            unique_fields=['inventory_number'], update_fields=INSTRUMENT_UPDATE_FIELDS,
+        )
+        # bulk_create не шлет сигналы, а id обновленных строк неизвестны
+        invalidate_model(Instrument)
+    return len(unique)
+
+
+def parse_reference(kind, row):
+    """Строка справочника -> словарь полей (ключевое поле обязательно)."""
+    key = KIND_KEYS[kind]
+    data = {field: str(_clean(row, field) or '') for field in KIND_FIELDS[kind]}
+    if not data[key]:
+        raise RowError(f"пустое поле {key}")
+    return data
+
+
+def upsert_references(kind, items):
+    """Пачка справочника: создаем отсутствующие, обновляем поля у найденных."""
+    model, key = KIND_MODELS[kind], KIND_KEYS[kind]
+    fields = [field for field in KIND_FIELDS[kind] if field != key]
+    items = {item[key]: item for item in items}
+
+    with transaction.atomic():
+        existing = {getattr(obj, key): obj for obj in model.objects.filter(**{f'{key}__in': list(items)})}
+        for value, obj in existing.items():
+            for field in fields:
+                setattr(obj, field, items[value][field])
+        if existing:
+            model.objects.bulk_update(list(existing.values()), fields)
+            invalidate_objects(model, [obj.pk for obj in existing.values()])
+            invalidate_model(Instrument)
+        model.objects.bulk_create([model(**item) for value, item in items.items() if value not in existing])
+    return len(items)
@@ -0,0 +1,261 @@
+"""
+Фоновые задачи без внешнего брокера: очередь лежит в таблице Job,
+выполняет ее команда run_worker (можно запустить несколько воркеров).
+
+Задача — обычная функция, зарегистрированная декоратором @job. Периодические
+задачи (every=секунды) воркер сам ставит в очередь; уникальный ключ не дает
+появиться двум живым копиям одной периодической задачи. Массовые задачи
+работают пачками: тысячи строк на транзакцию, а не save() на каждую.
+"""
+import datetime
+import logging
+import os
+import socket
+import threading
+import traceback
+from contextlib import contextmanager
+
+from django.core.mail import mail_admins
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F, Max, Q
+from django.utils import timezone
+
+from .availability import overlapping_rentals
+from .caching import invalidate_objects
+from .models import Instrument, Job, Rental
+from .pricing import recompute_totals
+from .recommendations import refresh_recommendations
+from .rollups import compact_window
+from .status_feed import publish_on_commit
+from .stock import rebuild_stock, record_status_change
+
+logger = logging.getLogger(__name__)
+
+# Сколько строк обрабатывать в одной транзакции
+BATCH_SIZE = 2000
+MAX_ATTEMPTS = 3
+RETRY_DELAY = datetime.timedelta(minutes=5)
+# Пока задача выполняется, воркер раз в HEARTBEAT_EVERY отмечает heartbeat_at;
+# running без отметки дольше STALE_AFTER — воркер умер (долгая задача живет)
+HEARTBEAT_EVERY = datetime.timedelta(minutes=1)
+STALE_AFTER = datetime.timedelta(minutes=10)
+KEEP_FINISHED = datetime.timedelta(days=7)
+# Инструмент без ТО дольше стольких дней попадает в напоминание
+MAINTENANCE_INTERVAL_DAYS = 180
+
+registry = {}
+periodic = {}
+
+
+def job(name, every=None):
+    """Регистрирует функцию как задачу; every — период в секундах."""
+    def decorator(func):
+        registry[name] = func
+        if every:
+            periodic[name] = datetime.timedelta(seconds=every)
+        return func
+    return decorator
+
+
+def enqueue(name, payload=None, run_at=None, unique_key=None):
+    """Ставит задачу в очередь. С unique_key вернет None, если такая уже ждет."""
+    if name not in registry:
+        raise ValueError(f"Неизвестная задача: {name}")
+    try:
+        with transaction.atomic():
+            return Job.objects.create(
+                name=name, payload=payload or {}, run_at=run_at or timezone.now(), unique_key=unique_key,
+            )
+    except IntegrityError:
+        return None
+
+
+# --- ВОРКЕР ---
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def schedule_periodic():
+    """Ставит в очередь периодические задачи, у которых нет живой копии."""
+    now = timezone.now()
+    live = set(
+        Job.objects.filter(unique_key__in=list(periodic), status__in=['queued', 'running'])
+        .values_list('unique_key', flat=True)
+    )
+    last_runs = dict(
+        Job.objects.filter(name__in=list(periodic), status__in=['done', 'failed'])
+        .values('name').annotate(last=Max('finished_at')).values_list('name', 'last')
+    )
+    for name, every in periodic.items():
+        if name in live:
+            continue
+        last = last_runs.get(name)
+        enqueue(name, run_at=max(now, last + every) if last else now, unique_key=name)
+
+
+def requeue_stale():
+    """Возвращает в очередь задачи, зависшие в running (воркер упал и перестал отмечаться)."""
+    return Job.objects.filter(status='running', heartbeat_at__lt=timezone.now() - STALE_AFTER).update(
+        status='queued', worker='', run_at=timezone.now(),
+    )
+
+
+def claim(worker, limit=1):
+    """Забирает до limit готовых к запуску задач. Разные воркеры получают разные."""
+    now = timezone.now()
+    with transaction.atomic():
+        candidates = Job.objects.filter(status='queued', run_at__lte=now).order_by('run_at', 'id')
+        if connection.features.has_select_for_update_skip_locked:
+            candidates = candidates.select_for_update(skip_locked=True)
+        ids = list(candidates.values_list('id', flat=True)[:limit])
+        claimed = []
+        for job_id in ids:
+            # Условный UPDATE: на SQLite нет SKIP LOCKED, выигрывает кто первый
+            if Job.objects.filter(id=job_id, status='queued').update(
+                status='running', worker=worker, started_at=now, heartbeat_at=now, attempts=F('attempts') + 1,
+            ):
+                claimed.append(job_id)
+    return list(Job.objects.filter(id__in=claimed).order_by('run_at', 'id'))
+
+
+@contextmanager
+def heartbeat(job_id, every=HEARTBEAT_EVERY):
+    """Пока выполняется тело with, отдельный поток раз в every отмечает задачу живой."""
+    stop = threading.Event()
+
+    def beat():
+        try:
+            while not stop.wait(every.total_seconds()):
+                try:
+                    Job.objects.filter(id=job_id, status='running').update(heartbeat_at=timezone.now())
+                except Exception:
+                    logger.exception("Не удалось отметить задачу #%s", job_id)
+        finally:
+            connection.close()  # у потока свое соединение
+
+    thread = threading.Thread(target=beat, name=f'job-{job_id}-heartbeat', daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def run(job_obj):
+    handler = registry.get(job_obj.name)
+    try:
+        if handler is None:
+            raise LookupError(f"Задача {job_obj.name} не зарегистрирована")
+        with heartbeat(job_obj.id):
+            result = handler(**job_obj.payload)
+    except Exception:
+        error = traceback.format_exc()
+        logger.exception("Задача %s #%s упала", job_obj.name, job_obj.id)
+        retry = job_obj.attempts < MAX_ATTEMPTS and handler is not None
+        Job.objects.filter(id=job_obj.id).update(
+            status='queued' if retry else 'failed', last_error=error[-5000:],
+            run_at=timezone.now() + RETRY_DELAY * job_obj.attempts,
+            finished_at=None if retry else timezone.now(),
+        )
+        return False
+    Job.objects.filter(id=job_obj.id).update(status='done', result=result, finished_at=timezone.now())
+    return True
+
+
+# --- ЗАДАЧИ ---
+@job('overdue_sweep', every=60 * 60)
+def overdue_sweep():
+    """
+    Помечает активные аренды с прошедшим end_date как просроченные и
+    пересчитывает их стоимость (штраф растет каждые сутки просрочки).
+    """
+    today = datetime.date.today()
+    overdue = Rental.objects.filter(is_active=True, end_date__lt=today)
+
+    flagged = 0
+    ids = overdue.filter(is_overdue=False).order_by('id').values_list('id', flat=True)
+    while True:
+        chunk = list(ids[:BATCH_SIZE])
+        if not chunk:
+            break
+        with transaction.atomic():
+            flagged += Rental.objects.filter(id__in=chunk).update(is_overdue=True)
+
+    checked, charged = recompute_totals(BATCH_SIZE, today=today, rentals=overdue)
+    return {'flagged': flagged, 'checked': checked, 'charged': charged}
+
+
+@job('start_due_rentals', every=15 * 60)
+def start_due_rentals():
+    """Будущие брони, чей день настал: инструмент переводим в статус rented."""
+    today = datetime.date.today()
+    due = Instrument.objects.filter(
+        status='available', id__in=overlapping_rentals(today, today).values('instrument_id'),
+    ).order_by('id').values_list('id', flat=True)
+
+    started = 0
+    while True:
+        chunk = list(due[:BATCH_SIZE])
+        if not chunk:
+            break
+        with transaction.atomic():
+            # Перечитываем под блокировкой: статус мог смениться, пока выбирали
+            ids = list(
+                Instrument.objects.select_for_update()
+                .filter(id__in=chunk, status='available').values_list('id', flat=True)
+            )
+            record_status_change(ids, 'rented')
+            started += Instrument.objects.filter(id__in=ids).update(status='rented', updated_at=timezone.now())
+            invalidate_objects(Instrument, ids)
+            publish_on_commit({inst_id: 'rented' for inst_id in ids})
+    return {'started': started}
+
+
+@job('maintenance_reminders', every=24 * 60 * 60)
+def maintenance_reminders(interval_days=MAINTENANCE_INTERVAL_DAYS):
+    """Письмо администраторам со списком инструментов, которым пора на ТО."""
+    cutoff = datetime.date.today() - datetime.timedelta(days=interval_days)
+    due = (
+        Instrument.objects.exclude(status='maintenance')
+        .annotate(last_service=Max('maintenance__date'))
+        .filter(Q(last_service__lt=cutoff) | Q(last_service__isnull=True))
+        .order_by('location__name', 'inventory_number')
+        .values_list('location__name', 'inventory_number', 'name', 'last_service')
+    )
+    lines = []
+    for location, number, name, last_service in due.iterator(chunk_size=BATCH_SIZE):
+        lines.append(f"{location or '-'}: {number} {name} — последнее ТО {last_service or 'никогда'}")
+    if lines:
+        mail_admins(
+            f"Пора на ТО: {len(lines)} инструментов",
+            "\n".join(lines),
+        )
+    return {'due': len(lines)}
+
+
+@job('refresh_rollups', every=60 * 60)
+def refresh_rollups(days=2):
+    """Пересобирает дневные сводки за последние дни (флаг загрузки, дрейф счетчиков)."""
+    end = datetime.date.today()
+    return {'rows': compact_window(end - datetime.timedelta(days=days - 1), end)}
+
+
+@job('refresh_recommendations', every=60 * 60)
+def refresh_recommendations_job(full=False):
+    """Дописывает рекомендации по новым арендам и отзывам (полный пересчет — full=True)."""
+    return refresh_recommendations(full=full)
+
+
+@job('rebuild_stock', every=24 * 60 * 60)
+def rebuild_stock_job():
+    """Пересчитывает остатки по филиалам с нуля (исправляет дрейф счетчиков)."""
+    return {'rows': rebuild_stock()}
+
+
+@job('cleanup_jobs', every=24 * 60 * 60)
+def cleanup_jobs():
+    deleted, _ = Job.objects.filter(
+        status__in=['done', 'failed'], finished_at__lt=timezone.now() - KEEP_FINISHED,
+    ).delete()
+    return {'deleted': deleted}
@@ -0,0 +1,36 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from rentals.archive import archive_candidates, archive_rentals
+
+
+class Command(BaseCommand):
+    help = "Переносит старые закрытые аренды и их платежи в архивные таблицы"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=int, default=settings.ARCHIVE_AFTER_DAYS,
+                            help="Возраст (по дате возврата), старше которого аренда уходит в архив")
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--max-batches', type=int, help="Остановиться после N пачек")
+        parser.add_argument('--pause', type=float, default=0,
+                            help="Пауза между пачками в секундах, чтобы не мешать рабочей нагрузке")
+        parser.add_argument('--dry-run', action='store_true', help="Только посчитать, сколько уйдет в архив")
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            count = archive_candidates(options['older_than_days']).count()
+            self.stdout.write(f"К архивации: {count} аренд")
+            return
+
+        rentals_total = payments_total = 0
+        for rentals, payments in archive_rentals(
+            options['older_than_days'], options['batch_size'], options['max_batches'],
+        ):
+            rentals_total += rentals
+            payments_total += payments
+            self.stdout.write(f"  перенесено аренд: {rentals_total}, платежей: {payments_total}")
+            if options['pause']:
+                time.sleep(options['pause'])
+        self.stdout.write(self.style.SUCCESS(f"Готово: аренд {rentals_total}, платежей {payments_total}"))
@@ -0,0 +1,355 @@
+"""
+Нагрузочный тест бронирования.
+
+Поднимает отдельную тестовую БД (ту же СУБД, что в DATABASE_URL: SQLite или
+локальный PostgreSQL), заполняет ее инструментами и пользователями и гоняет
+конкурентный поток бронирований/отмен/опроса статусов прямо в процессе
+через ASGI- и WSGI-приложения проекта. Результат пишется в JSON, чтобы
+сравнивать релизы между собой.
+
+    python manage.py bench_booking --requests 2000 --concurrency 32 --output bench.json
+"""
+import asyncio
+import datetime
+import io
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+from wsgiref.util import setup_testing_defaults
+
+import django
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.db.backends.signals import connection_created
+from django.test import Client, override_settings
+from django.utils.crypto import get_random_string
+
+from rentals.caching import invalidate_model
+from rentals.stock import rebuild_stock
+from rentals.models import Category, Brand, Location, Instrument, Rental
+
+CSRF_TOKEN = get_random_string(32)
+
+
+class QueryTimer:
+    """Считает время запросов SELECT ... FOR UPDATE (ожидание блокировки строки)."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.lock_wait = 0.0
+        self.lock_queries = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        if 'FOR UPDATE' not in sql:
+            return execute(sql, params, many, context)
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            with self.lock:
+                self.lock_wait += time.perf_counter() - started
+                self.lock_queries += 1
+
+    def install(self, sender=None, connection=None, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, round(pct / 100 * (len(sorted_values) - 1)))
+    return round(sorted_values[index] * 1000, 2)
+
+
+class Command(BaseCommand):
+    help = "Нагрузочный тест бронирования (ASGI/WSGI в процессе), результат в JSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--instruments', type=int, default=50, help="Сколько инструментов создать")
+        parser.add_argument('--hot', type=int, default=3, help="Сколько из них 'популярных'")
+        parser.add_argument('--hot-share', type=float, default=0.8, help="Доля бронирований популярных")
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--requests', type=int, default=1000, help="Запросов на каждое приложение")
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument('--mix', default='book=0.4,cancel=0.2,status=0.4',
+                            help="Доли операций: book, cancel, status")
+        parser.add_argument('--app', choices=['asgi', 'wsgi', 'both'], default='both')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--output', help="Куда сохранить результат (JSON)")
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.mix = self.parse_mix(options['mix'])
+        apps = ['asgi', 'wsgi'] if options['app'] == 'both' else [options['app']]
+
+        # Отдельная БД, чтобы не трогать рабочие данные. SQLite держим в файле:
+        # общий in-memory кэш плохо переносит конкурентные записи из потоков
+        db = settings.DATABASES['default']
+        if connection.vendor == 'sqlite':
+            db.setdefault('TEST', {})['NAME'] = str(settings.BASE_DIR / f'bench_{os.getpid()}.sqlite3')
+        original_name = db['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+
+        timer = QueryTimer()
+        connection_created.connect(timer.install)
+        # Импорт приложений заново настраивает логирование, поэтому делаем его заранее
+        from config.asgi import application as asgi_app
+        from config.wsgi import application as wsgi_app
+        self.apps = {'asgi': asgi_app, 'wsgi': wsgi_app}
+
+        # 500-е считаем в статистике, трейсбеки в консоль не нужны
+        request_logger = logging.getLogger('django.request')
+        log_level = request_logger.level
+        request_logger.setLevel(logging.CRITICAL)
+        # Бенчмарк меряет конкуренцию за блокировки, а не ограничитель частоты:
+        # с лимитами большая часть броней отбивалась бы 429 до транзакции
+        limits = override_settings(BOOKING_RATE_LIMITS={})
+        limits.enable()
+        try:
+            self.seed()
+            runs = {}
+            for app in apps:
+                self.reset()
+                runs[app] = self.run_app(app, timer)
+                self.print_run(app, runs[app])
+        finally:
+            limits.disable()
+            request_logger.setLevel(log_level)
+            connection_created.disconnect(timer.install)
+            connections.close_all()
+            connection.creation.destroy_test_db(original_name, verbosity=0)
+
+        result = {
+            'meta': {
+                'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                'vendor': connection.vendor,
+                'django': django.get_version(),
+                'python': platform.python_version(),
+                'options': {k: v for k, v in options.items() if k in (
+                    'instruments', 'hot', 'hot_share', 'users', 'requests', 'concurrency', 'mix', 'seed')},
+            },
+            'runs': runs,
+        }
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(result, f, ensure_ascii=False, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Результат сохранен в {options['output']}"))
+
+    # --- подготовка данных ---
+
+    def parse_mix(self, raw):
+        mix = {}
+        for part in raw.split(','):
+            name, _, share = part.partition('=')
+            if name not in ('book', 'cancel', 'status'):
+                raise CommandError(f"Неизвестная операция в --mix: {name}")
+            mix[name] = float(share)
+        return mix
+
+    def seed(self):
+        category = Category.objects.create(name="Бенчмарк", slug="bench")
+        brand = Brand.objects.create(name="Bench")
+        location = Location.objects.create(name="Склад", address="-", phone="-")
+        Instrument.objects.bulk_create([
+            Instrument(name=f"Инструмент {i}", category=category, brand=brand, location=location,
+                       price_per_day=100, inventory_number=f"BENCH-{i:06d}")
+            for i in range(self.options['instruments'])
+        ])
+        self.instrument_ids = list(Instrument.objects.order_by('id').values_list('id', flat=True))
+        self.hot_ids = self.instrument_ids[:self.options['hot']]
+
+        User.objects.bulk_create([User(username=f"bench_{i}") for i in range(self.options['users'])])
+        # Заранее логиним всех, чтобы сессии не создавались во время замера
+        self.sessions = {}
+        for user in User.objects.filter(username__startswith='bench_'):
+            client = Client()
+            client.force_login(user)
+            self.sessions[user.id] = client.cookies[settings.SESSION_COOKIE_NAME].value
+
+    def reset(self):
+        Rental.objects.all().delete()
+        Instrument.objects.update(status='available')
+        invalidate_model(Instrument)
+        rebuild_stock()
+
+    def pick_operation(self, rng):
+        op = rng.choices(list(self.mix), weights=list(self.mix.values()))[0]
+        user_id = rng.choice(list(self.sessions))
+        if op == 'book':
+            pool = self.hot_ids if rng.random() < self.options['hot_share'] else self.instrument_ids
+            return op, user_id, rng.choice(pool)
+        if op == 'status':
+            start = rng.randrange(max(1, len(self.instrument_ids) - 24))
+            return op, user_id, self.instrument_ids[start:start + 24]
+        return op, user_id, None
+
+    def build_request(self, op, user_id, arg):
+        """Возвращает (method, path, query, body) для операции."""
+        if op == 'book':
+            return 'POST', '/api/book/', '', urlencode({'id': arg}).encode()
+        if op == 'status':
+            return 'GET', '/api/status/', urlencode({'ids': ','.join(map(str, arg))}), b''
+        rental_id = (Rental.objects.filter(user_id=user_id, is_active=True)
+                     .values_list('id', flat=True).first())
+        if rental_id is None:
+            return None
+        return 'POST', f'/rental/cancel/{rental_id}/', '', b''
+
+    def headers(self, user_id, body):
+        return {
+            'cookie': f"{settings.SESSION_COOKIE_NAME}={self.sessions[user_id]}; "
+                      f"{settings.CSRF_COOKIE_NAME}={CSRF_TOKEN}",
+            'x-csrftoken': CSRF_TOKEN,
+            'content-type': 'application/x-www-form-urlencoded',
+            'content-length': str(len(body)),
+        }
+
+    # --- прогон ---
+
+    def run_app(self, app, timer):
+        timer.lock_wait, timer.lock_queries = 0.0, 0
+        timer.install(connection=connection)
+        rng = random.Random(self.options['seed'])
+        plan = [self.pick_operation(rng) for _ in range(self.options['requests'])]
+        samples = defaultdict(list)
+        codes = defaultdict(int)
+
+        started = time.perf_counter()
+        if app == 'asgi':
+            asyncio.run(self.run_asgi(plan, samples, codes))
+        else:
+            self.run_wsgi(plan, samples, codes)
+        wall = time.perf_counter() - started
+
+        all_samples = sorted(x for values in samples.values() for x in values)
+        return {
+            'requests': len(all_samples),
+            'wall_seconds': round(wall, 3),
+            'throughput_rps': round(len(all_samples) / wall, 1) if wall else None,
+            'latency_ms': self.latency(all_samples),
+            'by_operation': {op: self.latency(sorted(values)) for op, values in samples.items()},
+            'status_codes': dict(codes),
+            'server_errors': sum(n for code, n in codes.items() if code >= 500),
+            # На SQLite нет SELECT ... FOR UPDATE — там ожидание видно по 500 "database is locked"
+            'lock_wait_ms': (round(timer.lock_wait * 1000, 2)
+                             if connection.features.has_select_for_update else None),
+            'lock_queries': timer.lock_queries,
+            'double_bookings': self.count_double_bookings(),
+        }
+
+    def latency(self, values):
+        return {
+            'count': len(values),
+            'mean': round(statistics.fmean(values) * 1000, 2) if values else None,
+            'p50': percentile(values, 50),
+            'p95': percentile(values, 95),
+            'p99': percentile(values, 99),
+        }
+
+    def run_wsgi(self, plan, samples, codes):
+        application = self.apps['wsgi']
+
+        def call(item):
+            op, user_id, arg = item
+            request = self.build_request(op, user_id, arg)
+            if request is None:
+                return
+            method, path, query, body = request
+            environ = {}
+            setup_testing_defaults(environ)
+            environ.update({
+                'REQUEST_METHOD': method, 'PATH_INFO': path, 'QUERY_STRING': query,
+                'wsgi.input': io.BytesIO(body),
+            })
+            for name, value in self.headers(user_id, body).items():
+                key = name.upper().replace('-', '_')
+                environ[key if key in ('CONTENT_TYPE', 'CONTENT_LENGTH') else f'HTTP_{key}'] = value
+
+            status = []
+            began = time.perf_counter()
+            result = application(environ, lambda s, h, exc_info=None: status.append(int(s[:3])))
+            for _ in result:
+                pass
+            result.close()
+            samples[op].append(time.perf_counter() - began)
+            codes[status[0]] += 1
+
+        with ThreadPoolExecutor(max_workers=self.options['concurrency']) as pool:
+            list(pool.map(call, plan))
+
+    async def run_asgi(self, plan, samples, codes):
+        application = self.apps['asgi']
+
+        semaphore = asyncio.Semaphore(self.options['concurrency'])
+        build = sync_to_async(self.build_request)
+
+        async def call(item):
+            op, user_id, arg = item
+            async with semaphore:
+                request = await build(op, user_id, arg)
+                if request is None:
+                    return
+                method, path, query, body = request
+                scope = {
+                    'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+                    'method': method, 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+                    'query_string': query.encode(), 'root_path': '',
+                    'headers': [(k.encode(), v.encode()) for k, v in self.headers(user_id, body).items()],
+                    'client': ('127.0.0.1', 0), 'server': ('testserver', 80),
+                }
+                body_sent = False
+
+                async def receive():
+                    nonlocal body_sent
+                    if not body_sent:
+                        body_sent = True
+                        return {'type': 'http.request', 'body': body, 'more_body': False}
+                    await asyncio.Event().wait()  # клиент не отключается
+
+                status = []
+
+                async def send(message):
+                    if message['type'] == 'http.response.start':
+                        status.append(message['status'])
+
+                began = time.perf_counter()
+                await application(scope, receive, send)
+                samples[op].append(time.perf_counter() - began)
+                codes[status[0]] += 1
+
+        await asyncio.gather(*(call(item) for item in plan))
+
+    def count_double_bookings(self):
+        """Сколько инструментов имеют пересекающиеся активные аренды."""
+        periods = defaultdict(list)
+        for inst_id, start, end in (Rental.objects.filter(is_active=True)
+                                    .values_list('instrument_id', 'start_date', 'end_date')):
+            periods[inst_id].append((start, end or datetime.date.max))
+
+        doubled = 0
+        for items in periods.values():
+            items.sort()
+            if any(items[i + 1][0] <= items[i][1] for i in range(len(items) - 1)):
+                doubled += 1
+        return doubled
+
+    def print_run(self, app, run):
+        latency = run['latency_ms']
+        self.stdout.write(
+            f"[{app}] {run['requests']} запросов за {run['wall_seconds']} c "
+            f"({run['throughput_rps']} rps), p50={latency['p50']} p95={latency['p95']} "
+            f"p99={latency['p99']} мс, ожидание блокировок={run['lock_wait_ms']} мс, "
+            f"двойных броней={run['double_bookings']}, ошибок 5xx={run['server_errors']}"
+        )
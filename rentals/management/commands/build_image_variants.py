@@ -0,0 +1,57 @@
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from rentals.image_worker import render_variants
+from rentals.models import InstrumentPhoto, UserProfile
+
+
+class Command(BaseCommand):
+    help = "Делает уменьшенные копии для уже загруженных фото и аватаров"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help="Пересоздать даже готовые копии")
+        parser.add_argument('--workers', type=int, default=settings.IMAGE_VARIANT_WORKERS)
+        parser.add_argument('--batch-size', type=int, default=200)
+
+    def handle(self, *args, **options):
+        with ProcessPoolExecutor(max_workers=options['workers']) as pool:
+            for model in (InstrumentPhoto, UserProfile):
+                self.process(model, pool, options)
+
+    def process(self, model, pool, options):
+        field = model.variant_source_field
+        items = model.objects.exclude(**{field: ''}).exclude(**{f'{field}__isnull': True})
+        done = failed = 0
+        batch = []
+        for obj in items.only('pk', field, 'variants').iterator(chunk_size=options['batch_size']):
+            if options['force'] or (obj.variants or {}).get('source') != getattr(obj, field).name:
+                batch.append(obj)
+            if len(batch) >= options['batch_size']:
+                ok, bad = self.render_batch(model, batch, pool, options['force'])
+                done, failed, batch = done + ok, failed + bad, []
+        if batch:
+            ok, bad = self.render_batch(model, batch, pool, options['force'])
+            done, failed = done + ok, failed + bad
+        self.stdout.write(f"{model._meta.verbose_name_plural}: готово {done}, ошибок {failed}")
+
+    def render_batch(self, model, batch, pool, overwrite):
+        field = model.variant_source_field
+        futures = [
+            pool.submit(
+                render_variants, str(settings.MEDIA_ROOT), getattr(obj, field).name, model.VARIANT_SIZES, overwrite,
+            )
+            for obj in batch
+        ]
+        updated, failed = [], 0
+        for obj, future in zip(batch, futures):
+            try:
+                obj.variants = future.result()
+            except Exception as exc:
+                failed += 1
+                self.stderr.write(f"{model.__name__} #{obj.pk}: {exc}")
+                continue
+            updated.append(obj)
+        model.objects.bulk_update(updated, ['variants'])
+        return len(updated), failed
@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from rentals.recommendations import TOP_K, refresh_recommendations
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает рекомендации \"часто берут вместе\" (по умолчанию только по новым арендам и отзывам)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help="Пересчитать всю матрицу заново")
+        parser.add_argument('--top-k', type=int, default=TOP_K, help="Сколько соседей хранить на инструмент")
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        stats = refresh_recommendations(full=options['full'], top_k=options['top_k'])
+        scope = "все инструменты" if stats['rows'] is None else f"инструментов: {stats['rows']}"
+        self.stdout.write(self.style.SUCCESS(
+            f"Пересчет ({scope}), корзин: {stats['baskets']}, рекомендаций: {stats['saved']}, "
+            f"{time.monotonic() - started:.1f} с"
+        ))
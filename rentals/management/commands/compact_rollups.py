@@ -0,0 +1,49 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Min
+
+from rentals.models import ArchivedRental, Rental
+from rentals.rollups import compact_window
+
+# Сколько дней пересобирать за один проход (ограничивает память)
+CHUNK_DAYS = 31
+
+
+class Command(BaseCommand):
+    help = "Пересобирает дневные сводки для отчетов из аренд, платежей и журнала ТО (запускать раз в ночь)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=2,
+                            help="Сколько последних дней пересобрать (по умолчанию вчера и сегодня)")
+        parser.add_argument('--from', dest='date_from', help="Начало периода, ГГГГ-ММ-ДД")
+        parser.add_argument('--to', dest='date_to', help="Конец периода, ГГГГ-ММ-ДД")
+        parser.add_argument('--full', action='store_true', help="Пересобрать всю историю")
+
+    def handle(self, *args, **options):
+        today = datetime.date.today()
+        try:
+            end = datetime.date.fromisoformat(options['date_to']) if options['date_to'] else today
+            if options['full']:
+                firsts = [
+                    model.objects.aggregate(first=Min('start_date'))['first']
+                    for model in (Rental, ArchivedRental)
+                ]
+                start = min([day for day in firsts if day], default=end)
+            elif options['date_from']:
+                start = datetime.date.fromisoformat(options['date_from'])
+            else:
+                start = end - datetime.timedelta(days=options['days'] - 1)
+        except ValueError:
+            raise CommandError("Даты должны быть в формате ГГГГ-ММ-ДД")
+        if start > end:
+            raise CommandError("Начало периода позже конца")
+
+        written = 0
+        chunk_start = start
+        while chunk_start <= end:
+            chunk_end = min(end, chunk_start + datetime.timedelta(days=CHUNK_DAYS - 1))
+            written += compact_window(chunk_start, chunk_end)
+            self.stdout.write(f"{chunk_start} — {chunk_end}: готово")
+            chunk_start = chunk_end + datetime.timedelta(days=1)
+        self.stdout.write(self.style.SUCCESS(f"Строк сводки: {written}"))
@@ -0,0 +1,52 @@
+import datetime
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from rentals.accounting import ENCODERS, KIND_FIELDS, encode_stream, export_batches
+
+
+class Command(BaseCommand):
+    help = "Выгружает аренды, платежи или ТО за период в CSV/XLSX (потоково, можно в .gz)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=list(KIND_FIELDS))
+        parser.add_argument('path', nargs='?', help="Файл для записи (по умолчанию — stdout)")
+        parser.add_argument('--format', choices=list(ENCODERS), default='csv')
+        parser.add_argument('--start', type=datetime.date.fromisoformat, help="С даты (YYYY-MM-DD)")
+        parser.add_argument('--end', type=datetime.date.fromisoformat, help="По дату включительно")
+        parser.add_argument('--location', type=int, help="id филиала")
+        parser.add_argument('--gzip', action='store_true', help="Сжать gzip (по умолчанию — если путь .gz)")
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        compress = options['gzip'] or bool(path and path.endswith('.gz'))
+        if compress and options['format'] == 'xlsx':
+            raise CommandError("XLSX уже сжат, --gzip только для CSV")
+        if options['start'] and options['end'] and options['end'] < options['start']:
+            raise CommandError("--end раньше --start")
+
+        kind = options['kind']
+        batches = export_batches(
+            kind, options['start'], options['end'], options['location'], chunk_size=options['chunk_size'],
+        )
+        count = 0
+
+        def counted():
+            nonlocal count
+            for batch in batches:
+                count += len(batch)
+                yield batch
+
+        f = open(path, 'wb') if path else sys.stdout.buffer
+        try:
+            for chunk in encode_stream(ENCODERS[options['format']](KIND_FIELDS[kind]), counted(), compress):
+                f.write(chunk)
+        finally:
+            if path:
+                f.close()
+            else:
+                f.flush()
+        if path:
+            self.stdout.write(self.style.SUCCESS(f"Выгружено: {count}"))
@@ -0,0 +1,29 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from rentals.inventory import FORMATS, KIND_FIELDS, RowWriter, export_rows
+
+
+class Command(BaseCommand):
+    help = "Выгружает инструменты (или бренды/категории/филиалы) в CSV или JSONL"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', help="Файл для записи (по умолчанию — stdout)")
+        parser.add_argument('--kind', choices=list(KIND_FIELDS), default='instruments')
+        parser.add_argument('--format', choices=FORMATS, default='csv')
+
+    def handle(self, *args, **options):
+        kind = options['kind']
+        f = open(options['path'], 'w', newline='', encoding='utf-8') if options['path'] else sys.stdout
+        try:
+            writer = RowWriter(f, options['format'], KIND_FIELDS[kind])
+            count = 0
+            for row in export_rows(kind):
+                writer.write(row)
+                count += 1
+        finally:
+            if options['path']:
+                f.close()
+        if options['path']:
+            self.stdout.write(self.style.SUCCESS(f"Выгружено: {count}"))
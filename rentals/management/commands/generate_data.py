@@ -0,0 +1,261 @@
+import contextlib
+import datetime
+import random
+import time
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from rentals.availability import overlapping_rentals
+from rentals.caching import invalidate_model
+from rentals.models import (
+    Brand, Category, Instrument, Location, Maintenance, Payment, Rental, Review, UserProfile,
+)
+from rentals.pricing import rental_total
+from rentals.ratings import rebuild_all_ratings
+from rentals.stock import rebuild_stock
+
+CITIES = ['Москва', 'Санкт-Петербург', 'Казань', 'Новосибирск', 'Екатеринбург', 'Самара', 'Пермь', 'Уфа']
+CATEGORY_NAMES = ['Электрогитары', 'Акустика', 'Бас-гитары', 'Ударные', 'Клавишные', 'Духовые',
+                  'Струнные', 'Звук', 'Микрофоны', 'Усилители', 'Педали', 'DJ']
+BRAND_NAMES = ['Fender', 'Gibson', 'Yamaha', 'Roland', 'Ibanez', 'Korg', 'Pearl', 'Shure', 'Marshall',
+               'Boss', 'Casio', 'Epiphone', 'Nord', 'Tama', 'Sennheiser', 'Pioneer']
+BRAND_COUNTRIES = ['США', 'Япония', 'Германия', 'Великобритания', 'Китай', 'Швеция']
+MODEL_WORDS = ['Standard', 'Custom', 'Deluxe', 'Studio', 'Pro', 'Classic', 'Vintage', 'Special', 'Artist']
+COMMENTS = ['Отличное состояние', 'Все работало', 'Немного потерт, но звучит хорошо',
+            'Рекомендую', 'Быстро выдали', 'Струны были старые', 'Супер!']
+REPAIRS = ['Замена струн', 'Настройка грифа', 'Чистка', 'Замена пластика', 'Пайка разъема', 'Проверка']
+
+
+@contextlib.contextmanager
+def plain_timestamps(*fields):
+    """Отключает auto_now_add, чтобы сохранить сгенерированные даты в прошлом."""
+    saved = [(field, field.auto_now_add) for field in fields]
+    for field, _ in saved:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, value in saved:
+            field.auto_now_add = value
+
+
+class Command(BaseCommand):
+    help = "Генерирует воспроизводимый набор тестовых данных (филиалы, инструменты, клиенты, аренды...)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--prefix', default='gen', help="Префикс логинов, slug и инвентарных номеров")
+        parser.add_argument('--locations', type=int, default=8)
+        parser.add_argument('--brands', type=int, default=30)
+        parser.add_argument('--categories', type=int, default=12)
+        parser.add_argument('--instruments', type=int, default=5000)
+        parser.add_argument('--users', type=int, default=2000)
+        parser.add_argument('--rentals', type=int, default=50000)
+        parser.add_argument('--reviews', type=int, default=20000)
+        parser.add_argument('--maintenance', type=int, default=5000)
+        parser.add_argument('--days', type=int, default=730, help="Глубина истории в днях")
+        parser.add_argument('--paid-share', type=float, default=0.85, help="Доля оплаченных завершенных аренд")
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--skip-rollups', action='store_true', help="Не пересобирать дневные сводки")
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.options = options
+        self.batch_size = options['batch_size']
+        self.prefix = options['prefix']
+        self.today = datetime.date.today()
+        if User.objects.filter(username__startswith=f"{self.prefix}_").exists():
+            raise CommandError(f"Данные с префиксом '{self.prefix}' уже есть, укажите другой --prefix")
+
+        self.tune_connection()
+        started = time.monotonic()
+        # bulk_create не шлет сигналы: рейтинги, сводки и поиск пересчитаем в конце
+        with plain_timestamps(
+            Rental._meta.get_field('created_at'), Payment._meta.get_field('payment_date'),
+            Review._meta.get_field('created_at'),
+        ):
+            locations, brands, categories = self.references()
+            instruments = self.instruments(locations, brands, categories)
+            users = self.users()
+            self.rentals(instruments, users)
+            self.reviews(instruments, users)
+            self.maintenance(instruments)
+
+        self.stdout.write("Пересчитываем рейтинги, статусы и остатки филиалов...")
+        rebuild_all_ratings()
+        self.sync_statuses()
+        rebuild_stock()
+        if not options['skip_rollups']:
+            call_command('compact_rollups', full=True, stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(f"Готово за {time.monotonic() - started:.1f} с"))
+
+    def tune_connection(self):
+        # Только на время генерации и только для этого соединения
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                cursor.execute('PRAGMA synchronous = OFF')
+                cursor.execute('PRAGMA temp_store = MEMORY')
+                cursor.execute('PRAGMA cache_size = -200000')
+            elif connection.vendor == 'postgresql':
+                cursor.execute('SET synchronous_commit = off')
+
+    def bulk(self, model, objs, label):
+        created = []
+        for i in range(0, len(objs), self.batch_size):
+            with transaction.atomic():
+                created += model.objects.bulk_create(objs[i:i + self.batch_size])
+        self.stdout.write(f"  {label}: {len(created)}")
+        return created
+
+    # --- СПРАВОЧНИКИ ---
+    def references(self):
+        rng, o = self.rng, self.options
+        locations = self.bulk(Location, [
+            Location(name=f"{CITIES[i % len(CITIES)]} #{i + 1}", address=f"ул. Музыкальная, {i + 1}",
+                     phone=f"+7 900 {rng.randrange(10**6, 10**7)}")
+            for i in range(o['locations'])
+        ], "филиалов")
+        brands = self.bulk(Brand, [
+            Brand(name=BRAND_NAMES[i % len(BRAND_NAMES)] + ('' if i < len(BRAND_NAMES) else f" {i}"),
+                  country=rng.choice(BRAND_COUNTRIES))
+            for i in range(o['brands'])
+        ], "брендов")
+        categories = self.bulk(Category, [
+            Category(name=CATEGORY_NAMES[i % len(CATEGORY_NAMES)] + ('' if i < len(CATEGORY_NAMES) else f" {i}"),
+                     slug=f"{self.prefix}-cat-{i}")
+            for i in range(o['categories'])
+        ], "категорий")
+        return locations, brands, categories
+
+    def instruments(self, locations, brands, categories):
+        rng = self.rng
+        statuses = ['available'] * 19 + ['maintenance']
+        return self.bulk(Instrument, [
+            Instrument(
+                name=f"{rng.choice(brands).name} {rng.choice(MODEL_WORDS)} {rng.randint(1, 999)}",
+                description="Сгенерированный инструмент", price_per_day=Decimal(rng.randrange(200, 5000, 50)),
+                status=rng.choice(statuses), inventory_number=f"{self.prefix.upper()}-{i:08d}",
+                location=rng.choice(locations), brand=rng.choice(brands), category=rng.choice(categories),
+            )
+            for i in range(self.options['instruments'])
+        ], "инструментов")
+
+    def users(self):
+        # Хэш пароля считается один раз: PBKDF2 на каждого пользователя занял бы минуты
+        password = make_password('password')
+        joined = timezone.now() - datetime.timedelta(days=self.options['days'])
+        users = self.bulk(User, [
+            User(username=f"{self.prefix}_user_{i}", email=f"{self.prefix}_user_{i}@example.com",
+                 password=password, date_joined=joined)
+            for i in range(self.options['users'])
+        ], "клиентов")
+        self.bulk(UserProfile, [
+            UserProfile(user=user, phone_number=f"+7 9{self.rng.randrange(10**8, 10**9)}",
+                        address=f"{self.rng.choice(CITIES)}, д. {self.rng.randint(1, 200)}")
+            for user in users
+        ], "профилей")
+        return users
+
+    # --- АРЕНДЫ И ПЛАТЕЖИ ---
+    def rental_timeline(self, instrument):
+        """Непересекающиеся аренды одного инструмента: пауза, аренда, пауза..."""
+        rng, days = self.rng, self.options['days']
+        per_instrument = max(1, self.options['rentals'] // max(1, self.options['instruments']))
+        # Средняя длина цикла так, чтобы уложиться в историю
+        cycle = max(3, days // per_instrument)
+        max_length = max(1, min(14, cycle // 2))
+        # Пауза в среднем добирает цикл до нужной длины, чтобы история доходила до сегодня
+        max_gap = max(0, int(2 * (cycle - (1 + max_length) / 2 - 1)))
+        day = self.today - datetime.timedelta(days=days)
+        for _ in range(per_instrument):
+            day += datetime.timedelta(days=rng.randint(0, max_gap))
+            length = rng.randint(1, max_length)
+            start, end = day, day + datetime.timedelta(days=length - 1)
+            if start > self.today + datetime.timedelta(days=30):
+                return
+            yield start, (None if rng.random() < 0.05 and end >= self.today else end)
+            day = end + datetime.timedelta(days=1)
+
+    def rentals(self, instruments, users):
+        rng = self.rng
+        batch = []
+        total = payments = 0
+        for instrument in instruments:
+            if instrument.status == 'maintenance':
+                continue
+            for start, end in self.rental_timeline(instrument):
+                finished = end is not None and end < self.today
+                returned = None
+                if finished:
+                    # Большинство возвращают в срок, кто-то раньше, кто-то с опозданием
+                    shift = rng.choice([0] * 8 + [-1, 1, 2])
+                    returned = max(start, end + datetime.timedelta(days=shift))
+                created = min(timezone.now(), timezone.make_aware(datetime.datetime.combine(
+                    start - datetime.timedelta(days=rng.randint(0, 7)), datetime.time(rng.randint(8, 21)),
+                )))
+                batch.append(Rental(
+                    instrument=instrument, user=rng.choice(users), start_date=start, end_date=end,
+                    returned_at=returned, is_active=not finished, created_at=created,
+                    total_price=rental_total(instrument.price_per_day, start, end, returned, self.today),
+                ))
+                if len(batch) >= self.batch_size:
+                    total, payments = total + len(batch), payments + self.flush_rentals(batch)
+                    batch = []
+        if batch:
+            total, payments = total + len(batch), payments + self.flush_rentals(batch)
+        self.stdout.write(f"  аренд: {total}, платежей: {payments}")
+
+    def flush_rentals(self, batch):
+        rng, paid_share = self.rng, self.options['paid_share']
+        with transaction.atomic():
+            rentals = Rental.objects.bulk_create(batch)
+            payments = []
+            for rental in rentals:
+                if rental.is_active or rng.random() > paid_share:
+                    continue
+                paid_at = rental.returned_at or rental.start_date
+                payments.append(Payment(
+                    rental=rental, amount=rental.total_price, is_successful=rng.random() > 0.02,
+                    payment_date=timezone.make_aware(datetime.datetime.combine(paid_at, datetime.time(12))),
+                ))
+            Payment.objects.bulk_create(payments)
+        return len(payments)
+
+    # --- ОТЗЫВЫ И ТО ---
+    def past_moment(self):
+        return timezone.now() - datetime.timedelta(
+            days=self.rng.randrange(self.options['days']), seconds=self.rng.randrange(86400),
+        )
+
+    def reviews(self, instruments, users):
+        rng = self.rng
+        # Популярные инструменты получают больше отзывов
+        weights = [1 / (i + 1) ** 0.5 for i in range(len(instruments))]
+        self.bulk(Review, [
+            Review(instrument=instrument, user=rng.choice(users),
+                   rating=rng.choices([1, 2, 3, 4, 5], [1, 1, 3, 8, 10])[0],
+                   comment=rng.choice(COMMENTS), created_at=self.past_moment())
+            for instrument in rng.choices(instruments, weights, k=self.options['reviews'])
+        ] if instruments and users else [], "отзывов")
+
+    def maintenance(self, instruments):
+        rng = self.rng
+        self.bulk(Maintenance, [
+            Maintenance(instrument=rng.choice(instruments), description=rng.choice(REPAIRS),
+                        cost=Decimal(rng.randrange(300, 15000, 100)), date=self.past_moment().date())
+            for _ in range(self.options['maintenance'])
+        ] if instruments else [], "записей ТО")
+
+    def sync_statuses(self):
+        # Инструменты с арендой на сегодня помечаем как выданные
+        busy_today = overlapping_rentals(self.today, self.today).values('instrument_id')
+        Instrument.objects.filter(id__in=busy_today, status='available').update(
+            status='rented', updated_at=timezone.now(),
+        )
+        invalidate_model(Instrument)
@@ -0,0 +1,77 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from rentals.caching import invalidate_filter_lists
+from rentals.stock import rebuild_stock
+from rentals.inventory import (
+    FORMATS, KIND_FIELDS, References, RowError, RowWriter,
+    parse_instrument, parse_reference, read_rows, upsert_instruments, upsert_references,
+)
+
+
+class Command(BaseCommand):
+    help = "Импортирует инструменты (или бренды/категории/филиалы) из CSV или JSONL"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Файл .csv или .jsonl")
+        parser.add_argument('--kind', choices=list(KIND_FIELDS), default='instruments')
+        parser.add_argument('--format', choices=FORMATS, help="По умолчанию — по расширению файла")
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--rejects', help="Куда записать отклоненные строки (с колонкой error)")
+
+    def handle(self, *args, **options):
+        fmt = options['format'] or os.path.splitext(options['path'])[1].lstrip('.').lower()
+        if fmt not in FORMATS:
+            raise CommandError(f"Неизвестный формат '{fmt}', укажите --format")
+        kind = options['kind']
+
+        rejects_file = rejects = None
+        if options['rejects']:
+            rejects_file = open(options['rejects'], 'w', newline='', encoding='utf-8')
+            rejects = RowWriter(rejects_file, fmt, ['line', 'error'] + KIND_FIELDS[kind] + ['_raw'])
+
+        refs = References() if kind == 'instruments' else None
+        imported = rejected = 0
+        batch = []
+        try:
+            with open(options['path'], newline='', encoding='utf-8-sig') as f:
+                for line_no, row in read_rows(f, fmt):
+                    try:
+                        if '_raw' in row:
+                            raise RowError("строка не является JSON-объектом")
+                        if refs is not None:
+                            batch.append(parse_instrument(row, refs))
+                        else:
+                            batch.append(parse_reference(kind, row))
+                    except RowError as e:
+                        rejected += 1
+                        if rejects:
+                            rejects.write({**row, 'line': line_no, 'error': str(e)})
+                        continue
+
+                    if len(batch) >= options['batch_size']:
+                        imported += self.flush(kind, batch)
+                        batch = []
+                        self.stdout.write(f"  обработано: {imported}, отклонено: {rejected}")
+                if batch:
+                    imported += self.flush(kind, batch)
+        finally:
+            if rejects_file:
+                rejects_file.close()
+
+        # bulk_create не шлет сигналы: сбрасываем кэш фильтров сами.
+        # Поиск и карточки каталога подхватят изменения по updated_at
+        if kind != 'instruments' or refs.created:
+            invalidate_filter_lists()
+        if kind == 'instruments' and imported:
+            rebuild_stock()
+
+        self.stdout.write(self.style.SUCCESS(f"Импортировано: {imported}, отклонено: {rejected}"))
+        if refs is not None and refs.created:
+            self.stdout.write(f"Создано новых брендов/категорий/филиалов: {refs.created}")
+
+    def flush(self, kind, batch):
+        if kind == 'instruments':
+            return upsert_instruments(batch)
+        return upsert_references(kind, batch)
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from rentals.ratings import find_stale_ratings, rebuild_all_ratings
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает средний рейтинг и число отзывов у всех инструментов"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help="Только показать расхождения, ничего не менять")
+
+    def handle(self, *args, **options):
+        stale = find_stale_ratings()
+        for item in stale[:20]:
+            self.stdout.write(
+                f"#{item['id']}: сохранено {item['rating_avg']} ({item['review_count']}), "
+                f"на самом деле {item['real_avg']:.2f} ({item['real_count']})"
+            )
+        self.stdout.write(f"Расхождений: {len(stale)}")
+
+        if options['check']:
+            return
+        updated = rebuild_all_ratings()
+        self.stdout.write(self.style.SUCCESS(f"Пересчитано инструментов: {updated}"))
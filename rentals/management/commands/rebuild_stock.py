@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from rentals.stock import rebuild_stock
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает остатки по филиалам (LocationStock) с нуля по таблице инструментов"
+
+    def handle(self, *args, **options):
+        rows = rebuild_stock()
+        self.stdout.write(self.style.SUCCESS(f"Строк остатков: {rows}"))
@@ -0,0 +1,44 @@
+import csv
+
+from django.core.management.base import BaseCommand
+
+from rentals.pricing import billing_summary, outstanding_by_user, recompute_totals
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает стоимость всех аренд и сверяет начисления с платежами"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Только посчитать расхождения, ничего не менять")
+        parser.add_argument('--report', metavar='CSV',
+                            help="Сохранить долги всех пользователей в CSV")
+        parser.add_argument('--top', type=int, default=10,
+                            help="Сколько должников показать в выводе")
+
+    def handle(self, *args, **options):
+        checked, changed = recompute_totals(options['batch_size'], options['dry_run'])
+        verb = "Нужно исправить" if options['dry_run'] else "Исправлено"
+        self.stdout.write(f"Проверено аренд: {checked}, {verb.lower()}: {changed}")
+
+        summary = billing_summary()
+        self.stdout.write(
+            f"Начислено {summary['billed']} р., оплачено {summary['paid']} р., "
+            f"долг {summary['outstanding']} р., аренд с переплатой: {summary['overpaid_rentals']}"
+        )
+
+        debtors = outstanding_by_user()
+        for row in debtors[:options['top']]:
+            self.stdout.write(f"  {row['username']}: {row['outstanding']} р. (из {row['billed']})")
+
+        if options['report']:
+            with open(options['report'], 'w', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                writer.writerow(['user_id', 'username', 'billed', 'paid', 'outstanding'])
+                count = 0
+                for row in debtors.iterator(chunk_size=2000):
+                    writer.writerow([row['id'], row['username'], row['billed'], row['paid'], row['outstanding']])
+                    count += 1
+            self.stdout.write(f"Должников в отчете: {count}")
+        self.stdout.write(self.style.SUCCESS("Готово"))
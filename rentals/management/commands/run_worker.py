@@ -0,0 +1,57 @@
+import signal
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from rentals import jobs
+
+
+class Command(BaseCommand):
+    help = "Выполняет фоновые задачи из очереди (просрочки, напоминания о ТО, сводки)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help="Выполнить все готовые задачи и выйти (для cron)")
+        parser.add_argument('--sleep', type=float, default=5, help="Пауза при пустой очереди, с")
+        parser.add_argument('--no-periodic', action='store_true',
+                            help="Не ставить периодические задачи (только то, что уже в очереди)")
+        parser.add_argument('--enqueue', metavar='NAME', help="Поставить задачу в очередь и выйти")
+
+    def handle(self, *args, **options):
+        if options['enqueue']:
+            if options['enqueue'] not in jobs.registry:
+                raise CommandError(f"Неизвестная задача. Есть: {', '.join(sorted(jobs.registry))}")
+            job = jobs.enqueue(options['enqueue'])
+            self.stdout.write(f"Поставлена задача #{job.id}")
+            return
+
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        worker = jobs.worker_name()
+        self.stdout.write(f"Воркер {worker} запущен, задачи: {', '.join(sorted(jobs.registry))}")
+
+        while not self.stopping:
+            close_old_connections()
+            jobs.requeue_stale()
+            if not options['no_periodic']:
+                jobs.schedule_periodic()
+
+            batch = jobs.claim(worker)
+            if not batch:
+                if options['once']:
+                    break
+                time.sleep(options['sleep'])
+                continue
+
+            for job in batch:
+                started = time.monotonic()
+                ok = jobs.run(job)
+                status = self.style.SUCCESS("ok") if ok else self.style.ERROR("ошибка")
+                self.stdout.write(f"{job.name} #{job.id}: {status} за {time.monotonic() - started:.1f} с")
+        self.stdout.write("Воркер остановлен")
+
+    def stop(self, signum, frame):
+        # Текущую задачу доделываем, новых не берем
+        self.stopping = True
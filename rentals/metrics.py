@@ -0,0 +1,105 @@
+"""
+Агрегированные метрики запросов в памяти процесса и их вывод
+в текстовом формате Prometheus (эндпоинт /metrics).
+
+Другие подсистемы могут добавлять свои строки через register_collector().
+"""
+import threading
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class ViewStats:
+    __slots__ = (
+        'requests', 'duration', 'buckets', 'sampled', 'queries',
+        'sql_time', 'template_time', 'duplicates', 'similar',
+    )
+
+    def __init__(self):
+        self.requests = 0
+        self.duration = 0.0
+        self.buckets = [0] * len(DURATION_BUCKETS)
+        self.sampled = 0
+        self.queries = 0
+        self.sql_time = 0.0
+        self.template_time = 0.0
+        self.duplicates = 0
+        self.similar = 0
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = {}
+        self._collectors = []
+
+    def observe(self, view, duration, probe=None):
+        """Учитывает запрос; probe — данные о SQL/шаблонах, если запрос попал в выборку."""
+        with self._lock:
+            stats = self._views.get(view)
+            if stats is None:
+                stats = self._views[view] = ViewStats()
+            stats.requests += 1
+            stats.duration += duration
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if duration <= bound:
+                    stats.buckets[i] += 1
+            if probe is not None:
+                stats.sampled += 1
+                stats.queries += probe.queries
+                stats.sql_time += probe.sql_time
+                stats.template_time += probe.template_time
+                stats.duplicates += probe.duplicates
+                stats.similar += probe.similar
+
+    def register_collector(self, collector):
+        """collector() возвращает список готовых строк в формате Prometheus."""
+        self._collectors.append(collector)
+
+    def render(self):
+        with self._lock:
+            views = sorted(self._views.items())
+            lines = [
+                '# HELP muzrent_http_requests_total Requests handled, by view.',
+                '# TYPE muzrent_http_requests_total counter',
+            ]
+            lines += [f'muzrent_http_requests_total{{view="{_label(v)}"}} {s.requests}' for v, s in views]
+
+            lines += [
+                '# HELP muzrent_http_request_duration_seconds Request duration, by view.',
+                '# TYPE muzrent_http_request_duration_seconds histogram',
+            ]
+            for view, stats in views:
+                name = _label(view)
+                for bound, count in zip(DURATION_BUCKETS, stats.buckets):
+                    lines.append(f'muzrent_http_request_duration_seconds_bucket{{view="{name}",le="{bound}"}} {count}')
+                lines.append(f'muzrent_http_request_duration_seconds_bucket{{view="{name}",le="+Inf"}} {stats.requests}')
+                lines.append(f'muzrent_http_request_duration_seconds_sum{{view="{name}"}} {stats.duration:.6f}')
+                lines.append(f'muzrent_http_request_duration_seconds_count{{view="{name}"}} {stats.requests}')
+
+            # Остальное считается только по запросам, попавшим в выборку
+            for metric, attr, kind, help_text in (
+                ('muzrent_sampled_requests_total', 'sampled', 'counter', 'Requests profiled for SQL/templates.'),
+                ('muzrent_db_queries_total', 'queries', 'counter', 'SQL queries in sampled requests.'),
+                ('muzrent_db_query_seconds_total', 'sql_time', 'counter', 'SQL time in sampled requests.'),
+                ('muzrent_template_render_seconds_total', 'template_time', 'counter', 'Template render time in sampled requests.'),
+                ('muzrent_db_duplicate_queries_total', 'duplicates', 'counter', 'Exact repeats of a query (same SQL and params).'),
+                ('muzrent_db_similar_queries_total', 'similar', 'counter', 'Queries repeated with different params (N+1 suspects).'),
+            ):
+                lines.append(f'# HELP {metric} {help_text}')
+                lines.append(f'# TYPE {metric} {kind}')
+                for view, stats in views:
+                    value = getattr(stats, attr)
+                    value = f'{value:.6f}' if isinstance(value, float) else value
+                    lines.append(f'{metric}{{view="{_label(view)}"}} {value}')
+
+        for collector in self._collectors:
+            lines.extend(collector())
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
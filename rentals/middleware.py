@@ -0,0 +1,234 @@
+"""
+Middleware для замера запросов: сколько SQL-запросов сделала вьюха, сколько
+они заняли, сколько рендерился шаблон и есть ли повторяющиеся запросы (N+1).
+
+Подробно профилируется только доля запросов (METRICS_SAMPLE_RATE), остальные
+дают лишь время ответа, поэтому middleware можно держать включенным в проде.
+Для профилированных запросов добавляется заголовок Server-Timing.
+
+Middleware работает и в синхронной, и в асинхронной цепочке (ASGI), чтобы
+не загонять async-вьюхи в поток. SQL ловится обработчиком, который ставится
+на каждое соединение и берет текущий probe из contextvar: так запросы
+учитываются, даже если ORM выполняет их в другом потоке (sync_to_async).
+"""
+import random
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import connections
+from django.db.backends.signals import connection_created
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+from .db_routing import PIN_COOKIE, SAFE_METHODS
+from .metrics import registry
+
+# Повтор одного и того же SQL с разными параметрами столько раз и больше — похоже на N+1
+N_PLUS_ONE_THRESHOLD = 5
+
+_current_probe = ContextVar('metrics_probe', default=None)
+
+
+class RequestProbe:
+    """Собирает SQL-запросы (через execute_wrapper) и время рендера шаблонов."""
+
+    def __init__(self):
+        self.queries = 0
+        self.sql_time = 0.0
+        self.template_time = 0.0
+        self.template_depth = 0
+        self.statements = Counter()
+        self.exact = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += time.perf_counter() - started
+            self.queries += 1
+            self.statements[sql] += 1
+            self.exact[(sql, repr(params))] += 1
+
+    @property
+    def duplicates(self):
+        return sum(n - 1 for n in self.exact.values() if n > 1)
+
+    @property
+    def similar(self):
+        return sum(n for n in self.statements.values() if n >= N_PLUS_ONE_THRESHOLD)
+
+
+def _probe_dispatch(execute, sql, params, many, context):
+    probe = _current_probe.get()
+    if probe is None:
+        return execute(sql, params, many, context)
+    return probe(execute, sql, params, many, context)
+
+
+def _install_probe_dispatch(connection):
+    if _probe_dispatch not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_probe_dispatch)
+
+
+def _on_connection_created(sender, connection, **kwargs):
+    _install_probe_dispatch(connection)
+
+
+def _on_request_started(sender, **kwargs):
+    # Соединения, открытые до загрузки middleware (в том числе в другом потоке),
+    # сигнал connection_created уже пропустил. Под ASGI sync-обработчики
+    # request_started выполняются в том же потоке, что и ORM (вместе с
+    # close_old_connections, без лишнего перехода между потоками)
+    for connection in connections.all(initialized_only=True):
+        _install_probe_dispatch(connection)
+
+
+def _install_template_timer():
+    """Оборачивает рендер шаблонов Django один раз на процесс."""
+    from django.template.backends.django import Template
+
+    if getattr(Template.render, 'metrics_wrapped', False):
+        return
+    original_render = Template.render
+
+    def render(self, context=None, request=None):
+        probe = _current_probe.get()
+        if probe is None:
+            return original_render(self, context, request)
+        # Вложенные render_to_string не считаем дважды
+        probe.template_depth += 1
+        started = time.perf_counter()
+        try:
+            return original_render(self, context, request)
+        finally:
+            probe.template_depth -= 1
+            if probe.template_depth == 0:
+                probe.template_time += time.perf_counter() - started
+
+    render.metrics_wrapped = True
+    Template.render = render
+
+
+class QueryMetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'METRICS_SAMPLE_RATE', 1.0)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        _install_template_timer()
+        connection_created.connect(_on_connection_created, dispatch_uid='metrics_probe_dispatch')
+        request_started.connect(_on_request_started, dispatch_uid='metrics_probe_request')
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        started = time.perf_counter()
+        if random.random() >= self.sample_rate:
+            response = self.get_response(request)
+            registry.observe(self.view_name(request), time.perf_counter() - started)
+            return response
+
+        probe = RequestProbe()
+        token = _current_probe.set(probe)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_probe.reset(token)
+        return self.finish(request, response, probe, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        if random.random() >= self.sample_rate:
+            response = await self.get_response(request)
+            registry.observe(self.view_name(request), time.perf_counter() - started)
+            return response
+
+        probe = RequestProbe()
+        token = _current_probe.set(probe)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_probe.reset(token)
+        return self.finish(request, response, probe, time.perf_counter() - started)
+
+    def finish(self, request, response, probe, duration):
+        registry.observe(self.view_name(request), duration, probe)
+        response['Server-Timing'] = (
+            f'db;dur={probe.sql_time * 1000:.1f};desc="{probe.queries} queries", '
+            f'tpl;dur={probe.template_time * 1000:.1f}, '
+            f'dup;desc="{probe.duplicates} duplicate, {probe.similar} similar", '
+            f'total;dur={duration * 1000:.1f}'
+        )
+        return response
+
+    @staticmethod
+    def view_name(request):
+        match = getattr(request, 'resolver_match', None)
+        return match.view_name if match else 'unresolved'
+
+
+class AsyncWhiteNoiseMiddleware(WhiteNoiseMiddleware):
+    """
+    WhiteNoise умеет только sync, и из-за него вся цепочка под ASGI уходила
+    в поток. Поиск файла — это словарь в памяти, так что его можно делать
+    прямо в event loop; остальные запросы идут дальше асинхронно.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, *args, **kwargs):
+        super().__init__(get_response, *args, **kwargs)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            # В DEBUG файлы ищутся на диске
+            static_file = await sync_to_async(self.find_file)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return self.serve(static_file, request)
+        return await self.get_response(request)
+
+
+class ReplicaPinMiddleware:
+    """
+    После изменяющего запроса (POST, PUT, ...) ставит cookie, которая на
+    REPLICA_PIN_SECONDS отправляет чтения клиента в основную базу: реплика
+    может еще не догнать его запись (см. db_routing.replica_reads).
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.pin_seconds = getattr(settings, 'REPLICA_PIN_SECONDS', 10)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.pin(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.pin(request, await self.get_response(request))
+
+    def pin(self, request, response):
+        if request.method not in SAFE_METHODS and getattr(settings, 'DATABASE_REPLICAS', None):
+            response.set_cookie(PIN_COOKIE, '1', max_age=self.pin_seconds, httponly=True, samesite='Lax')
+        return response
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-18 12:07
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rentals', '0002_instrument_updated_at'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='rental',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['instrument', 'start_date', 'end_date'], name='rental_active_period_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rental',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['start_date', 'end_date'], name='rental_active_dates_idx'),
+        ),
+    ]
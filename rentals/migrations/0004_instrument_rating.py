@@ -0,0 +1,42 @@
+# Generated by Django 5.2.8 on 2026-10-18 12:11
+
+from django.db import migrations, models
+from django.db.models import Avg, Count, FloatField, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_ratings(apps, schema_editor):
+    Instrument = apps.get_model('rentals', 'Instrument')
+    Review = apps.get_model('rentals', 'Review')
+    per_instrument = Review.objects.filter(instrument=OuterRef('pk')).order_by().values('instrument')
+    Instrument.objects.update(
+        rating_avg=Coalesce(
+            Subquery(per_instrument.annotate(v=Avg('rating')).values('v'), output_field=FloatField()),
+            Value(0.0),
+        ),
+        review_count=Coalesce(
+            Subquery(per_instrument.annotate(v=Count('id')).values('v'), output_field=IntegerField()),
+            Value(0),
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rentals', '0003_rental_period_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='instrument',
+            name='rating_avg',
+            field=models.FloatField(db_index=True, default=0, verbose_name='Средняя оценка'),
+        ),
+        migrations.AddField(
+            model_name='instrument',
+            name='review_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Количество отзывов'),
+        ),
+        migrations.RunPython(backfill_ratings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-18 12:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rentals', '0004_instrument_rating'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='instrumentphoto',
+            name='variants',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='Уменьшенные копии'),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='variants',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='Уменьшенные копии'),
+        ),
+    ]
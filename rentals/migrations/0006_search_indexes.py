@@ -0,0 +1,42 @@
+from django.db import migrations
+
+# Индексы нужны только PostgreSQL: на других СУБД поиск идет по индексу в памяти
+POSTGRES_INDEXES = [
+    ("rentals_instrument_name_trgm",
+     "CREATE INDEX IF NOT EXISTS rentals_instrument_name_trgm ON rentals_instrument USING gin (name gin_trgm_ops)"),
+    ("rentals_instrument_invnum_trgm",
+     "CREATE INDEX IF NOT EXISTS rentals_instrument_invnum_trgm ON rentals_instrument USING gin (inventory_number gin_trgm_ops)"),
+    ("rentals_brand_name_trgm",
+     "CREATE INDEX IF NOT EXISTS rentals_brand_name_trgm ON rentals_brand USING gin (name gin_trgm_ops)"),
+    ("rentals_category_name_trgm",
+     "CREATE INDEX IF NOT EXISTS rentals_category_name_trgm ON rentals_category USING gin (name gin_trgm_ops)"),
+    ("rentals_instrument_description_fts",
+     "CREATE INDEX IF NOT EXISTS rentals_instrument_description_fts ON rentals_instrument "
+     "USING gin (to_tsvector('simple'::regconfig, COALESCE(description, '')))"),
+]
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for _, sql in POSTGRES_INDEXES:
+        schema_editor.execute(sql)
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, _ in POSTGRES_INDEXES:
+        schema_editor.execute(f"DROP INDEX IF EXISTS {name}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rentals', '0005_image_variants'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
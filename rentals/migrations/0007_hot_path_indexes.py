@@ -0,0 +1,31 @@
+# Generated by Django 5.2.8 on 2026-10-18 12:14
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rentals', '0006_search_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='instrument',
+            index=models.Index(fields=['status'], name='instrument_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='maintenance',
+            index=models.Index(fields=['instrument', '-date'], name='maintenance_inst_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rental',
+            index=models.Index(fields=['user', '-created_at'], name='rental_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['instrument', '-created_at', '-id'], name='review_inst_created_idx'),
+        ),
+    ]
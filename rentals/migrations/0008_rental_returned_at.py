@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 12:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rentals', '0007_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rental',
+            name='returned_at',
+            field=models.DateField(blank=True, null=True, verbose_name='Фактически возвращен'),
+        ),
+    ]
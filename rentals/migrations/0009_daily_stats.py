@@ -0,0 +1,75 @@
+# Generated by Django 5.2.8 on 2026-10-18 12:18
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rentals', '0008_rental_returned_at'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InstrumentDailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='День')),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Выручка')),
+                ('rentals_started', models.PositiveIntegerField(default=0, verbose_name='Новых аренд')),
+                ('rented', models.BooleanField(default=False, verbose_name='Был в аренде')),
+                ('maintenance_cost', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Затраты на ТО')),
+            ],
+            options={
+                'verbose_name': 'Дневная сводка',
+                'verbose_name_plural': 'Дневные сводки',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['payment_date'], name='payment_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rental',
+            index=models.Index(condition=models.Q(('is_active', False)), fields=['returned_at', 'end_date'], name='rental_closed_returned_idx'),
+        ),
+        migrations.AddField(
+            model_name='instrumentdailystats',
+            name='brand',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='rentals.brand'),
+        ),
+        migrations.AddField(
+            model_name='instrumentdailystats',
+            name='category',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='rentals.category'),
+        ),
+        migrations.AddField(
+            model_name='instrumentdailystats',
+            name='instrument',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='rentals.instrument'),
+        ),
+        migrations.AddField(
+            model_name='instrumentdailystats',
+            name='location',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='rentals.location'),
+        ),
+        migrations.AddIndex(
+            model_name='instrumentdailystats',
+            index=models.Index(fields=['day', 'location'], name='daily_stats_day_loc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='instrumentdailystats',
+            index=models.Index(fields=['day', 'category'], name='daily_stats_day_cat_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='instrumentdailystats',
+            index=models.Index(fields=['day', 'brand'], name='daily_stats_day_brand_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='instrumentdailystats',
+            constraint=models.UniqueConstraint(fields=('day', 'instrument'), name='daily_stats_day_inst_uniq'),
+        ),
+    ]
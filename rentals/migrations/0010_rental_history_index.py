@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-18 12:20
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rentals', '0009_daily_stats'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='rental',
+            name='rental_user_created_idx',
+        ),
+        migrations.AddIndex(
+            model_name='rental',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='rental_user_created_idx'),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.2.8 on 2026-10-18 12:20
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rentals', '0010_rental_history_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedRental',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('start_date', models.DateField(verbose_name='Дата начала')),
+                ('end_date', models.DateField(blank=True, null=True, verbose_name='Дата возврата')),
+                ('returned_at', models.DateField(blank=True, null=True, verbose_name='Фактически возвращен')),
+                ('total_price', models.DecimalField(decimal_places=2, default=0, max_digits=10, verbose_name='Итоговая стоимость')),
+                ('created_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('instrument', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='rentals.instrument', verbose_name='Инструмент')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Клиент')),
+            ],
+            options={
+                'verbose_name': 'Аренда (архив)',
+                'verbose_name_plural': 'Аренды (архив)',
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedPayment',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='Сумма')),
+                ('payment_date', models.DateTimeField()),
+                ('is_successful', models.BooleanField(default=True, verbose_name='Успешно')),
+                ('rental', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='payments', to='rentals.archivedrental')),
+            ],
+            options={
+                'verbose_name': 'Платеж (архив)',
+                'verbose_name_plural': 'Платежи (архив)',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='archivedrental',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='archrental_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedrental',
+            index=models.Index(fields=['returned_at', 'end_date'], name='archrental_returned_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedpayment',
+            index=models.Index(fields=['payment_date'], name='archpayment_date_idx'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.8 on 2026-10-18 12:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rentals', '0011_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rental',
+            name='is_overdue',
+            field=models.BooleanField(default=False, verbose_name='Просрочена'),
+        ),
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, verbose_name='Задача')),
+                ('payload', models.JSONField(blank=True, default=dict, verbose_name='Параметры')),
+                ('status', models.CharField(choices=[('queued', 'В очереди'), ('running', 'Выполняется'), ('done', 'Готово'), ('failed', 'Ошибка')], default='queued', max_length=10, verbose_name='Статус')),
+                ('unique_key', models.CharField(blank=True, editable=False, max_length=100, null=True)),
+                ('run_at', models.DateTimeField(verbose_name='Запустить не раньше')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='Попыток')),
+                ('last_error', models.TextField(blank=True, verbose_name='Последняя ошибка')),
+                ('result', models.JSONField(blank=True, null=True, verbose_name='Результат')),
+                ('worker', models.CharField(blank=True, max_length=100, verbose_name='Воркер')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Фоновая задача',
+                'verbose_name_plural': 'Фоновые задачи',
+                'indexes': [models.Index(fields=['status', 'run_at'], name='job_status_run_at_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('status__in', ['queued', 'running'])), fields=('unique_key',), name='job_unique_live_key')],
+            },
+        ),
+    ]
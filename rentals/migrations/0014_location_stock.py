@@ -0,0 +1,54 @@
+# Generated by Django 5.2.8 on 2026-10-18 12:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_stock(apps, schema_editor):
+    Instrument = apps.get_model('rentals', 'Instrument')
+    LocationStock = apps.get_model('rentals', 'LocationStock')
+    rows = (
+        Instrument.objects.filter(location__isnull=False)
+        .values('location_id', 'category_id', 'brand_id', 'name', 'status')
+        .annotate(count=Count('id')).order_by()
+    )
+    LocationStock.objects.bulk_create([LocationStock(**row) for row in rows], batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rentals', '0013_recommendations'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='location',
+            name='latitude',
+            field=models.FloatField(blank=True, null=True, verbose_name='Широта'),
+        ),
+        migrations.AddField(
+            model_name='location',
+            name='longitude',
+            field=models.FloatField(blank=True, null=True, verbose_name='Долгота'),
+        ),
+        migrations.CreateModel(
+            name='LocationStock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, verbose_name='Название модели')),
+                ('status', models.CharField(choices=[('available', 'В наличии'), ('rented', 'В аренде'), ('maintenance', 'На обслуживании')], max_length=20, verbose_name='Статус')),
+                ('count', models.IntegerField(default=0, verbose_name='Количество')),
+                ('brand', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='rentals.brand', verbose_name='Бренд')),
+                ('category', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='rentals.category', verbose_name='Категория')),
+                ('location', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock', to='rentals.location', verbose_name='Филиал')),
+            ],
+            options={
+                'verbose_name': 'Остаток в филиале',
+                'verbose_name_plural': 'Остатки в филиалах',
+                'indexes': [models.Index(fields=['location', 'category', 'brand', 'name', 'status'], name='stock_key_idx'), models.Index(fields=['category', 'status'], name='stock_category_idx'), models.Index(fields=['brand', 'status'], name='stock_brand_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_stock, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.8 on 2026-10-18 13:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rentals', '0014_location_stock'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='instrumentdailystats',
+            name='brand',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='rentals.brand'),
+        ),
+        migrations.AlterField(
+            model_name='instrumentdailystats',
+            name='category',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='rentals.category'),
+        ),
+        migrations.AlterField(
+            model_name='instrumentdailystats',
+            name='location',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='rentals.location'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.8 on 2026-10-18 13:09
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_heartbeat(apps, schema_editor):
+    # Уже выполняющиеся задачи считаем отмеченными в момент старта
+    Job = apps.get_model('rentals', 'Job')
+    Job.objects.filter(status='running').update(heartbeat_at=F('started_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rentals', '0015_daily_stats_nullable_dims'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_heartbeat, migrations.RunPython.noop),
+    ]
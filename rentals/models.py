@@ -30,6 +30,9 @@ class Location(models.Model):
     name = models.CharField("Название филиала", max_length=100)
     address = models.TextField("Адрес")
     phone = models.CharField("Телефон", max_length=20)
+    # Необязательные координаты: по ним API остатков сортирует филиалы по расстоянию
+    latitude = models.FloatField("Широта", null=True, blank=True)
+    longitude = models.FloatField("Долгота", null=True, blank=True)
 
     def __str__(self):
         return f"{self.name} ({self.address})"
@@ -45,6 +48,11 @@ class UserProfile(models.Model):
     phone_number = models.CharField("Телефон", max_length=20, blank=True)
     address = models.TextField("Адрес проживания", blank=True)
     avatar = models.ImageField("Аватар", upload_to='avatars/', blank=True, null=True)
+    # Уменьшенные копии аватара (см. images.py)
+    variants = models.JSONField("Уменьшенные копии", default=dict, blank=True, editable=False)
+
+    variant_source_field = 'avatar'
+    VARIANT_SIZES = {'thumb': 160}
 
     def __str__(self):
         return f"Профиль {self.user.username}"
@@ -55,6 +63,9 @@ class UserProfile(models.Model):
 
 # --- ТОВАРЫ ---
 
+# Поля инструмента, по которым группируются остатки филиалов (LocationStock)
+STOCK_KEY_FIELDS = ('location_id', 'category_id', 'brand_id', 'name', 'status')
+
 class Instrument(models.Model):
     STATUS_CHOICES = [
         ('available', 'В наличии'),
@@ -73,17 +84,48 @@ class Instrument(models.Model):
     
     inventory_number = models.CharField("Инвентарный номер", max_length=50, unique=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Нужен для ETag/Last-Modified в API и сброса кэша карточек
+    updated_at = models.DateTimeField("Обновлено", auto_now=True, db_index=True)
+
+    # Денормализованный рейтинг: пересчитывается при сохранении/удалении отзыва
+    # (см. ratings.py), чтобы каталог мог фильтровать по нему без агрегатов
+    rating_avg = models.FloatField("Средняя оценка", default=0, db_index=True)
+    review_count = models.PositiveIntegerField("Количество отзывов", default=0)
 
     def __str__(self):
         return f"{self.brand} {self.name} ({self.inventory_number})"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Что лежит в БД — чтобы при сохранении сдвинуть остатки по филиалам (см. stock.py)
+        instance._stock_key = instance.stock_key()
+        return instance
+
+    def stock_key(self):
+        """Ключ строки LocationStock; None — без филиала или поля не загружены (.only())."""
+        loaded = self.__dict__
+        if any(field not in loaded for field in STOCK_KEY_FIELDS):
+            return None
+        if self.location_id is None:
+            return None
+        return tuple(loaded[field] for field in STOCK_KEY_FIELDS)
     
     class Meta:
         verbose_name = "Инструмент"
         verbose_name_plural = "Инструменты"
+        indexes = [
+            models.Index(fields=['status'], name='instrument_status_idx'),
+        ]
 
 class InstrumentPhoto(models.Model):
     instrument = models.ForeignKey(Instrument, related_name='photos', on_delete=models.CASCADE)
     image = models.ImageField("Фото", upload_to='instruments/')
+    # Уменьшенные копии фото (см. images.py)
+    variants = models.JSONField("Уменьшенные копии", default=dict, blank=True, editable=False)
+
+    variant_source_field = 'image'
+    VARIANT_SIZES = {'thumb': 320, 'large': 1600}
     
     class Meta:
         verbose_name = "Фото инструмента"
@@ -96,8 +138,12 @@ class Rental(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name="Клиент")
     start_date = models.DateField("Дата начала")
     end_date = models.DateField("Дата возврата", null=True, blank=True)
+    # Фактическая дата возврата (ставится при завершении аренды)
+    returned_at = models.DateField("Фактически возвращен", null=True, blank=True)
     total_price = models.DecimalField("Итоговая стоимость", max_digits=10, decimal_places=2, default=0)
     is_active = models.BooleanField("Активна", default=True)
+    # Ставит фоновая задача overdue_sweep (см. jobs.py)
+    is_overdue = models.BooleanField("Просрочена", default=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
@@ -106,6 +152,28 @@ class Rental(models.Model):
     class Meta:
         verbose_name = "Аренда"
         verbose_name_plural = "Аренды"
+        indexes = [
+            # Проверка пересечений по датам для конкретного инструмента
+            models.Index(
+                fields=['instrument', 'start_date', 'end_date'],
+                condition=models.Q(is_active=True),
+                name='rental_active_period_idx',
+            ),
+            # Поиск "что свободно с X по Y" по всему каталогу
+            models.Index(
+                fields=['start_date', 'end_date'],
+                condition=models.Q(is_active=True),
+                name='rental_active_dates_idx',
+            ),
+            # Личный кабинет: аренды пользователя, новые сверху
+            models.Index(fields=['user', '-created_at', '-id'], name='rental_user_created_idx'),
+            # Пересборка дневных сводок: закрытые аренды по дате возврата
+            models.Index(
+                fields=['returned_at', 'end_date'],
+                condition=models.Q(is_active=False),
+                name='rental_closed_returned_idx',
+            ),
+        ]
 
 class Payment(models.Model):
     rental = models.ForeignKey(Rental, on_delete=models.CASCADE, related_name='payments')
@@ -119,6 +187,9 @@ class Payment(models.Model):
     class Meta:
         verbose_name = "Платеж"
         verbose_name_plural = "Платежи"
+        indexes = [
+            models.Index(fields=['payment_date'], name='payment_date_idx'),
+        ]
 
 class Maintenance(models.Model):
     instrument = models.ForeignKey(Instrument, on_delete=models.CASCADE)
@@ -132,6 +203,9 @@ class Maintenance(models.Model):
     class Meta:
         verbose_name = "Техобслуживание"
         verbose_name_plural = "Журнал ТО"
+        indexes = [
+            models.Index(fields=['instrument', '-date'], name='maintenance_inst_date_idx'),
+        ]
 
 class Review(models.Model):
     instrument = models.ForeignKey(Instrument, on_delete=models.CASCADE, related_name='reviews')
@@ -142,7 +216,201 @@ class Review(models.Model):
 
     def __str__(self):
         return f"Отзыв {self.user.username} на {self.instrument.name}"
+
+    @property
+    def stars(self):
+        return "⭐" * self.rating
     
     class Meta:
         verbose_name = "Отзыв"
-        verbose_name_plural = "Отзывы"
\ No newline at end of file
+        verbose_name_plural = "Отзывы"
+        indexes = [
+            # Страница отзывов на карточке инструмента, новые сверху
+            models.Index(fields=['instrument', '-created_at', '-id'], name='review_inst_created_idx'),
+        ]
+
+class InstrumentDailyStats(models.Model):
+    """
+    Дневная сводка по инструменту для отчетов. Филиал, категория и бренд
+    продублированы, чтобы группировать без JOIN'ов к сырым таблицам.
+    Заполняется сигналами и ночной командой compact_rollups (см. rollups.py).
+    """
+    day = models.DateField("День")
+    instrument = models.ForeignKey(Instrument, on_delete=models.CASCADE, related_name='daily_stats')
+    # У инструмента они необязательны; удаление справочника не должно стирать историю выручки
+    location = models.ForeignKey(Location, on_delete=models.SET_NULL, null=True, related_name='+')
+    category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, related_name='+')
+    brand = models.ForeignKey(Brand, on_delete=models.SET_NULL, null=True, related_name='+')
+    revenue = models.DecimalField("Выручка", max_digits=12, decimal_places=2, default=0)
+    rentals_started = models.PositiveIntegerField("Новых аренд", default=0)
+    rented = models.BooleanField("Был в аренде", default=False)
+    maintenance_cost = models.DecimalField("Затраты на ТО", max_digits=12, decimal_places=2, default=0)
+
+    def __str__(self):
+        return f"{self.instrument_id} за {self.day}"
+
+    class Meta:
+        verbose_name = "Дневная сводка"
+        verbose_name_plural = "Дневные сводки"
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'instrument'], name='daily_stats_day_inst_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['day', 'location'], name='daily_stats_day_loc_idx'),
+            models.Index(fields=['day', 'category'], name='daily_stats_day_cat_idx'),
+            models.Index(fields=['day', 'brand'], name='daily_stats_day_brand_idx'),
+        ]
+
+
+# --- АРХИВ ---
+# Закрытые аренды старше ARCHIVE_AFTER_DAYS переезжают сюда вместе с платежами
+# (команда archive_rentals), чтобы рабочие таблицы не росли бесконечно.
+# id сохраняются прежними.
+
+class ArchivedRental(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    instrument = models.ForeignKey(Instrument, on_delete=models.CASCADE, related_name='+', verbose_name="Инструмент")
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+', verbose_name="Клиент")
+    start_date = models.DateField("Дата начала")
+    end_date = models.DateField("Дата возврата", null=True, blank=True)
+    returned_at = models.DateField("Фактически возвращен", null=True, blank=True)
+    total_price = models.DecimalField("Итоговая стоимость", max_digits=10, decimal_places=2, default=0)
+    created_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    # Архивная аренда всегда завершена
+    is_active = False
+
+    def __str__(self):
+        return f"Аренда #{self.id} (архив)"
+
+    class Meta:
+        verbose_name = "Аренда (архив)"
+        verbose_name_plural = "Аренды (архив)"
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id'], name='archrental_user_created_idx'),
+            models.Index(fields=['returned_at', 'end_date'], name='archrental_returned_idx'),
+        ]
+
+
+class ArchivedPayment(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    rental = models.ForeignKey(ArchivedRental, on_delete=models.CASCADE, related_name='payments')
+    amount = models.DecimalField("Сумма", max_digits=10, decimal_places=2)
+    payment_date = models.DateTimeField()
+    is_successful = models.BooleanField("Успешно", default=True)
+
+    def __str__(self):
+        return f"Платеж {self.amount} р. за аренду #{self.rental_id} (архив)"
+
+    class Meta:
+        verbose_name = "Платеж (архив)"
+        verbose_name_plural = "Платежи (архив)"
+        indexes = [
+            models.Index(fields=['payment_date'], name='archpayment_date_idx'),
+        ]
+
+
+# --- ФОНОВЫЕ ЗАДАЧИ ---
+
+class Job(models.Model):
+    """Очередь фоновых задач в БД (без внешнего брокера), см. jobs.py и run_worker."""
+    STATUS_CHOICES = [
+        ('queued', 'В очереди'),
+        ('running', 'Выполняется'),
+        ('done', 'Готово'),
+        ('failed', 'Ошибка'),
+    ]
+
+    name = models.CharField("Задача", max_length=100)
+    payload = models.JSONField("Параметры", default=dict, blank=True)
+    status = models.CharField("Статус", max_length=10, choices=STATUS_CHOICES, default='queued')
+    # Для периодических задач: не больше одной живой копии на ключ
+    unique_key = models.CharField(max_length=100, null=True, blank=True, editable=False)
+    run_at = models.DateTimeField("Запустить не раньше")
+    attempts = models.PositiveSmallIntegerField("Попыток", default=0)
+    last_error = models.TextField("Последняя ошибка", blank=True)
+    result = models.JSONField("Результат", null=True, blank=True)
+    worker = models.CharField("Воркер", max_length=100, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    # Воркер отмечает, пока задача выполняется (см. jobs.heartbeat)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.name} #{self.id} ({self.status})"
+
+    class Meta:
+        verbose_name = "Фоновая задача"
+        verbose_name_plural = "Фоновые задачи"
+        indexes = [
+            models.Index(fields=['status', 'run_at'], name='job_status_run_at_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['unique_key'],
+                condition=models.Q(status__in=['queued', 'running']),
+                name='job_unique_live_key',
+            ),
+        ]
+
+
+# --- РЕКОМЕНДАЦИИ ---
+# "Часто берут вместе": top-K соседей каждого инструмента, заранее
+# посчитанные командой build_recommendations (см. recommendations.py)
+
+class InstrumentRecommendation(models.Model):
+    instrument = models.ForeignKey(Instrument, on_delete=models.CASCADE, related_name='recommendations')
+    recommended = models.ForeignKey(Instrument, on_delete=models.CASCADE, related_name='+', verbose_name="Рекомендуемый")
+    rank = models.PositiveSmallIntegerField("Место")
+    score = models.FloatField("Сходство")
+
+    def __str__(self):
+        return f"{self.instrument_id} -> {self.recommended_id} (#{self.rank})"
+
+    class Meta:
+        verbose_name = "Рекомендация"
+        verbose_name_plural = "Рекомендации"
+        # Уникальный индекс заодно обслуживает выборку соседей по порядку
+        constraints = [
+            models.UniqueConstraint(fields=['instrument', 'rank'], name='recommendation_rank_uniq'),
+        ]
+
+
+class RecommendationState(models.Model):
+    """Одна строка: до каких аренд и отзывов рекомендации уже посчитаны."""
+    last_rental_id = models.BigIntegerField(default=0)
+    last_review_id = models.BigIntegerField(default=0)
+    built_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Рекомендации: аренды до #{self.last_rental_id}, отзывы до #{self.last_review_id}"
+
+
+# --- ОСТАТКИ ПО ФИЛИАЛАМ ---
+# Сколько инструментов каждой модели/бренда/категории и в каком статусе лежит
+# в филиале. Счетчики двигают события (бронь, отмена, ТО, правка инструмента),
+# а не подсчет на каждый запрос; дрейф исправляет команда rebuild_stock.
+
+class LocationStock(models.Model):
+    location = models.ForeignKey(Location, on_delete=models.CASCADE, related_name='stock', verbose_name="Филиал")
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, null=True, related_name='+', verbose_name="Категория")
+    brand = models.ForeignKey(Brand, on_delete=models.CASCADE, null=True, related_name='+', verbose_name="Бренд")
+    name = models.CharField("Название модели", max_length=100)
+    status = models.CharField("Статус", max_length=20, choices=Instrument.STATUS_CHOICES)
+    count = models.IntegerField("Количество", default=0)
+
+    def __str__(self):
+        return f"{self.location_id}: {self.name} [{self.status}] x{self.count}"
+
+    class Meta:
+        verbose_name = "Остаток в филиале"
+        verbose_name_plural = "Остатки в филиалах"
+        # Без уникальности: у category/brand бывает NULL, а NULL в уникальном
+        # индексе не совпадают. Редкий дубль из-за гонки безвреден — читаем через Sum
+        indexes = [
+            models.Index(fields=['location', 'category', 'brand', 'name', 'status'], name='stock_key_idx'),
+            models.Index(fields=['category', 'status'], name='stock_category_idx'),
+            models.Index(fields=['brand', 'status'], name='stock_brand_idx'),
+        ]
@@ -0,0 +1,158 @@
+"""
+Расчет стоимости аренды: скидки за длительность и штраф за просрочку.
+
+Плановый период [start_date, end_date] оплачивается полностью (со скидкой
+за длительность), даже если инструмент вернули раньше. Каждые сутки после
+end_date считаются просрочкой по повышенному тарифу. Открытая аренда
+(без end_date) оплачивается по факту — до возврата или до сегодня.
+"""
+import datetime
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.conf import settings
+from django.db.models import DecimalField, ExpressionWrapper, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+CENTS = Decimal('0.01')
+MONEY = DecimalField(max_digits=14, decimal_places=2)
+ZERO = Value(Decimal('0'), output_field=MONEY)
+
+
+def rental_days(start, end):
+    return max(1, (end - start).days + 1)
+
+
+def discount_percent(days):
+    # RENTAL_DISCOUNTS: [(от скольких суток, скидка в %), ...]
+    best = 0
+    for min_days, percent in settings.RENTAL_DISCOUNTS:
+        if days >= min_days:
+            best = max(best, percent)
+    return best
+
+
+def rental_total(price_per_day, start, end=None, returned=None, today=None):
+    """
+    Стоимость аренды. returned — фактическая дата возврата (None, если
+    инструмент еще у клиента: тогда считаем на сегодня).
+    """
+    price = Decimal(price_per_day)
+    effective = returned or today or datetime.date.today()
+    if returned is not None and returned < start:
+        # Отменили до начала — платить не за что
+        return Decimal('0.00')
+    effective = max(effective, start)
+
+    if end is not None:
+        days = rental_days(start, end)
+        overdue_days = max(0, (effective - end).days)
+    else:
+        days = rental_days(start, effective)
+        overdue_days = 0
+
+    base = price * days * (100 - discount_percent(days)) / 100
+    overdue = price * overdue_days * Decimal(str(settings.RENTAL_OVERDUE_RATE))
+    return (base + overdue).quantize(CENTS, rounding=ROUND_HALF_UP)
+
+
+def price_rental(rental, price_per_day=None, today=None):
+    """Стоимость для объекта Rental (цену можно передать, чтобы не грузить инструмент)."""
+    if price_per_day is None:
+        price_per_day = rental.instrument.price_per_day
+    return rental_total(price_per_day, rental.start_date, rental.end_date, rental.returned_at, today)
+
+
+def recompute_totals(batch_size=2000, dry_run=False, today=None, rentals=None):
+    """
+    Пересчитывает total_price у всех аренд (или у выборки rentals) пачками
+    по id (keyset, без OFFSET). Сохраняются только изменившиеся суммы.
+    Возвращает (проверено, изменено).
+    """
+    from .models import Rental
+
+    if rentals is None:
+        rentals = Rental.objects.all()
+    today = today or datetime.date.today()
+    checked = changed = 0
+    last_id = 0
+    while True:
+        rows = list(
+            rentals.filter(id__gt=last_id).order_by('id')
+            .values_list('id', 'start_date', 'end_date', 'returned_at', 'is_active', 'total_price',
+                         'instrument__price_per_day')[:batch_size]
+        )
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        checked += len(rows)
+
+        stale = []
+        for rental_id, start, end, returned, is_active, total, price in rows:
+            if not is_active and returned is None:
+                # Старые закрытые аренды без даты возврата: считаем, что вернули
+                # в срок, а открытые без срока оставляем как есть
+                if end is None:
+                    continue
+                returned = end
+            new_total = rental_total(price, start, end, returned, today)
+            if new_total != total:
+                stale.append(Rental(id=rental_id, total_price=new_total))
+        changed += len(stale)
+        if stale and not dry_run:
+            Rental.objects.bulk_update(stale, ['total_price'])
+    return checked, changed
+
+
+def paid_subquery(model=None, **lookup):
+    """
+    Сумма успешных платежей как подзапрос для annotate(), например
+    paid_subquery(rental=OuterRef('pk')). NULL, если платежей нет.
+    model — ArchivedPayment для архивных аренд.
+    """
+    from .models import Payment
+
+    model = model or Payment
+    return Subquery(
+        model.objects.filter(is_successful=True, **lookup)
+        .order_by().values(next(iter(lookup))).annotate(s=Sum('amount')).values('s'),
+        output_field=MONEY,
+    )
+
+
+def billing_summary():
+    """Итоги по всем арендам одним проходом в БД: начислено, оплачено, переплаты."""
+    from .models import Payment, Rental
+
+    billed = Rental.objects.aggregate(s=Coalesce(Sum('total_price'), ZERO))['s']
+    paid = Payment.objects.filter(is_successful=True).aggregate(s=Coalesce(Sum('amount'), ZERO))['s']
+    overpaid = (
+        Rental.objects.annotate(paid=Coalesce(paid_subquery(rental=OuterRef('pk')), ZERO))
+        .filter(paid__gt=F('total_price')).count()
+    )
+    return {'billed': billed, 'paid': paid, 'outstanding': billed - paid, 'overpaid_rentals': overpaid}
+
+
+def outstanding_by_user():
+    """
+    Долг каждого пользователя (начислено минус успешно оплачено), по убыванию.
+    Считается в БД коррелированными подзапросами, в Python ничего не копится.
+    """
+    from django.contrib.auth.models import User
+    from .models import Rental
+
+    billed = Subquery(
+        Rental.objects.filter(user=OuterRef('pk'))
+        .order_by().values('user').annotate(s=Sum('total_price')).values('s'),
+        output_field=MONEY,
+    )
+    return (
+        User.objects
+        .annotate(
+            billed=Coalesce(billed, ZERO),
+            paid=Coalesce(paid_subquery(rental__user=OuterRef('pk')), ZERO),
+        )
+        .annotate(outstanding=ExpressionWrapper(F('billed') - F('paid'), output_field=MONEY))
+        .filter(outstanding__gt=0)
+        .order_by('-outstanding', 'id')
+        .values('id', 'username', 'billed', 'paid', 'outstanding')
+    )
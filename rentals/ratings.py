@@ -0,0 +1,49 @@
+"""
+Денормализованный рейтинг инструмента (rating_avg, review_count).
+"""
+from django.db.models import Avg, Count, FloatField, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .caching import invalidate_model, invalidate_objects
+from .models import Instrument, Review
+
+
+def refresh_instrument_rating(instrument_id):
+    """Пересчитывает рейтинг одного инструмента (вызывается из сигналов)."""
+    stats = Review.objects.filter(instrument_id=instrument_id).aggregate(
+        avg=Avg('rating'), count=Count('id')
+    )
+    Instrument.objects.filter(id=instrument_id).update(
+        rating_avg=stats['avg'] or 0,
+        review_count=stats['count'],
+        # update() не трогает auto_now, а карточка в кэше должна обновиться
+        updated_at=timezone.now(),
+    )
+    invalidate_objects(Instrument, [instrument_id])
+
+
+def rating_subqueries():
+    per_instrument = Review.objects.filter(instrument=OuterRef('pk')).order_by().values('instrument')
+    avg = Subquery(per_instrument.annotate(v=Avg('rating')).values('v'), output_field=FloatField())
+    count = Subquery(per_instrument.annotate(v=Count('id')).values('v'), output_field=IntegerField())
+    return Coalesce(avg, Value(0.0)), Coalesce(count, Value(0))
+
+
+def rebuild_all_ratings():
+    """Пересчитывает рейтинг всех инструментов одним UPDATE. Возвращает число строк."""
+    avg, count = rating_subqueries()
+    updated = Instrument.objects.update(rating_avg=avg, review_count=count, updated_at=timezone.now())
+    invalidate_model(Instrument)
+    return updated
+
+
+def find_stale_ratings():
+    """Инструменты, у которых сохраненный рейтинг разошелся с отзывами."""
+    avg, count = rating_subqueries()
+    return [
+        item for item in Instrument.objects.annotate(real_avg=avg, real_count=count)
+        .values('id', 'rating_avg', 'review_count', 'real_avg', 'real_count')
+        .iterator(chunk_size=2000)
+        if item['review_count'] != item['real_count'] or abs(item['rating_avg'] - item['real_avg']) > 1e-6
+    ]
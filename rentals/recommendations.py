@@ -0,0 +1,222 @@
+"""
+Рекомендации "часто берут вместе" по истории аренд и отзывов.
+
+Корзина клиента — все инструменты, которые он брал (включая архив) или
+оценил на 4-5. Каждая пара инструментов из одной корзины дает +1 к их
+совместному счетчику c_ij; сходство — косинус c_ij / sqrt(n_i * n_j), где
+n_i — число клиентов с инструментом в корзине. Матрица разреженная: только
+ненулевые пары в массивах NumPy (координатный формат, пара упакована в
+одно int64). В InstrumentRecommendation сохраняются top-K соседей каждого
+инструмента, страница читает их одним запросом по индексу.
+
+Пересчет инкрементальный: новые аренды и отзывы (id выше водяного знака в
+RecommendationState) меняют пары только внутри корзин своих клиентов,
+поэтому пересчитываются лишь строки инструментов из этих корзин (нормировка
+в остальных строках может слегка отстать). Удаления отзывов и аренд и этот
+дрейф подбирает полный пересчет (build_recommendations --full).
+
+NumPy импортируется только здесь и только при пересчете: веб-процессу,
+который лишь читает готовую таблицу, он не нужен.
+"""
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import (
+    ArchivedRental, Instrument, InstrumentRecommendation, RecommendationState, Rental, Review,
+)
+
+TOP_K = 8
+# Отзыв с такой оценкой считаем интересом к инструменту
+LIKED_RATING = 4
+# Пара должна встретиться хотя бы у стольких клиентов, иначе это случайность
+MIN_COMMON = 2
+# Корзины крупнее — служебные и оптовые аккаунты: шум и квадратичное число пар
+MAX_BASKET = 300
+# Сколько пар копить перед схлопыванием одинаковых (ограничивает память)
+PAIR_BLOCK = 5_000_000
+# Если затронута такая доля парка, дешевле пересчитать все
+FULL_REBUILD_SHARE = 0.5
+CHUNK = 5000
+IN_CHUNK = 500
+
+
+def _chunks(values, size=IN_CHUNK):
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def _sources():
+    return (
+        Rental.objects.all(),
+        ArchivedRental.objects.all(),
+        Review.objects.filter(rating__gte=LIKED_RATING),
+    )
+
+
+def _baskets(user_ids=None):
+    """{user_id: {instrument_id, ...}} — по всем клиентам или по списку."""
+    baskets = defaultdict(set)
+    for qs in _sources():
+        parts = [qs] if user_ids is None else (qs.filter(user_id__in=chunk) for chunk in _chunks(user_ids))
+        for part in parts:
+            for user_id, inst_id in part.values_list('user_id', 'instrument_id').iterator(chunk_size=CHUNK):
+                baskets[user_id].add(inst_id)
+    return baskets
+
+
+def _users_of(instrument_ids):
+    users = set()
+    for qs in _sources():
+        for chunk in _chunks(instrument_ids):
+            users.update(qs.filter(instrument_id__in=chunk).values_list('user_id', flat=True).distinct())
+    return users
+
+
+def _reduce(np, keys, counts):
+    keys, inverse = np.unique(keys, return_inverse=True)
+    return keys, np.bincount(inverse, weights=counts).astype(np.int64)
+
+
+def cooccurrence(baskets, rows=None):
+    """
+    Совместные счетчики по корзинам: (i, j, count) как массивы NumPy, i != j.
+    rows — оставить только строки этих инструментов (инкрементальный пересчет).
+    """
+    import numpy as np
+
+    row_ids = None if rows is None else np.fromiter(rows, dtype=np.int64, count=len(rows))
+    keys = np.empty(0, dtype=np.int64)
+    counts = np.empty(0, dtype=np.int64)
+    pending, pending_size = [], 0
+    for items in baskets.values():
+        if len(items) < 2 or len(items) > MAX_BASKET:
+            continue
+        arr = np.fromiter(items, dtype=np.int64, count=len(items))
+        i = np.repeat(arr, len(arr))
+        j = np.tile(arr, len(arr))
+        mask = i != j
+        if row_ids is not None:
+            mask &= np.isin(i, row_ids)
+        packed = (i[mask] << 32) | j[mask]
+        pending.append(packed)
+        pending_size += len(packed)
+        if pending_size >= PAIR_BLOCK:
+            block = np.concatenate(pending)
+            keys, counts = _reduce(np, np.concatenate([keys, block]),
+                                   np.concatenate([counts, np.ones(len(block), dtype=np.int64)]))
+            pending, pending_size = [], 0
+    if pending:
+        block = np.concatenate(pending)
+        keys, counts = _reduce(np, np.concatenate([keys, block]),
+                               np.concatenate([counts, np.ones(len(block), dtype=np.int64)]))
+    return keys >> 32, keys & 0xFFFFFFFF, counts
+
+
+def popularity(instrument_ids=None):
+    """n_i: у скольких клиентов инструмент в корзине (пары без повторов считает БД)."""
+    pairs = [qs.values('instrument_id', 'user_id') for qs in _sources()]
+    if instrument_ids is None:
+        union = pairs[0].union(*pairs[1:])
+        return Counter(row['instrument_id'] for row in union.iterator(chunk_size=CHUNK))
+    result = Counter()
+    for chunk in _chunks(instrument_ids):
+        union = pairs[0].filter(instrument_id__in=chunk).union(
+            *(qs.filter(instrument_id__in=chunk) for qs in pairs[1:])
+        )
+        result.update(row['instrument_id'] for row in union.iterator(chunk_size=CHUNK))
+    return result
+
+
+def top_neighbours(i, j, counts, sizes, top_k=TOP_K):
+    """Косинусное сходство и top-K соседей каждой строки: (i, j, score, rank)."""
+    import numpy as np
+
+    keep = counts >= MIN_COMMON
+    i, j, counts = i[keep], j[keep], counts[keep]
+    n_i = np.array([sizes.get(int(x), 1) for x in i], dtype=np.float64)
+    n_j = np.array([sizes.get(int(x), 1) for x in j], dtype=np.float64)
+    scores = counts / np.sqrt(np.maximum(n_i * n_j, 1))
+
+    # Сортировка: по строке, внутри — по убыванию сходства, при равенстве по id
+    order = np.lexsort((j, -scores, i))
+    i, j, scores = i[order], j[order], scores[order]
+    if not len(i):
+        return i, j, scores, i
+    starts = np.flatnonzero(np.r_[True, i[1:] != i[:-1]])
+    rank = np.arange(len(i)) - np.repeat(starts, np.diff(np.r_[starts, len(i)]))
+    keep = rank < top_k
+    return i[keep], j[keep], scores[keep], rank[keep]
+
+
+def _save(rows, i, j, scores, ranks, batch_size=2000):
+    objs = [
+        InstrumentRecommendation(instrument_id=a, recommended_id=b, score=round(s, 6), rank=r + 1)
+        for a, b, s, r in zip(i.tolist(), j.tolist(), scores.tolist(), ranks.tolist())
+    ]
+    with transaction.atomic():
+        if rows is None:
+            InstrumentRecommendation.objects.all().delete()
+        else:
+            for chunk in _chunks(rows):
+                InstrumentRecommendation.objects.filter(instrument_id__in=chunk).delete()
+        InstrumentRecommendation.objects.bulk_create(objs, batch_size=batch_size)
+    return len(objs)
+
+
+def refresh_recommendations(full=False, top_k=TOP_K):
+    """
+    Пересчитывает рекомендации: полностью или только для инструментов,
+    задетых новыми арендами/отзывами. Возвращает статистику для лога.
+    """
+    state, _ = RecommendationState.objects.get_or_create(pk=1)
+    # Водяные знаки берем до чтения корзин: то, что появится позже,
+    # в худшем случае обработается дважды, но не потеряется
+    last_rental = Rental.objects.aggregate(m=Max('id'))['m'] or 0
+    last_review = Review.objects.aggregate(m=Max('id'))['m'] or 0
+
+    rows = None
+    if not full and state.built_at is not None:
+        users = set(
+            Rental.objects.filter(id__gt=state.last_rental_id, id__lte=last_rental).values_list('user_id', flat=True)
+        ) | set(
+            Review.objects.filter(id__gt=state.last_review_id, id__lte=last_review, rating__gte=LIKED_RATING)
+            .values_list('user_id', flat=True)
+        )
+        rows = set().union(*_baskets(users).values()) if users else set()
+        if len(rows) > FULL_REBUILD_SHARE * Instrument.objects.count():
+            rows = None
+
+    saved = baskets = 0
+    if rows is None or rows:
+        user_baskets = _baskets() if rows is None else _baskets(_users_of(rows))
+        i, j, counts = cooccurrence(user_baskets, rows)
+        if rows is None:
+            sizes = popularity()
+        else:
+            sizes = popularity(rows | set(j[counts >= MIN_COMMON].tolist()))
+        i, j, scores, ranks = top_neighbours(i, j, counts, sizes, top_k)
+        saved = _save(rows, i, j, scores, ranks)
+        baskets = len(user_baskets)
+
+    state.last_rental_id, state.last_review_id = last_rental, last_review
+    state.built_at = timezone.now()
+    state.save()
+    return {
+        'mode': 'full' if rows is None else 'incremental',
+        'rows': None if rows is None else len(rows),
+        'baskets': baskets,
+        'saved': saved,
+    }
+
+
+def recommendations_for(instrument_id, limit=TOP_K):
+    """Готовые рекомендации инструмента (один запрос по индексу). Инструменты на ТО не предлагаем."""
+    return (
+        InstrumentRecommendation.objects.filter(instrument_id=instrument_id)
+        .exclude(recommended__status='maintenance')
+        .select_related('recommended').order_by('rank')[:limit]
+    )
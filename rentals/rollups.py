@@ -0,0 +1,236 @@
+"""
+Дневные сводки для отчетов: выручка, новые аренды, загрузка и затраты на ТО
+по каждому инструменту (с филиалом, категорией и брендом).
+
+Выручка, новые аренды и ТО прибавляются сразу по событиям (сигналы на
+Payment/Rental/Maintenance) атомарным UPDATE ... SET x = x + n. Флаг "был
+в аренде" и исправление дрейфа (удаленные платежи, отмены, массовые правки)
+делает ночная compact_rollups: она заново собирает последние дни из сырых
+таблиц и перезаписывает их целиком. Отчеты читают только сводку.
+"""
+import datetime
+from collections import Counter, defaultdict
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .availability import overlapping_rentals
+from .models import (
+    ArchivedPayment, ArchivedRental, Brand, Category, Instrument, InstrumentDailyStats, Location,
+    Maintenance, Payment, Rental,
+)
+
+# Разрезы отчетов: параметр group -> поле сводки
+GROUPS = {
+    'day': 'day',
+    'instrument': 'instrument_id',
+    'location': 'location_id',
+    'category': 'category_id',
+    'brand': 'brand_id',
+}
+GROUP_NAMES = {'location': Location, 'category': Category, 'brand': Brand, 'instrument': Instrument}
+# Подпись группы для инструментов без филиала/категории/бренда (и удаленных справочников)
+NO_DIMENSION = 'Не указан'
+
+
+def bump(day, instrument_id, **deltas):
+    """Прибавляет счетчики к сводке инструмента за день, создавая строку при необходимости."""
+    stats = InstrumentDailyStats.objects.filter(day=day, instrument_id=instrument_id)
+    updates = {field: F(field) + value for field, value in deltas.items()}
+    if stats.update(**updates):
+        return
+
+    dims = Instrument.objects.filter(id=instrument_id).values('location_id', 'category_id', 'brand_id').first()
+    if dims is None:
+        return
+    try:
+        with transaction.atomic():
+            InstrumentDailyStats.objects.create(day=day, instrument_id=instrument_id, **dims, **deltas)
+    except IntegrityError:
+        # Параллельный запрос успел создать строку первым
+        stats.update(**updates)
+
+
+def record_rentals_started(rentals):
+    """Для bulk_create, который не шлет сигналы."""
+    for (day, instrument_id), count in Counter((r.start_date, r.instrument_id) for r in rentals).items():
+        bump(day, instrument_id, rentals_started=count)
+
+
+def record_payment(payment):
+    if not payment.is_successful:
+        return
+    instrument_id = Rental.objects.filter(id=payment.rental_id).values_list('instrument_id', flat=True).first()
+    if instrument_id is not None:
+        bump(timezone.localdate(payment.payment_date), instrument_id, revenue=payment.amount)
+
+
+# --- ПЕРЕСБОРКА ОКНА ИЗ СЫРЫХ ДАННЫХ ---
+def _day_range(start, end):
+    for offset in range((end - start).days + 1):
+        yield start + datetime.timedelta(days=offset)
+
+
+def _rentals_in_window(start, end):
+    """(instrument_id, start_date, end_date, returned_at, is_active) аренд, задевающих окно."""
+    fields = ('instrument_id', 'start_date', 'end_date', 'returned_at')
+    active = overlapping_rentals(start, end).values_list(*fields)
+    yield from (row + (True,) for row in active.iterator(chunk_size=5000))
+    # Закрытые аренды (и рабочие, и архивные) ищем по дате возврата;
+    # у старых записей без returned_at считаем, что вернули в срок
+    returned_in_window = Q(returned_at__gte=start) | Q(returned_at__isnull=True, end_date__gte=start)
+    for closed in (Rental.objects.filter(is_active=False), ArchivedRental.objects.all()):
+        yield from (
+            row + (False,)
+            for row in closed.filter(returned_in_window, start_date__lte=end)
+            .values_list(*fields).iterator(chunk_size=5000)
+        )
+
+
+def build_window(start, end):
+    """
+    Собирает сводку за [start, end] из аренд, платежей (с архивом) и ТО: {(day, inst_id): поля}.
+    Будущие дни не заполняются: занятость пишем только по сегодня.
+    """
+    rows = defaultdict(lambda: {
+        'revenue': Decimal('0'), 'rentals_started': 0, 'rented': False, 'maintenance_cost': Decimal('0'),
+    })
+
+    today = timezone.localdate()
+    for inst_id, rent_start, rent_end, returned, active in _rentals_in_window(start, end):
+        if returned is not None and returned < rent_start:
+            continue  # отменили до начала
+        if active and (rent_end is None or rent_end < today):
+            # Открытая или просроченная аренда держит инструмент по сегодня,
+            # как и в availability.overlapping_rentals
+            last = today
+        else:
+            last = returned or rent_end
+        if start <= rent_start <= end:
+            rows[rent_start, inst_id]['rentals_started'] += 1
+        for day in _day_range(max(rent_start, start), min(last, end, today)):
+            rows[day, inst_id]['rented'] = True
+
+    tz = timezone.get_current_timezone()
+    since = datetime.datetime.combine(start, datetime.time.min, tzinfo=tz)
+    until = datetime.datetime.combine(end + datetime.timedelta(days=1), datetime.time.min, tzinfo=tz)
+    for model in (Payment, ArchivedPayment):
+        payments = (
+            model.objects.filter(is_successful=True, payment_date__gte=since, payment_date__lt=until)
+            .annotate(day=TruncDate('payment_date'))
+            .values('day', 'rental__instrument_id').annotate(total=Sum('amount')).order_by()
+        )
+        for row in payments:
+            rows[row['day'], row['rental__instrument_id']]['revenue'] += row['total']
+
+    maintenance = (
+        Maintenance.objects.filter(date__range=(start, end))
+        .values('date', 'instrument_id').annotate(total=Sum('cost')).order_by()
+    )
+    for row in maintenance:
+        rows[row['date'], row['instrument_id']]['maintenance_cost'] += row['total']
+    return rows
+
+
+def compact_window(start, end, batch_size=2000):
+    """
+    Перезаписывает сводку за [start, end] тем, что лежит в сырых таблицах.
+    Пустые строки не сохраняются. Возвращает число записанных строк.
+    """
+    rows = build_window(start, end)
+    dims = {
+        inst_id: {'location_id': loc, 'category_id': cat, 'brand_id': brand}
+        for inst_id, loc, cat, brand in Instrument.objects.filter(id__in={i for _, i in rows})
+        .values_list('id', 'location_id', 'category_id', 'brand_id').iterator(chunk_size=5000)
+    }
+    objs = [
+        InstrumentDailyStats(day=day, instrument_id=inst_id, **dims[inst_id], **fields)
+        for (day, inst_id), fields in rows.items()
+        if inst_id in dims
+    ]
+    with transaction.atomic():
+        InstrumentDailyStats.objects.filter(day__range=(start, end)).delete()
+        InstrumentDailyStats.objects.bulk_create(objs, batch_size=batch_size)
+    return len(objs)
+
+
+# --- ОТЧЕТЫ ---
+def _stats(start, end, filters):
+    stats = InstrumentDailyStats.objects.filter(day__range=(start, end))
+    for dim in ('location', 'category', 'brand'):
+        if filters.get(dim):
+            stats = stats.filter(**{f'{dim}_id': filters[dim]})
+    return stats
+
+
+def _names(group, keys):
+    model = GROUP_NAMES.get(group)
+    if model is None:
+        return {}
+    names = dict(model.objects.filter(id__in=[k for k in keys if k is not None]).values_list('id', 'name'))
+    if None in keys:
+        names[None] = NO_DIMENSION
+    return names
+
+
+def revenue_report(start, end, group='day', **filters):
+    key = GROUPS[group]
+    rows = list(
+        _stats(start, end, filters).values(key)
+        .annotate(
+            revenue=Sum('revenue'), rentals_started=Sum('rentals_started'),
+            maintenance_cost=Sum('maintenance_cost'),
+        )
+        .order_by(key)
+    )
+    names = _names(group, [row[key] for row in rows])
+    return [
+        {
+            'key': row[key], 'name': names.get(row[key]),
+            'revenue': row['revenue'], 'rentals_started': row['rentals_started'],
+            'maintenance_cost': row['maintenance_cost'], 'profit': row['revenue'] - row['maintenance_cost'],
+        }
+        for row in rows
+    ]
+
+
+def utilization_report(start, end, group='location', **filters):
+    """
+    Доля инструменто-дней в аренде. Знаменатель — текущее число инструментов
+    в группе (для разреза по дням — во всем отобранном парке).
+    """
+    key = GROUPS[group]
+    days = (end - start).days + 1
+    rows = list(
+        _stats(start, end, filters).values(key)
+        .annotate(rented_days=Count('id', filter=Q(rented=True)))
+        .order_by(key)
+    )
+
+    fleet = Instrument.objects.all()
+    for dim in ('location', 'category', 'brand'):
+        if filters.get(dim):
+            fleet = fleet.filter(**{f'{dim}_id': filters[dim]})
+    if group in ('location', 'category', 'brand'):
+        sizes = dict(fleet.values_list(key).annotate(n=Count('id')).order_by())
+    elif group == 'day':
+        total = fleet.count()
+
+    names = _names(group, [row[key] for row in rows])
+    result = []
+    for row in rows:
+        if group == 'day':
+            capacity = total
+        elif group == 'instrument':
+            capacity = days
+        else:
+            capacity = sizes.get(row[key], 0) * days
+        result.append({
+            'key': row[key], 'name': names.get(row[key]),
+            'rented_days': row['rented_days'], 'capacity_days': capacity,
+            'utilization': round(row['rented_days'] / capacity, 4) if capacity else None,
+        })
+    return result
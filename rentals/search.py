@@ -0,0 +1,256 @@
+"""
+Поиск инструментов по названию, бренду, категории, описанию и инвентарному
+номеру с ранжированием и допуском опечаток.
+
+На PostgreSQL работает через pg_trgm и полнотекстовый поиск (индексы создает
+миграция 0006). На остальных СУБД используется триграммный инвертированный
+индекс в памяти процесса: он строится лениво при первом поиске, обновляется
+сигналами при сохранении/удалении и раз в несколько секунд догоняет изменения,
+сделанные другими процессами (по Instrument.updated_at).
+"""
+import math
+import re
+import threading
+import time
+from collections import Counter, defaultdict, namedtuple
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count, Max, Q
+
+from .models import Instrument
+
+Hit = namedtuple('Hit', 'id score')
+
+# Вес поля в ранжировании
+FIELD_WEIGHTS = {
+    'name': 1.0,
+    'inventory_number': 1.0,
+    'brand': 0.8,
+    'category': 0.6,
+    'description': 0.3,
+}
+# Доля совпавших триграмм слова, начиная с которой считаем совпадение (опечатки)
+MIN_SIMILARITY = 0.45
+# Бонус за точное совпадение слова
+EXACT_BONUS = 0.5
+SYNC_INTERVAL = 5  # секунд между проверками изменений в БД
+
+_word_re = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    return _word_re.findall((text or '').lower().replace('ё', 'е'))
+
+
+def trigrams(token):
+    padded = f'  {token} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _document(row):
+    return {
+        'name': row['name'],
+        'inventory_number': row['inventory_number'],
+        'brand': row['brand__name'],
+        'category': row['category__name'],
+        'description': row['description'],
+    }
+
+
+DOC_FIELDS = ('id', 'name', 'inventory_number', 'description', 'brand__name', 'category__name', 'updated_at')
+
+
+class MemoryIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self._built = False
+        self._postings = {field: defaultdict(set) for field in FIELD_WEIGHTS}
+        self._tokens = {field: defaultdict(set) for field in FIELD_WEIGHTS}
+        self._docs = {}  # id -> {field: (tokens, trigrams)}
+        self._synced_at = None  # максимальный updated_at, который мы видели
+        self._checked = 0.0
+
+    # --- наполнение ---
+
+    def _add(self, inst_id, document):
+        self._remove(inst_id)
+        stored = {}
+        for field, text in document.items():
+            tokens = set(tokenize(text))
+            grams = set().union(*(trigrams(t) for t in tokens)) if tokens else set()
+            for gram in grams:
+                self._postings[field][gram].add(inst_id)
+            for token in tokens:
+                self._tokens[field][token].add(inst_id)
+            stored[field] = (tokens, grams)
+        self._docs[inst_id] = stored
+
+    def _remove(self, inst_id):
+        stored = self._docs.pop(inst_id, None)
+        if not stored:
+            return
+        for field, (tokens, grams) in stored.items():
+            for gram in grams:
+                self._postings[field][gram].discard(inst_id)
+            for token in tokens:
+                self._tokens[field][token].discard(inst_id)
+
+    def _stamp(self):
+        return Instrument.objects.order_by().aggregate(last=Max('updated_at'), count=Count('id'))
+
+    def rebuild(self):
+        with self._lock:
+            self._reset()
+            stamp = self._stamp()
+            for row in Instrument.objects.values(*DOC_FIELDS).iterator(chunk_size=2000):
+                self._add(row['id'], _document(row))
+            self._synced_at = stamp['last']
+            self._built = True
+            self._checked = time.monotonic()
+
+    def _sync(self):
+        """Догоняет изменения из БД (в том числе сделанные другими процессами)."""
+        if time.monotonic() - self._checked < SYNC_INTERVAL:
+            return
+        self._checked = time.monotonic()
+        stamp = self._stamp()
+        if stamp['last'] != self._synced_at:
+            changed = Instrument.objects.all()
+            if self._synced_at is not None:
+                changed = changed.filter(updated_at__gt=self._synced_at)
+            for row in changed.values(*DOC_FIELDS):
+                self._add(row['id'], _document(row))
+        self._synced_at = stamp['last']
+        if stamp['count'] != len(self._docs):
+            # Что-то удалили мимо сигналов — проще перестроить целиком
+            self.rebuild()
+
+    def ensure_ready(self):
+        with self._lock:
+            if not self._built:
+                self.rebuild()
+            else:
+                self._sync()
+
+    def update(self, instrument_ids):
+        """Переиндексирует инструменты (вызывается из сигналов)."""
+        with self._lock:
+            if not self._built:
+                return
+            found = set()
+            for row in Instrument.objects.filter(id__in=instrument_ids).values(*DOC_FIELDS):
+                self._add(row['id'], _document(row))
+                found.add(row['id'])
+            for inst_id in set(instrument_ids) - found:
+                self._remove(inst_id)
+
+    def remove(self, inst_id):
+        with self._lock:
+            if self._built:
+                self._remove(inst_id)
+
+    # --- поиск ---
+
+    def search(self, query, limit=50):
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens:
+            return []
+        self.ensure_ready()
+
+        with self._lock:
+            per_token = []
+            for token in tokens:
+                grams = trigrams(token)
+                best = {}
+                for field, weight in FIELD_WEIGHTS.items():
+                    overlap = Counter()
+                    for gram in grams:
+                        overlap.update(self._postings[field].get(gram, ()))
+                    exact = self._tokens[field].get(token, ())
+                    for inst_id, shared in overlap.items():
+                        similarity = shared / len(grams)
+                        if similarity < MIN_SIMILARITY:
+                            continue
+                        score = weight * (similarity + (EXACT_BONUS if inst_id in exact else 0))
+                        if score > best.get(inst_id, 0):
+                            best[inst_id] = score
+                per_token.append(best)
+
+        # Сначала требуем совпадения всех слов, если так ничего нет — хотя бы половины
+        scores = Counter()
+        matched = Counter()
+        for best in per_token:
+            for inst_id, score in best.items():
+                scores[inst_id] += score
+                matched[inst_id] += 1
+        required = len(tokens)
+        hits = [i for i in scores if matched[i] >= required]
+        if not hits:
+            required = math.ceil(len(tokens) / 2)
+            hits = [i for i in scores if matched[i] >= required]
+
+        hits.sort(key=lambda i: (-scores[i], i))
+        return [Hit(i, round(scores[i] / len(tokens), 4)) for i in hits[:limit]]
+
+
+class PostgresSearch:
+    """pg_trgm для названий/бренда/категории/номера + полнотекстовый поиск по описанию."""
+
+    def search(self, query, limit=50):
+        from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, TrigramWordSimilarity
+        from django.db.models.functions import Greatest
+
+        if not tokenize(query):
+            return []
+        text_query = SearchQuery(query, config='simple', search_type='websearch')
+        # Выражение совпадает с индексом rentals_instrument_description_fts
+        description = SearchVector('description', config='simple')
+        rows = (
+            Instrument.objects
+            .annotate(
+                similarity=Greatest(
+                    TrigramWordSimilarity(query, 'name'),
+                    TrigramWordSimilarity(query, 'inventory_number'),
+                    TrigramWordSimilarity(query, 'brand__name') * FIELD_WEIGHTS['brand'],
+                    TrigramWordSimilarity(query, 'category__name') * FIELD_WEIGHTS['category'],
+                ),
+                rank=SearchRank(description, text_query) * FIELD_WEIGHTS['description'],
+            )
+            .filter(
+                Q(name__trigram_word_similar=query)
+                | Q(inventory_number__icontains=query)
+                | Q(brand__name__trigram_word_similar=query)
+                | Q(category__name__trigram_word_similar=query)
+                | Q(description__search=text_query)
+            )
+            .order_by('-similarity', '-rank', 'id')
+            .values_list('id', 'similarity', 'rank')[:limit]
+        )
+        return [Hit(inst_id, round(similarity + rank, 4)) for inst_id, similarity, rank in rows]
+
+
+memory_index = MemoryIndex()
+postgres_search = PostgresSearch()
+
+
+def get_backend():
+    choice = getattr(settings, 'SEARCH_BACKEND', 'auto')
+    if choice == 'postgres' or (choice == 'auto' and connection.vendor == 'postgresql'):
+        return postgres_search
+    return memory_index
+
+
+def search_instruments(query, limit=50):
+    return get_backend().search(query, limit)
+
+
+def reindex_instruments(instrument_ids):
+    memory_index.update(instrument_ids)
+
+
+def unindex_instrument(instrument_id):
+    memory_index.remove(instrument_id)
@@ -0,0 +1,130 @@
+from django.db.models.signals import post_delete, post_save
+from django.db import transaction
+from django.dispatch import receiver
+
+from .caching import invalidate_filter_lists, invalidate_model, invalidate_objects
+from .images import needs_variants, schedule_variants
+from .models import (
+    Brand, Category, Instrument, InstrumentPhoto, Location, Maintenance, Payment, Rental,
+    Review, UserProfile,
+)
+from .ratings import refresh_instrument_rating
+from .rollups import bump, record_payment
+from .search import reindex_instruments, unindex_instrument
+from .stock import move as move_stock, rebuild_stock
+
+
+# --- СБРОС КЭША ФИЛЬТРОВ КАТАЛОГА ---
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=Brand)
+@receiver([post_save, post_delete], sender=Location)
+def reset_filter_lists(sender, **kwargs):
+    invalidate_filter_lists()
+
+
+# --- СБРОС КЭША ОБЪЕКТОВ ---
+@receiver([post_save, post_delete], sender=Instrument)
+def reset_cached_instrument(sender, instance, **kwargs):
+    invalidate_objects(Instrument, [instance.pk])
+
+
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=Brand)
+@receiver([post_save, post_delete], sender=Location)
+def reset_cached_reference(sender, instance, **kwargs):
+    invalidate_objects(sender, [instance.pk])
+    # Справочник вшит в закэшированные инструменты через select_related
+    invalidate_model(Instrument)
+
+
+# --- ОСТАТКИ ПО ФИЛИАЛАМ ---
+# Такой save() — смена статуса: остатки уже сдвинул record_status_change()
+STATUS_ONLY_FIELDS = {'status', 'updated_at'}
+
+
+@receiver(post_save, sender=Instrument)
+def update_stock(sender, instance, created, update_fields=None, **kwargs):
+    new_key = instance.stock_key()
+    if created:
+        move_stock(None, new_key)
+    elif update_fields is not None and set(update_fields) <= STATUS_ONLY_FIELDS:
+        pass
+    elif hasattr(instance, '_stock_key'):
+        move_stock(instance._stock_key, new_key)
+    else:
+        # Объект собран вручную, старый ключ неизвестен: не читаем его на
+        # каждом сохранении, а пересчитываем остатки после коммита
+        transaction.on_commit(rebuild_stock)
+    instance._stock_key = new_key
+
+
+@receiver(post_delete, sender=Instrument)
+def drop_from_stock(sender, instance, **kwargs):
+    move_stock(getattr(instance, '_stock_key', instance.stock_key()), None)
+
+
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Brand)
+@receiver(post_delete, sender=Location)
+def rebuild_stock_after_reference_delete(sender, **kwargs):
+    # Инструменты получили NULL вместо ссылки массовым UPDATE, без сигналов
+    transaction.on_commit(rebuild_stock)
+
+
+# --- РЕЙТИНГ ИНСТРУМЕНТА ---
+@receiver([post_save, post_delete], sender=Review)
+def update_instrument_rating(sender, instance, **kwargs):
+    refresh_instrument_rating(instance.instrument_id)
+
+
+# --- УМЕНЬШЕННЫЕ КОПИИ КАРТИНОК ---
+@receiver(post_save, sender=InstrumentPhoto)
+@receiver(post_save, sender=UserProfile)
+def build_image_variants(sender, instance, **kwargs):
+    if needs_variants(instance):
+        schedule_variants(instance)
+
+
+# --- ПОИСКОВЫЙ ИНДЕКС ---
+# Поля, которые не участвуют в поиске: их смена не требует переиндексации
+NOT_INDEXED_FIELDS = {'status', 'updated_at', 'rating_avg', 'review_count'}
+
+
+@receiver(post_save, sender=Instrument)
+def index_instrument(sender, instance, update_fields=None, **kwargs):
+    if update_fields and set(update_fields) <= NOT_INDEXED_FIELDS:
+        return
+    reindex_instruments([instance.id])
+
+
+@receiver(post_delete, sender=Instrument)
+def drop_instrument_from_index(sender, instance, **kwargs):
+    unindex_instrument(instance.id)
+
+
+@receiver(post_save, sender=Brand)
+@receiver(post_save, sender=Category)
+def reindex_by_reference(sender, instance, **kwargs):
+    # Переименование бренда/категории меняет документы всех их инструментов
+    field = 'brand' if sender is Brand else 'category'
+    reindex_instruments(list(Instrument.objects.filter(**{field: instance}).values_list('id', flat=True)))
+
+
+# --- ДНЕВНЫЕ СВОДКИ ДЛЯ ОТЧЕТОВ ---
+# Правки и удаления не отслеживаем: их подберет ночная compact_rollups
+@receiver(post_save, sender=Rental)
+def count_rental_started(sender, instance, created, **kwargs):
+    if created:
+        bump(instance.start_date, instance.instrument_id, rentals_started=1)
+
+
+@receiver(post_save, sender=Payment)
+def count_payment(sender, instance, created, **kwargs):
+    if created:
+        record_payment(instance)
+
+
+@receiver(post_save, sender=Maintenance)
+def count_maintenance(sender, instance, created, **kwargs):
+    if created:
+        bump(instance.date, instance.instrument_id, maintenance_cost=instance.cost)
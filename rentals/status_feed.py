@@ -0,0 +1,183 @@
+"""
+Лента изменений статусов инструментов (push вместо поллинга).
+
+Каждое изменение статуса получает номер версии из монотонного счетчика;
+опрос БД подтягивает его к времени опроса в мс, поэтому версии разных
+процессов сравнимы и клиент может переподключиться к другому воркеру.
+Открытая вкладка каталога держит
+одно SSE-соединение и получает только те инструменты, которые изменились
+после ее последней версии.
+
+Источник правды — БД: любая смена статуса (бронь и отмена в другом воркере,
+start_due_rentals в run_worker, правка в админке) двигает
+Instrument.updated_at. Пока в процессе кто-то ждет, одна задача на event
+loop раз в POLL_INTERVAL читает изменившиеся инструменты (по индексу
+updated_at) и публикует их в ленту. publish_on_commit() публикует изменения
+своего процесса сразу, не дожидаясь опроса; опрос их потом узнает и не
+дублирует.
+
+Сами ожидающие клиенты запросов к БД не делают: все они спят на одном
+общем asyncio.Event своего event loop, и один publish() будит их разом.
+"""
+import asyncio
+import datetime
+import logging
+import threading
+from collections import OrderedDict
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Instrument
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL = 1.0  # секунд между опросами БД, пока есть ожидающие
+# Транзакция может закоммититься позже изменений с бОльшим updated_at:
+# каждый опрос захватывает еще столько назад
+POLL_OVERLAP = datetime.timedelta(seconds=10)
+
+
+def _ms(moment):
+    return int(moment.timestamp() * 1000)
+
+
+class StatusFeed:
+    def __init__(self, history=5000, poll_interval=POLL_INTERVAL):
+        self._lock = threading.Lock()
+        # Стартуем с "часов", чтобы после перезапуска сервера версии
+        # не пошли заново с нуля и клиенты не пропустили изменения
+        started = timezone.now()
+        self._version = _ms(started)
+        # Минимальная версия, начиная с которой мы еще можем отдать дельту
+        self._floor = self._version
+        self._history = history
+        # instrument_id -> (версия, статус), упорядочено по версии
+        self._latest = OrderedDict()
+        # Одно событие на каждый event loop, в котором кто-то ждет
+        self._events = {}
+        # Опрос БД: последний увиденный updated_at и что уже видели в окне перекрытия
+        self.poll_interval = poll_interval
+        self._cursor = started
+        self._seen = {}
+        self._watchers = set()
+
+    @property
+    def version(self):
+        return self._version
+
+    def publish(self, changes):
+        """
+        Принимает словарь {instrument_id: status}, увеличивает версию
+        и будит всех ожидающих. Можно вызывать из любого потока.
+        Статус, который лента уже отдает для инструмента, повторно не публикуется.
+        """
+        with self._lock:
+            published = False
+            for inst_id, status in changes.items():
+                if self._latest.get(inst_id, (None, None))[1] == status:
+                    continue
+                self._version += 1
+                self._latest.pop(inst_id, None)
+                self._latest[inst_id] = (self._version, status)
+                published = True
+            if not published:
+                return self._version
+
+            # Старые записи выбрасываем, клиенты с такой версией получат reset
+            while len(self._latest) > self._history:
+                _, (old_version, _) = self._latest.popitem(last=False)
+                self._floor = old_version
+
+            version = self._version
+            events, self._events = self._events, {}
+
+        for loop, event in events.items():
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # Loop уже закрыт — будить некого
+                pass
+        return version
+
+    async def poll(self):
+        """Один опрос БД: публикует смены статусов, сделанные любым процессом."""
+        started = timezone.now()
+        since = self._cursor - POLL_OVERLAP
+        rows = (
+            Instrument.objects.filter(updated_at__gt=since)
+            .order_by('updated_at', 'id').values('id', 'status', 'updated_at')
+        )
+        rows = [row async for row in rows]
+        with self._lock:
+            fresh = [row for row in rows if self._seen.get(row['id']) != row['updated_at']]
+            self._seen.update((row['id'], row['updated_at']) for row in fresh)
+            if fresh:
+                self._cursor = max(self._cursor, fresh[-1]['updated_at'])
+            self._seen = {inst_id: at for inst_id, at in self._seen.items() if at > self._cursor - POLL_OVERLAP}
+            # Все, что закоммичено до начала опроса, теперь в ленте: версия
+            # не меньше времени опроса, новые изменения получат версии после него
+            self._version = max(self._version, _ms(started))
+        self.publish({row['id']: row['status'] for row in fresh})
+
+    async def _watch(self, loop):
+        try:
+            while True:
+                await asyncio.sleep(self.poll_interval)
+                await self.poll()
+                with self._lock:
+                    # Никто не ждет — до следующего wait() БД не опрашиваем
+                    if loop not in self._events:
+                        self._watchers.discard(loop)
+                        return
+        except Exception:
+            logger.exception("Опрос статусов упал")
+            with self._lock:
+                self._watchers.discard(loop)
+
+    def changes_since(self, version):
+        """
+        Возвращает (текущая_версия, {id: status}) с изменениями после version.
+        Если version слишком старая или "из будущего" (сервер перезапущен),
+        вместо словаря возвращается None — клиенту нужно перечитать статусы.
+        """
+        with self._lock:
+            if version < self._floor or version > self._version:
+                return self._version, None
+
+            changed = {}
+            for inst_id, (item_version, status) in reversed(self._latest.items()):
+                if item_version <= version:
+                    break
+                changed[inst_id] = status
+            return self._version, changed
+
+    async def wait(self, version, timeout):
+        """
+        Ждет, пока версия уйдет дальше version, но не дольше timeout секунд.
+        Возвращает True, если появились изменения.
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._version != version:
+                return True
+            event = self._events.get(loop)
+            if event is None:
+                event = self._events[loop] = asyncio.Event()
+            if loop not in self._watchers:
+                self._watchers.add(loop)
+                loop.create_task(self._watch(loop))
+
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+
+feed = StatusFeed()
+
+
+def publish_on_commit(changes):
+    """Публикует изменения только после успешного коммита транзакции."""
+    transaction.on_commit(lambda: feed.publish(changes))
@@ -0,0 +1,162 @@
+"""
+Остатки по филиалам: сколько инструментов каждой модели/бренда/категории
+и в каком статусе лежит в каждом филиале (таблица LocationStock).
+
+Счетчики двигаются по событиям. Смену статуса (бронь, отмена, пакетная
+бронь, start_due_rentals) код учитывает сам через record_status_change() —
+одним UPDATE на группу, до сохранения. Создание, удаление и правка
+инструмента (филиал, модель, бренд) — сигналы, старое состояние берется из
+Instrument.from_db без лишнего запроса. Массовые загрузки (генератор,
+импорт) вызывают rebuild_stock(), он же раз в сутки исправляет дрейф.
+
+Ответ "где есть свободные" — один GROUP BY по маленькой таблице остатков,
+а не подсчет по инструментам на каждый запрос.
+"""
+import math
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Case, Count, F, Q, Sum, Value, When
+
+from .models import STOCK_KEY_FIELDS, Instrument, LocationStock
+
+# Разрезы внутри филиала: параметр group -> поля строки остатков
+STOCK_GROUPS = {
+    'category': ('category_id', 'category__name'),
+    'brand': ('brand_id', 'brand__name'),
+    'model': ('name',),
+}
+LOCATION_FIELDS = ('location_id', 'location__name', 'location__address', 'location__latitude', 'location__longitude')
+
+
+def _key_q(key):
+    return Q(**dict(zip(STOCK_KEY_FIELDS, key)))
+
+
+def _bump(key, delta):
+    rows = LocationStock.objects.filter(_key_q(key))
+    if not rows.update(count=F('count') + delta):
+        LocationStock.objects.create(**dict(zip(STOCK_KEY_FIELDS, key)), count=delta)
+
+
+def move(old_key, new_key, count=1):
+    """Переносит count инструментов из строки old_key в new_key (любой может быть None)."""
+    if old_key == new_key:
+        return
+    # Обычно уже внутри транзакции брони/отмены — лишний savepoint не нужен
+    with transaction.atomic(savepoint=False):
+        if old_key is None:
+            _bump(new_key, count)
+            return
+        if new_key is None:
+            _bump(old_key, -count)
+            return
+        # Обе строки одним UPDATE; новой строки может еще не быть
+        moved = LocationStock.objects.filter(_key_q(old_key) | _key_q(new_key)).update(
+            count=F('count') + Case(When(_key_q(old_key), then=Value(-count)), default=Value(count)),
+        )
+        if moved < 2 and not LocationStock.objects.filter(_key_q(new_key)).exists():
+            LocationStock.objects.create(**dict(zip(STOCK_KEY_FIELDS, new_key)), count=count)
+
+
+def record_status_change(instruments, status):
+    """
+    Вызывать перед сменой статуса (в той же транзакции, строки уже
+    заблокированы): сдвигает остатки для инструментов, чей статус сменится.
+    instruments — загруженные инструменты (ключ уже известен, без запроса)
+    или их id (ключи читаем одним GROUP BY).
+    """
+    if all(isinstance(inst, Instrument) for inst in instruments):
+        changing = Counter(
+            key for key in (inst.stock_key() for inst in instruments) if key is not None and key[-1] != status
+        )
+    else:
+        rows = (
+            Instrument.objects.filter(id__in=instruments, location__isnull=False).exclude(status=status)
+            .values(*STOCK_KEY_FIELDS).annotate(n=Count('id')).order_by()
+        )
+        changing = {tuple(row[field] for field in STOCK_KEY_FIELDS): row['n'] for row in rows}
+    for old_key, n in changing.items():
+        move(old_key, old_key[:-1] + (status,), n)
+
+
+def rebuild_stock(batch_size=2000):
+    """Пересчитывает таблицу остатков целиком по инструментам. Возвращает число строк."""
+    rows = (
+        Instrument.objects.filter(location__isnull=False)
+        .values(*STOCK_KEY_FIELDS).annotate(count=Count('id')).order_by()
+    )
+    objs = [LocationStock(**row) for row in rows]
+    with transaction.atomic():
+        LocationStock.objects.all().delete()
+        LocationStock.objects.bulk_create(objs, batch_size=batch_size)
+    return len(objs)
+
+
+def distance_km(lat1, lon1, lat2, lon2):
+    """Расстояние по большому кругу (гаверсинус)."""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 6371 * math.asin(math.sqrt(h))
+
+
+def stock_rows(category=None, brand=None, model=None, location=None, group=None):
+    """
+    Остатки по филиалам (и разрезу group внутри филиала) одним запросом:
+    free — в наличии, total — всего.
+    """
+    stock = LocationStock.objects.all()
+    if category:
+        stock = stock.filter(category_id=category)
+    if brand:
+        stock = stock.filter(brand_id=brand)
+    if model:
+        stock = stock.filter(name__icontains=model)
+    if location:
+        stock = stock.filter(location_id=location)
+    group_fields = STOCK_GROUPS[group] if group else ()
+    # Без ORDER BY: строк мало, порядок наводит branches_with_stock
+    return (
+        stock.values(*LOCATION_FIELDS, *group_fields)
+        .annotate(free=Sum('count', filter=Q(status='available')), total=Sum('count'))
+        .filter(total__gt=0)
+        .order_by()
+    )
+
+
+def branches_with_stock(rows, group=None, lat=None, lon=None):
+    """
+    Сворачивает строки stock_rows в список филиалов, где есть свободные,
+    в порядке филиалов (по id). С координатами — ближайшие первыми
+    (филиалы без координат в конце).
+    """
+    branches = {}
+    for row in rows:
+        branch = branches.get(row['location_id'])
+        if branch is None:
+            branch = branches[row['location_id']] = {
+                'id': row['location_id'], 'name': row['location__name'], 'address': row['location__address'],
+                'free': 0, 'total': 0, 'distance_km': None,
+            }
+            if lat is not None and row['location__latitude'] is not None:
+                branch['distance_km'] = round(distance_km(
+                    lat, lon, row['location__latitude'], row['location__longitude'],
+                ), 1)
+            if group:
+                branch['items'] = []
+        free = row['free'] or 0
+        branch['free'] += free
+        branch['total'] += row['total']
+        if group:
+            key = STOCK_GROUPS[group]
+            branch['items'].append({
+                'key': row[key[0]], 'name': row[key[-1]], 'free': free, 'total': row['total'],
+            })
+
+    result = sorted((branch for branch in branches.values() if branch['free'] > 0), key=lambda b: b['id'])
+    if group:
+        for branch in result:
+            branch['items'].sort(key=lambda item: (item['name'] is None, str(item['name'])))
+    if lat is not None:
+        result.sort(key=lambda b: (b['distance_km'] is None, b['distance_km'] or 0))
+    return result
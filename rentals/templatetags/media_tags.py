@@ -0,0 +1,18 @@
+from django import template
+from django.conf import settings
+
+register = template.Library()
+
+
+@register.filter
+def variant(obj, spec):
+    """
+    {{ photo|variant:"thumb.webp" }} — URL уменьшенной копии.
+    Если копий еще нет, возвращает URL оригинала.
+    """
+    size, _, fmt = spec.partition('.')
+    path = (obj.variants or {}).get(size, {}).get(fmt or 'jpeg')
+    if path:
+        return settings.MEDIA_URL + path
+    image = getattr(obj, obj.variant_source_field)
+    return image.url if image else ''
@@ -1,3 +1,827 @@
-from django.test import TestCase
+import csv
+import datetime
+import gzip
+import io
+import os
+import random
+import re
+import tempfile
+from decimal import Decimal
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import OperationalError, connection, connections
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+
+from .stock import rebuild_stock
+from .throttling import bucket_store
+from .availability import free_instruments
+from .archive import archive_rentals
+from .caching import get_filter_lists, get_object
+from .db_routing import PIN_COOKIE, ReplicaRouter, replica_pool, replica_reads
+from .image_worker import render_variants
+from .jobs import STALE_AFTER, requeue_stale
+from .models import (
+    STOCK_KEY_FIELDS, ArchivedPayment, ArchivedRental, Brand, Category, Instrument, InstrumentDailyStats, Location,
+    Job, LocationStock, Maintenance, Payment, Rental, Review,
+)
+from .pricing import rental_total
+from .rollups import NO_DIMENSION, compact_window, revenue_report
+from .search import memory_index, search_instruments
+from .status_feed import StatusFeed
+
+# --- ПРОВЕРКА ПЛАНОВ ЗАПРОСОВ НА "ГОРЯЧИХ" СТРАНИЦАХ ---
+# Таблицы, которые растут вместе с историей: по ним не должно быть полного
+# прохода или сортировки без индекса
+LARGE_TABLES = ('rentals_rental', 'rentals_review', 'rentals_maintenance', 'rentals_payment')
+
+# Сколько запросов к БД делает каждая страница (вместе с пользователем; сессия — из кэша).
+# Если число выросло — скорее всего появился N+1
+QUERY_BUDGETS = {
+    'catalog': 4,
+    'catalog_filtered': 4,
+    'instrument_detail': 6,
+    'instrument_detail_cached': 5,
+    'api_recommendations': 1,
+    'profile': 5,
+    'api_profile_history': 3,
+    'api_check_status': 1,
+    'api_instruments_by_status': 2,
+    'api_free_instruments': 1,
+    'api_branch_stock': 1,
+    'cancel_rental': 9,
+    'book_replay': 0,
+    'api_accounting_export': 3,
+}
+
+
+# Бюджеты считаются по default: реплики (DATABASE_REPLICA_URLS) тут отключаем
+@override_settings(DATABASE_REPLICAS=[])
+class HotPathQueryPlanTests(TestCase):
+    """
+    Наполняет БД заметным объемом данных и для каждой горячей страницы
+    проверяет число запросов и план (EXPLAIN) каждого SELECT.
+    """
+    INSTRUMENTS = 1500
+    USERS = 40
+    RENTALS = 6000
+    REVIEWS = 3000
+    MAINTENANCE = 3000
+
+    @classmethod
+    def setUpTestData(cls):
+        rng = random.Random(11)
+        locations = Location.objects.bulk_create(
+            [Location(name=f"Филиал {i}", address="-", phone="-") for i in range(5)]
+        )
+        brands = Brand.objects.bulk_create([Brand(name=f"Бренд {i}") for i in range(10)])
+        categories = Category.objects.bulk_create(
+            [Category(name=f"Категория {i}", slug=f"cat-{i}") for i in range(8)]
+        )
+        statuses = ['available'] * 8 + ['rented', 'maintenance']
+        instruments = Instrument.objects.bulk_create([
+            Instrument(
+                name=f"Инструмент {i}", price_per_day=100 + i % 50,
+                inventory_number=f"INV-{i:06d}", status=rng.choice(statuses),
+                location=rng.choice(locations), brand=rng.choice(brands), category=rng.choice(categories),
+            )
+            for i in range(cls.INSTRUMENTS)
+        ])
+        rebuild_stock()  # bulk_create мимо сигналов
+        users = User.objects.bulk_create([User(username=f"user{i}") for i in range(cls.USERS)])
+        cls.user = users[0]
+
+        today = datetime.date.today()
+        rentals = []
+        for i in range(cls.RENTALS):
+            start = today - datetime.timedelta(days=rng.randrange(1, 700))
+            rentals.append(Rental(
+                instrument=rng.choice(instruments), user=rng.choice(users),
+                start_date=start, end_date=start + datetime.timedelta(days=rng.randrange(1, 14)),
+                is_active=i % 20 == 0, total_price=500,
+            ))
+        rentals = Rental.objects.bulk_create(rentals)
+        Payment.objects.bulk_create([Payment(rental=r, amount=500) for r in rentals[::2]])
+        Review.objects.bulk_create([
+            Review(instrument=rng.choice(instruments[:100]), user=rng.choice(users),
+                   rating=rng.randint(1, 5), comment="ok")
+            for _ in range(cls.REVIEWS)
+        ])
+        Maintenance.objects.bulk_create([
+            Maintenance(instrument=rng.choice(instruments[:100]), description="ТО", cost=10,
+                        date=today - datetime.timedelta(days=rng.randrange(1, 700)))
+            for _ in range(cls.MAINTENANCE)
+        ])
+
+        cls.instrument = instruments[0]
+        cls.category = categories[0]
+        cls.rental = Rental.objects.create(instrument=instruments[1], user=cls.user, start_date=today)
+
+        # Статистика для планировщика, иначе на свежих таблицах он гадает
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def setUp(self):
+        # Кэш справочников и снимок статусов не должны влиять на число запросов
+        cache.clear()
+        bucket_store().clear()
+        self.client.force_login(self.user)
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute('EXPLAIN ' + sql)
+            else:
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+            return [str(row[-1]) for row in cursor.fetchall()]
+
+    def bad_plan_steps(self, plan):
+        bad = []
+        for step in plan:
+            for table in LARGE_TABLES:
+                if connection.vendor == 'postgresql':
+                    if f'Seq Scan on {table}' in step:
+                        bad.append(step)
+                elif step.startswith(f'SCAN {table}') and 'USING' not in step:
+                    bad.append(step)
+            if connection.vendor == 'sqlite' and 'TEMP B-TREE FOR ORDER BY' in step:
+                bad.append(step)
+        return bad
+
+    def check_page(self, name, method, url, data=None, **extra):
+        with CaptureQueriesContext(connection) as ctx:
+            response = getattr(self.client, method)(url, data or {}, **extra)
+            if response.streaming:
+                # Выгрузки читают БД, пока отдают тело
+                b''.join(response.streaming_content)
+        self.assertLess(response.status_code, 400, f"{name}: {response.status_code}")
+
+        # Служебные запросы сессии/пользователя в бюджет тоже входят
+        self.assertLessEqual(
+            len(ctx.captured_queries), QUERY_BUDGETS[name],
+            f"{name}: запросов стало больше:\n" + "\n".join(q['sql'] for q in ctx.captured_queries),
+        )
+        for query in ctx.captured_queries:
+            if not query['sql'].startswith('SELECT'):
+                continue
+            bad = self.bad_plan_steps(self.explain(query['sql']))
+            self.assertFalse(bad, f"{name}: план без индекса {bad} для\n{query['sql']}")
+
+    def test_catalog(self):
+        self.check_page('catalog', 'get', '/')
+
+    def test_catalog_filtered(self):
+        self.check_page('catalog_filtered', 'get', f'/?category={self.category.id}')
+
+    def test_instrument_detail(self):
+        self.check_page('instrument_detail', 'get', f'/instrument/{self.instrument.id}/')
+
+    def test_instrument_detail_cached(self):
+        # Повторный просмотр берет инструмент из кэша объектов
+        url = f'/instrument/{self.instrument.id}/'
+        self.client.get(url)
+        self.check_page('instrument_detail_cached', 'get', url)
+
+        # Сохранение сбрасывает кэш после коммита — страница видит новые данные
+        with self.captureOnCommitCallbacks(execute=True):
+            Instrument.objects.filter(id=self.instrument.id).update(name="Переименованный")
+            Instrument.objects.get(id=self.instrument.id).save()
+        self.assertContains(self.client.get(url), "Переименованный")
+
+    def test_api_recommendations(self):
+        self.check_page('api_recommendations', 'get', f'/api/instruments/{self.instrument.id}/recommendations/')
+
+    def test_profile(self):
+        self.check_page('profile', 'get', '/profile/')
+
+    def test_api_profile_history(self):
+        # Вторая страница: проверяем план запроса с курсором
+        first = self.client.get('/api/profile/history/').json()
+        self.assertTrue(first['next_cursor'])
+        self.check_page('api_profile_history', 'get', f"/api/profile/history/?cursor={first['next_cursor']}")
+
+    def test_api_check_status(self):
+        ids = ','.join(str(i) for i in Instrument.objects.values_list('id', flat=True)[:24])
+        self.check_page('api_check_status', 'get', f'/api/status/?ids={ids}')
+
+    def test_api_instruments_by_status(self):
+        self.check_page('api_instruments_by_status', 'get', '/api/v1/instruments/?status=rented')
+
+    def test_api_free_instruments(self):
+        start = datetime.date.today() + datetime.timedelta(days=3)
+        self.check_page('api_free_instruments', 'get', f'/api/availability/?start={start}&end={start}')
+
+    def test_api_branch_stock(self):
+        self.check_page('api_branch_stock', 'get', f'/api/stock/?category={self.category.id}&group=brand')
+
+    def test_cancel_rental(self):
+        # Обычное состояние: строка остатков "available" для этой модели в филиале уже есть
+        # (первый перенос в новый статус стоит еще проверку и INSERT)
+        key = dict(zip(STOCK_KEY_FIELDS, self.rental.instrument.stock_key()), status='available')
+        LocationStock.objects.get_or_create(**key, defaults={'count': 0})
+        self.check_page('cancel_rental', 'post', f'/rental/cancel/{self.rental.id}/')
+
+    def test_book_replay(self):
+        # Повтор с тем же Idempotency-Key отдается из кэша, без единого запроса к БД
+        today = datetime.date.today()
+        free_id = free_instruments(today, today).filter(status='available').values_list('id', flat=True).first()
+        data = {'id': free_id, 'start_date': today, 'end_date': today}
+        first = self.client.post('/api/book/', data, HTTP_IDEMPOTENCY_KEY='test-key')
+        self.assertEqual(first.status_code, 200, first.content)
+        self.check_page('book_replay', 'post', '/api/book/', data, HTTP_IDEMPOTENCY_KEY='test-key')
+
+    def test_api_accounting_export(self):
+        # Выгрузка за период идет по индексу даты без сортировки: первые строки уходят сразу
+        self.client.force_login(User.objects.create(username='accountant', is_staff=True))
+        today = datetime.date.today()
+        self.check_page(
+            'api_accounting_export', 'get', f'/api/exports/payments/?start={today - datetime.timedelta(days=30)}&end={today}',
+        )
+
+
+# --- ПОВЕДЕНИЕ ---
+class RollupNullDimensionTests(TestCase):
+    """Инструмент без филиала/категории/бренда не ломает сводки и отчеты."""
+
+    def setUp(self):
+        self.user = User.objects.create(username='client')
+        self.brand = Brand.objects.create(name='Бренд')
+        self.orphan = Instrument.objects.create(name='Без всего', price_per_day=100, inventory_number='NULL-1')
+        self.branded = Instrument.objects.create(
+            name='С брендом', price_per_day=100, inventory_number='NULL-2', brand=self.brand,
+        )
+        self.today = timezone.localdate()
+        for instrument in (self.orphan, self.branded):
+            rental = Rental.objects.create(instrument=instrument, user=self.user, start_date=self.today)
+            Payment.objects.create(rental=rental, amount=Decimal('300'))
+
+    def test_bump_keeps_revenue(self):
+        stats = InstrumentDailyStats.objects.get(instrument=self.orphan, day=self.today)
+        self.assertEqual(stats.revenue, Decimal('300'))
+        self.assertIsNone(stats.brand_id)
+
+    def test_compact_and_report(self):
+        self.assertEqual(compact_window(self.today, self.today), 2)
+        rows = {row['name']: row['revenue'] for row in revenue_report(self.today, self.today, 'brand')}
+        self.assertEqual(rows, {NO_DIMENSION: Decimal('300'), 'Бренд': Decimal('300')})
+
+    def test_reference_delete_keeps_history(self):
+        self.brand.delete()
+        self.assertEqual(InstrumentDailyStats.objects.filter(day=self.today).count(), 2)
+
+
+class OverdueRentalTests(TestCase):
+    """Просроченная, но не закрытая аренда держит инструмент."""
+
+    def setUp(self):
+        bucket_store().clear()
+        self.today = datetime.date.today()
+        self.owner = User.objects.create(username='late')
+        self.other = User.objects.create(username='other')
+        self.instrument = Instrument.objects.create(
+            name='Гитара', price_per_day=100, inventory_number='OVD-1', status='rented',
+        )
+        Rental.objects.create(
+            instrument=self.instrument, user=self.owner,
+            start_date=self.today - datetime.timedelta(days=5), end_date=self.today - datetime.timedelta(days=2),
+        )
+
+    def test_booking_today_conflicts(self):
+        self.client.force_login(self.other)
+        response = self.client.post('/api/book/', {'id': self.instrument.id})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Rental.objects.filter(instrument=self.instrument, is_active=True).count(), 1)
+        self.assertFalse(free_instruments(self.today, self.today).filter(id=self.instrument.id).exists())
+
+    def test_cancel_other_rental_keeps_instrument_rented(self):
+        future = Rental.objects.create(
+            instrument=self.instrument, user=self.other,
+            start_date=self.today + datetime.timedelta(days=10), end_date=self.today + datetime.timedelta(days=12),
+        )
+        self.client.force_login(self.other)
+        self.client.post(f'/rental/cancel/{future.id}/')
+        future.refresh_from_db()
+        self.assertFalse(future.is_active)
+        self.instrument.refresh_from_db()
+        self.assertEqual(self.instrument.status, 'rented')
+
+
+class RollupRentedDaysTests(TestCase):
+    """Занятость в сводках: просроченная аренда — по сегодня, будущих дней нет."""
+
+    def setUp(self):
+        self.today = timezone.localdate()
+        user = User.objects.create(username='rollup')
+        self.overdue = Instrument.objects.create(name='Гитара', price_per_day=100, inventory_number='RLP-1')
+        self.open_ended = Instrument.objects.create(name='Бас', price_per_day=100, inventory_number='RLP-2')
+        Rental.objects.create(
+            instrument=self.overdue, user=user,
+            start_date=self.days(-5), end_date=self.days(-2),
+        )
+        Rental.objects.create(instrument=self.open_ended, user=user, start_date=self.days(-1))
+
+    def days(self, n):
+        return self.today + datetime.timedelta(days=n)
+
+    def rented_days(self, instrument):
+        return set(
+            InstrumentDailyStats.objects.filter(instrument=instrument, rented=True).values_list('day', flat=True)
+        )
+
+    def test_overdue_and_open_ended(self):
+        compact_window(self.days(-7), self.days(3))
+        self.assertEqual(self.rented_days(self.overdue), {self.days(n) for n in range(-5, 1)})
+        self.assertEqual(self.rented_days(self.open_ended), {self.days(-1), self.today})
+        self.assertFalse(InstrumentDailyStats.objects.filter(day__gt=self.today).exists())
+
+
+class StatusStreamTests(TestCase):
+    def test_wsgi_falls_back_to_polling(self):
+        # Под WSGI бесконечный поток занял бы воркер навсегда
+        self.assertEqual(self.client.get('/api/status/stream/').status_code, 204)
+
+    def test_feed_picks_up_changes_from_other_processes(self):
+        feed = StatusFeed()
+        instrument = Instrument.objects.create(name='Бас', price_per_day=100, inventory_number='FEED-1')
+        version = feed.version
+        # Как в другом воркере или run_worker: UPDATE без publish в этом процессе
+        Instrument.objects.filter(id=instrument.id).update(status='rented', updated_at=timezone.now())
+        async_to_sync(feed.poll)()
+        current, changed = feed.changes_since(version)
+        self.assertEqual(changed, {instrument.id: 'rented'})
+        # Повторный опрос уже виденное не публикует
+        async_to_sync(feed.poll)()
+        self.assertEqual(feed.changes_since(current)[1], {})
+
+    def test_waiters_are_woken_by_database_poll(self):
+        feed = StatusFeed(poll_interval=0.05)
+        instrument = Instrument.objects.create(name='Бас', price_per_day=100, inventory_number='FEED-2')
+
+        version = feed.version
+
+        async def wait_for_change():
+            await Instrument.objects.filter(id=instrument.id).aupdate(status='rented', updated_at=timezone.now())
+            return await feed.wait(version, 5)
+
+        self.assertTrue(async_to_sync(wait_for_change)())
+        self.assertEqual(feed.changes_since(version)[1], {instrument.id: 'rented'})
+
+
+class InventoryReimportTests(TestCase):
+    def test_reimport_keeps_status(self):
+        instrument = Instrument.objects.create(
+            name='Бас', price_per_day=100, inventory_number='IMP-1', status='rented',
+        )
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'catalog.csv')
+            with open(path, 'w', newline='', encoding='utf-8') as f:
+                f.write('inventory_number,name,price_per_day,status\nIMP-1,Бас 5 струн,150,available\nIMP-2,Новый,90,\n')
+            call_command('import_inventory', path, stdout=io.StringIO())
+        instrument.refresh_from_db()
+        self.assertEqual((instrument.name, instrument.price_per_day, instrument.status), ('Бас 5 струн', 150, 'rented'))
+        self.assertEqual(Instrument.objects.get(inventory_number='IMP-2').status, 'available')
+
+
+class BookingRateLimitTests(TestCase):
+    def setUp(self):
+        bucket_store().clear()
+        self.instrument = Instrument.objects.create(name='Синт', price_per_day=100, inventory_number='RL-1')
+
+    def test_anonymous_flood_does_not_block_instrument(self):
+        for _ in range(30):
+            self.assertEqual(self.client.post('/api/book/', {'id': self.instrument.id}).status_code, 403)
+        self.client.force_login(User.objects.create(username='customer'))
+        response = self.client.post('/api/book/', {'id': self.instrument.id})
+        self.assertEqual(response.status_code, 200, response.content)
+
+
+class AccountingExportTests(TestCase):
+    def test_wsgi_export_streams_sync(self):
+        # Под WSGI async-поток собрался бы в память целиком
+        instrument = Instrument.objects.create(name='Труба', price_per_day=100, inventory_number='ACC-1')
+        rental = Rental.objects.create(
+            instrument=instrument, user=User.objects.create(username='payer'), start_date=datetime.date.today(),
+        )
+        Payment.objects.create(rental=rental, amount=Decimal('250'))
+        self.client.force_login(User.objects.create(username='accountant', is_staff=True))
+        response = self.client.get('/api/exports/payments/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.is_async)
+        rows = list(csv.reader(io.StringIO(gzip.decompress(response.getvalue()).decode('utf-8-sig'))))
+        self.assertEqual(rows[1][2], '250.00')
+
+
+class BatchBookingTests(TestCase):
+    """Пакетная бронь: все или ничего."""
+
+    def setUp(self):
+        bucket_store().clear()
+        self.user = User.objects.create(username='band')
+        self.free = [
+            Instrument.objects.create(name=f'Свободный {i}', price_per_day=100, inventory_number=f'BAT-{i}')
+            for i in range(2)
+        ]
+        self.busy = Instrument.objects.create(name='Занятый', price_per_day=100, inventory_number='BAT-9')
+        Rental.objects.create(instrument=self.busy, user=User.objects.create(username='first'),
+                              start_date=datetime.date.today())
+        self.client.force_login(self.user)
+
+    def book(self, instruments):
+        return self.client.post('/api/book/batch/', {'ids': ','.join(str(i.id) for i in instruments)})
+
+    def test_conflict_books_nothing(self):
+        response = self.book(self.free + [self.busy])
+        self.assertEqual(response.status_code, 409)
+        states = {item['id']: item['status'] for item in response.json()['results']}
+        self.assertEqual(states[self.busy.id], 'busy')
+        self.assertEqual(states[self.free[0].id], 'booked')
+        self.assertFalse(Rental.objects.filter(user=self.user).exists())
+        self.assertFalse(Instrument.objects.filter(id__in=[i.id for i in self.free], status='rented').exists())
+
+    def test_all_free_books_all(self):
+        response = self.book(self.free)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Rental.objects.filter(user=self.user, is_active=True).count(), 2)
+        self.assertEqual(Instrument.objects.filter(id__in=[i.id for i in self.free], status='rented').count(), 2)
+
+
+class StockCounterTests(TestCase):
+    """Остатки по филиалам после брони, отмены и правки совпадают с полным пересчетом."""
+
+    def setUp(self):
+        bucket_store().clear()
+        self.user = User.objects.create(username='stock')
+        self.location = Location.objects.create(name='Центр', address='-', phone='-')
+        self.instruments = [
+            Instrument.objects.create(name='Гитара', price_per_day=100, inventory_number=f'STK-{i}',
+                                      location=self.location)
+            for i in range(3)
+        ]
+        self.client.force_login(self.user)
+
+    def counts(self):
+        return sorted(LocationStock.objects.filter(count__gt=0).values_list(*STOCK_KEY_FIELDS, 'count'))
+
+    def assertStockMatchesRebuild(self):
+        counts = self.counts()
+        rebuild_stock()
+        self.assertEqual(counts, self.counts())
+
+    def test_book_cancel_and_move(self):
+        self.client.post('/api/book/', {'id': self.instruments[0].id})
+        self.client.post('/api/book/batch/', {'ids': f'{self.instruments[1].id},{self.instruments[2].id}'})
+        self.assertEqual(LocationStock.objects.get(status='rented').count, 3)
+        self.assertStockMatchesRebuild()
+
+        rental = Rental.objects.get(instrument=self.instruments[0])
+        self.client.post(f'/rental/cancel/{rental.id}/')
+        self.assertStockMatchesRebuild()
+
+        instrument = Instrument.objects.get(id=self.instruments[1].id)
+        instrument.location = Location.objects.create(name='Север', address='-', phone='-')
+        instrument.save()
+        self.assertStockMatchesRebuild()
+
+
+@override_settings(RENTAL_DISCOUNTS=[(7, 10), (30, 20)], RENTAL_OVERDUE_RATE=1.5)
+class RentalTotalTests(TestCase):
+    start = datetime.date(2025, 3, 1)
+
+    def days(self, n):
+        return self.start + datetime.timedelta(days=n)
+
+    def test_discount_tiers(self):
+        self.assertEqual(rental_total(100, self.start, self.days(2), today=self.start), Decimal('300.00'))
+        self.assertEqual(rental_total(100, self.start, self.days(6), today=self.start), Decimal('630.00'))
+        self.assertEqual(rental_total(100, self.start, self.days(29), today=self.start), Decimal('2400.00'))
+
+    def test_overdue_multiplier(self):
+        # 3 дня по плану + 2 дня просрочки по полуторному тарифу
+        self.assertEqual(rental_total(100, self.start, self.days(2), returned=self.days(4)), Decimal('600.00'))
+        # Еще не вернули: просрочка считается на сегодня
+        self.assertEqual(rental_total(100, self.start, self.days(2), today=self.days(3)), Decimal('450.00'))
+
+    def test_early_return_and_cancel(self):
+        self.assertEqual(rental_total(100, self.start, self.days(2), returned=self.days(1)), Decimal('300.00'))
+        self.assertEqual(rental_total(100, self.start, self.days(2), returned=self.days(-1)), Decimal('0.00'))
+
+    def test_open_rental_billed_to_date(self):
+        self.assertEqual(rental_total(100, self.start, today=self.days(9)), Decimal('900.00'))
+
+
+class ArchiveRentalsTests(TestCase):
+    def setUp(self):
+        today = datetime.date.today()
+        self.user = User.objects.create(username='veteran')
+        instrument = Instrument.objects.create(name='Скрипка', price_per_day=100, inventory_number='ARC-1')
+        self.old = Rental.objects.create(
+            instrument=instrument, user=self.user, is_active=False, total_price=300,
+            start_date=today - datetime.timedelta(days=400), end_date=today - datetime.timedelta(days=398),
+            returned_at=today - datetime.timedelta(days=398),
+        )
+        Payment.objects.create(rental=self.old, amount=Decimal('300'))
+        self.recent = Rental.objects.create(
+            instrument=instrument, user=self.user, is_active=False, total_price=100,
+            start_date=today - datetime.timedelta(days=10), end_date=today - datetime.timedelta(days=10),
+            returned_at=today - datetime.timedelta(days=10),
+        )
+
+    def test_moves_rental_with_payments(self):
+        self.assertEqual(list(archive_rentals(older_than_days=365)), [(1, 1)])
+        self.assertFalse(Rental.objects.filter(id=self.old.id).exists())
+        self.assertFalse(Payment.objects.filter(rental_id=self.old.id).exists())
+        self.assertTrue(Rental.objects.filter(id=self.recent.id).exists())
+        archived = ArchivedRental.objects.get(id=self.old.id)
+        self.assertEqual(archived.total_price, 300)
+        self.assertEqual(list(ArchivedPayment.objects.filter(rental=archived).values_list('amount', flat=True)),
+                         [Decimal('300.00')])
+
+    def test_profile_history_shows_archived(self):
+        list(archive_rentals(older_than_days=365))
+        self.client.force_login(self.user)
+        rows = {row['id']: row for row in self.client.get('/api/profile/history/').json()['results']}
+        self.assertEqual(set(rows), {self.old.id, self.recent.id})
+        self.assertTrue(rows[self.old.id]['archived'])
+        self.assertEqual(Decimal(str(rows[self.old.id]['paid'])), Decimal('300'))
+        self.assertFalse(rows[self.recent.id]['archived'])
+
+
+class ImageVariantsTests(TestCase):
+    """Готовые копии не пересоздаются, пока не попросили overwrite (build_image_variants --force)."""
+
+    def test_overwrite_regenerates_existing_copies(self):
+        with tempfile.TemporaryDirectory() as media_root:
+            Image.new('RGB', (64, 64), 'red').save(os.path.join(media_root, 'photo.png'))
+            variants = render_variants(media_root, 'photo.png', {'thumb': 32})
+            path = os.path.join(media_root, variants['thumb']['jpeg'])
+            with open(path, 'wb') as f:
+                f.write(b'stale')
+
+            render_variants(media_root, 'photo.png', {'thumb': 32})
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), b'stale')
+
+            render_variants(media_root, 'photo.png', {'thumb': 32}, overwrite=True)
+            with open(path, 'rb') as f:
+                self.assertNotEqual(f.read(), b'stale')
+
+
+class RequeueStaleTests(TestCase):
+    """В очередь возвращаются только задачи, чей воркер перестал отмечаться."""
+
+    def make_job(self, heartbeat_age):
+        now = timezone.now()
+        return Job.objects.create(
+            name='overdue_sweep', status='running', worker='host:1', run_at=now,
+            started_at=now - 2 * STALE_AFTER, heartbeat_at=now - heartbeat_age,
+        )
+
+    def test_long_running_job_with_heartbeat_stays(self):
+        job = self.make_job(datetime.timedelta(seconds=30))
+        self.assertEqual(requeue_stale(), 0)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'running')
+
+    def test_silent_job_is_requeued(self):
+        job = self.make_job(STALE_AFTER + datetime.timedelta(minutes=1))
+        self.assertEqual(requeue_stale(), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.worker), ('queued', ''))
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRoutingTests(TestCase):
+    """Чтения — на реплику (зеркало default), запись, свежая запись клиента и отказ — на основную."""
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        replica_pool._down_until.clear()
+        self.factory = RequestFactory()
+
+    def test_reads_go_to_replica_and_writes_to_primary(self):
+        @replica_reads
+        def view(request):
+            with CaptureQueriesContext(connections['replica']) as replica_queries:
+                list(Instrument.objects.all())
+            return replica_queries, ReplicaRouter().db_for_write(Instrument)
+
+        replica_queries, write_alias = view(self.factory.get('/'))
+        self.assertEqual(len(replica_queries), 1)
+        self.assertEqual(write_alias, 'default')
+        # Вне помеченной вьюхи — основная база
+        self.assertIsNone(ReplicaRouter().db_for_read(Instrument))
+
+    def test_ndjson_stream_reads_from_replica(self):
+        # Строки читаются уже после выхода из вьюхи — и все равно с той же реплики, что и ETag
+        with CaptureQueriesContext(connections['replica']) as replica_queries, \
+                CaptureQueriesContext(connection) as primary_queries:
+            response = self.client.get('/api/v1/instruments/?format=ndjson')
+            b''.join(response.streaming_content)
+        self.assertEqual(len(replica_queries), 2)
+        self.assertEqual(len(primary_queries), 0)
+
+    def test_pin_cookie_forces_primary_after_write(self):
+        response = self.client.post('/api/book/')
+        self.assertIn(PIN_COOKIE, response.cookies)
+
+        @replica_reads
+        def view(request):
+            return ReplicaRouter().db_for_read(Instrument)
+
+        request = self.factory.get('/')
+        self.assertEqual(view(request), 'replica')
+        request.COOKIES[PIN_COOKIE] = '1'
+        self.assertIsNone(view(request))
+
+    def body(self, request):
+        alias = ReplicaRouter().db_for_read(Instrument)
+        self.calls.append(alias)
+        if alias == 'replica':
+            raise OperationalError("replica is down")
+        return HttpResponse(alias or 'default')
+
+    async def async_body(self, request):
+        return self.body(request)
+
+    def check_failover(self, view):
+        self.calls = []
+        response = view(self.factory.get('/'))
+        self.assertEqual(response.content, b'default')
+        self.assertEqual(self.calls, ['replica', None])
+        # Пока реплика помечена нерабочей, чтения сразу идут в основную базу
+        self.assertNotIn('replica', replica_pool.healthy())
+
+    def test_failover_sync(self):
+        self.check_failover(replica_reads(self.body))
+
+    def test_failover_async(self):
+        self.check_failover(async_to_sync(replica_reads(self.async_body)))
+
+
+@override_settings(SEARCH_BACKEND='memory')
+class MemorySearchTests(TestCase):
+    """Индекс в памяти: опечатки, ранжирование и обновление сигналами без ожидания синхронизации."""
+
+    def setUp(self):
+        yamaha = Brand.objects.create(name='Yamaha')
+        self.guitar = Instrument.objects.create(
+            name='Акустическая гитара', brand=yamaha, price_per_day=100, inventory_number='SRCH-1',
+        )
+        self.drums = Instrument.objects.create(
+            name='Барабанная установка', price_per_day=100, inventory_number='SRCH-2',
+            description='Подойдет к любой гитаре на репетиции',
+        )
+        memory_index.rebuild()
+        self.addCleanup(memory_index._reset)
+
+    def ids(self, query):
+        return [hit.id for hit in search_instruments(query)]
+
+    def test_typos(self):
+        self.assertEqual(self.ids('Yamha'), [self.guitar.id])
+        self.assertEqual(self.ids('акустичская')[:1], [self.guitar.id])
+        self.assertEqual(self.ids('барабаная'), [self.drums.id])
+
+    def test_name_ranks_above_description(self):
+        self.assertEqual(self.ids('гитара'), [self.guitar.id, self.drums.id])
+
+    def test_index_follows_save_and_delete(self):
+        self.guitar.name = 'Электрогитара Stratocaster'
+        self.guitar.save()
+        self.assertEqual(self.ids('stratocaster'), [self.guitar.id])
+
+        self.drums.delete()
+        self.assertEqual(self.ids('барабанная'), [])
+
+
+class CatalogCardCacheTests(TestCase):
+    """Кэш карточек каталога: переименование справочника дает новый ключ фрагмента."""
+
+    def setUp(self):
+        cache.clear()
+        self.brand = Brand.objects.create(name='Fender')
+        Instrument.objects.create(name='Бас', brand=self.brand, price_per_day=100, inventory_number='CARD-1')
+
+    def test_brand_rename_refreshes_cards(self):
+        self.assertContains(self.client.get('/'), 'Fender')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.brand.name = 'Squier'
+            self.brand.save()
+        response = self.client.get('/')
+        self.assertContains(response, 'Squier')
+        self.assertNotContains(response, 'Fender')
+
+
+class InstrumentExportETagTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.brand = Brand.objects.create(name='Fender')
+        Instrument.objects.create(name='Бас', brand=self.brand, price_per_day=100, inventory_number='ETAG-1')
+
+    def test_brand_rename_changes_etag(self):
+        url = '/api/v1/instruments/?format=ndjson'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.brand.name = 'Squier'
+            self.brand.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Squier', b''.join(response.streaming_content))
+
+
+class RecommendationTests(TestCase):
+    """Матрица совместных аренд из нескольких корзин и ответ API."""
+
+    def setUp(self):
+        self.a, self.b, self.c, self.d = [
+            Instrument.objects.create(name=f'Инструмент {n}', price_per_day=100, inventory_number=f'REC-{n}')
+            for n in 'ABCD'
+        ]
+        today = datetime.date.today()
+        baskets = [(self.a, self.b, self.c), (self.a, self.b, self.c), (self.a, self.d)]
+        for number, basket in enumerate(baskets):
+            user = User.objects.create(username=f'rec{number}')
+            for instrument in basket:
+                Rental.objects.create(instrument=instrument, user=user, start_date=today, is_active=False)
+        Instrument.objects.filter(id=self.c.id).update(status='maintenance')
+
+    def test_api_returns_neighbours(self):
+        call_command('build_recommendations', '--full', stdout=io.StringIO())
+        results = self.client.get(f'/api/instruments/{self.a.id}/recommendations/').json()['results']
+        # Сам инструмент не рекомендуется, C — на ТО, D взяли вместе с A только раз (< MIN_COMMON)
+        self.assertEqual([row['id'] for row in results], [self.b.id])
+        # Косинус: 2 общих клиента / sqrt(3 клиента у A * 2 у B)
+        self.assertAlmostEqual(results[0]['score'], 2 / 6 ** 0.5, places=5)
+
+
+class ObjectCacheInvalidationTests(TestCase):
+    """Прочитали, поменяли, прочитали снова — из кэша приходит новое значение."""
+
+    def setUp(self):
+        cache.clear()
+        self.brand = Brand.objects.create(name='Fender')
+        self.category = Category.objects.create(name='Гитары', slug='guitars')
+        self.instrument = Instrument.objects.create(
+            name='Бас', brand=self.brand, category=self.category, price_per_day=100, inventory_number='OBJ-1',
+        )
+
+    def cached_instrument(self):
+        return get_object(Instrument, self.instrument.pk, Instrument.objects.select_related('brand', 'category'))
+
+    def save(self, obj, **fields):
+        for field, value in fields.items():
+            setattr(obj, field, value)
+        with self.captureOnCommitCallbacks(execute=True):
+            obj.save()
+
+    def test_instrument_save(self):
+        self.assertEqual(self.cached_instrument().price_per_day, 100)
+        self.save(self.instrument, price_per_day=150)
+        self.assertEqual(self.cached_instrument().price_per_day, 150)
+
+    def test_reference_save_refreshes_cached_instrument(self):
+        self.cached_instrument()
+        self.save(self.brand, name='Squier')
+        self.save(self.category, name='Басы')
+        instrument = self.cached_instrument()
+        self.assertEqual((instrument.brand.name, instrument.category.name), ('Squier', 'Басы'))
+
+    def test_filter_lists(self):
+        self.assertEqual([row['name'] for row in get_filter_lists()['brands']], ['Fender'])
+        self.save(self.brand, name='Squier')
+        self.save(self.category, name='Басы')
+        lists = get_filter_lists()
+        self.assertEqual([row['name'] for row in lists['brands']], ['Squier'])
+        self.assertEqual([row['name'] for row in lists['categories']], ['Басы'])
+
+
+@override_settings(METRICS_SAMPLE_RATE=1.0, DATABASE_REPLICAS=[])
+class ServerTimingTests(TestCase):
+    """Server-Timing есть у sync- и async-вьюх, и число запросов в нем совпадает с настоящим."""
+
+    def setUp(self):
+        self.instrument = Instrument.objects.create(name='Бас', price_per_day=100, inventory_number='TIME-1')
+
+    def reported_queries(self, response):
+        return int(re.search(r'desc="(\d+) queries"', response['Server-Timing']).group(1))
+
+    def test_sync_view(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.reported_queries(response), len(queries))
+        self.assertIn('total;dur=', response['Server-Timing'])
+
+    def test_async_view(self):
+        # AsyncClient идет через ASGI-цепочку: middleware работает в __acall__
+        with CaptureQueriesContext(connection) as queries:
+            response = async_to_sync(self.async_client.get)(f'/api/status/?ids={self.instrument.id}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.reported_queries(response), len(queries))
+        self.assertEqual(len(queries), 1)
@@ -0,0 +1,234 @@
+"""
+Защита бронирования от шквала повторов (двойные клики, ретраи сети, акции).
+
+1. Идемпотентность. Клиент шлет заголовок Idempotency-Key (один на намерение,
+   повторы — с тем же ключом). Первый запрос с ключом выполняется, ответ
+   кладется в кэш на BOOKING_IDEMPOTENCY_TTL; повтор получает сохраненный
+   ответ, не трогая БД. Пока первый еще выполняется, повтор получает 409.
+   Тот же ключ с другими параметрами — 422.
+
+2. Token bucket на клиента и на инструмент, до select_for_update: лишние
+   запросы получают 429 с Retry-After и не встают в очередь за блокировкой
+   строки. Хранилище ведер — память процесса (по умолчанию, лимит на процесс)
+   или общий кэш Django (BOOKING_RATE_LIMIT_STORE='cache', лимит на кластер
+   при Redis; get/set без блокировки, при гонке ведро может пропустить
+   лишний запрос).
+
+Клиента узнаем по id пользователя из сессии (она в кэше), без запроса к
+таблице пользователей.
+"""
+import functools
+import hashlib
+import json
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.core.cache import cache
+from django.http import JsonResponse
+
+from .metrics import _label, registry
+
+IDEMPOTENCY_HEADER = 'HTTP_IDEMPOTENCY_KEY'
+IDEMPOTENCY_KEY_MAX_LENGTH = 100
+# Сколько держим отметку "выполняется": дольше бронь идти не должна
+PENDING_TTL = 30
+# Поля формы, которые не влияют на смысл запроса
+FINGERPRINT_IGNORED = {'csrfmiddlewaretoken'}
+
+
+class ThrottleStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.throttled = {}
+        self.replayed = 0
+
+    def record_throttled(self, scope):
+        with self._lock:
+            self.throttled[scope] = self.throttled.get(scope, 0) + 1
+
+    def record_replayed(self):
+        with self._lock:
+            self.replayed += 1
+
+    def prometheus_lines(self):
+        with self._lock:
+            throttled, replayed = dict(self.throttled), self.replayed
+        lines = [
+            '# HELP muzrent_booking_throttled_total Booking requests rejected by the rate limiter, by bucket.',
+            '# TYPE muzrent_booking_throttled_total counter',
+        ]
+        lines += [f'muzrent_booking_throttled_total{{scope="{_label(s)}"}} {n}' for s, n in sorted(throttled.items())]
+        lines += [
+            '# HELP muzrent_booking_replayed_total Booking responses served from the idempotency cache.',
+            '# TYPE muzrent_booking_replayed_total counter',
+            f'muzrent_booking_replayed_total {replayed}',
+        ]
+        return lines
+
+
+throttle_stats = ThrottleStats()
+registry.register_collector(throttle_stats.prometheus_lines)
+
+
+async def _session_user_id(request):
+    session = getattr(request, 'session', None)
+    return await session.aget(SESSION_KEY) if session is not None else None
+
+
+# --- ХРАНИЛИЩА ВЕДЕР ---
+def _refill(state, rate, burst, now):
+    """Новое состояние ведра и сколько ждать (0 — токен выдан)."""
+    tokens, stamp = state if state is not None else (burst, now)
+    tokens = min(burst, tokens + max(0.0, now - stamp) * rate)
+    if tokens >= 1:
+        return (tokens - 1, now), 0.0
+    return (tokens, now), (1 - tokens) / rate
+
+
+class LocalBucketStore:
+    """Ведра в памяти процесса; старые ключи вытесняются (LRU)."""
+
+    def __init__(self, max_keys=10000):
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+        self.max_keys = max_keys
+
+    async def take(self, key, rate, burst):
+        now = time.monotonic()
+        with self._lock:
+            state, wait = _refill(self._buckets.pop(key, None), rate, burst, now)
+            self._buckets[key] = state
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class CacheBucketStore:
+    """Ведра в кэше Django: общие для всех процессов, если кэш общий (Redis)."""
+
+    async def take(self, key, rate, burst):
+        cache_key = f'bucket:{key}'
+        state, wait = _refill(await cache.aget(cache_key), rate, burst, time.time())
+        # Полное ведро хранить незачем: через это время оно бы и так наполнилось
+        await cache.aset(cache_key, state, math.ceil(burst / rate) + 1)
+        return wait
+
+    def clear(self):
+        # Ведра сами истекают по таймауту, а cache.clear() их и так удалит
+        pass
+
+
+_local_store = LocalBucketStore()
+_cache_store = CacheBucketStore()
+
+
+def bucket_store():
+    if getattr(settings, 'BOOKING_RATE_LIMIT_STORE', 'local') == 'cache':
+        return _cache_store
+    return _local_store
+
+
+def _too_many(scope, wait):
+    throttle_stats.record_throttled(scope)
+    response = JsonResponse(
+        {'message': "⏳ Слишком много попыток, попробуйте через пару секунд"}, status=429,
+    )
+    response['Retry-After'] = str(max(1, math.ceil(wait)))
+    return response
+
+
+def _instrument_ids(request):
+    raw = ','.join(request.POST.getlist('id') + request.POST.getlist('ids')).split(',')
+    return sorted({int(x) for x in raw if x.strip().isdigit()})
+
+
+def rate_limited(view):
+    """
+    Token bucket на клиента и на каждый инструмент из запроса (только для
+    async-вьюх). Считаются только запросы вошедших клиентов.
+    """
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method != 'POST':
+            return await view(request, *args, **kwargs)
+        user_id = await _session_user_id(request)
+        if user_id is None:
+            # Анонимный запрос вьюха и так отклонит; ведра инструментов он
+            # тратить не должен, иначе любой может "заморозить" инструмент
+            return await view(request, *args, **kwargs)
+        limits = getattr(settings, 'BOOKING_RATE_LIMITS', {})
+        store = bucket_store()
+        if 'user' in limits:
+            wait = await store.take(f'user:{user_id}', *limits['user'])
+            if wait:
+                return _too_many('user', wait)
+        if 'instrument' in limits:
+            for inst_id in _instrument_ids(request):
+                wait = await store.take(f'instrument:{inst_id}', *limits['instrument'])
+                if wait:
+                    return _too_many('instrument', wait)
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+# --- ИДЕМПОТЕНТНОСТЬ ---
+def _fingerprint(request):
+    params = sorted(
+        (name, request.POST.getlist(name)) for name in request.POST if name not in FINGERPRINT_IGNORED
+    )
+    raw = json.dumps([request.method, request.path, params], ensure_ascii=False)
+    return hashlib.md5(raw.encode()).hexdigest()
+
+
+def idempotent(view):
+    """
+    Повтор запроса с тем же Idempotency-Key получает сохраненный ответ.
+    Сохраняются только JSON-ответы без 5xx и 429: их повтор выполнит заново.
+    """
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        key = request.META.get(IDEMPOTENCY_HEADER, '').strip() if request.method == 'POST' else ''
+        user_id = await _session_user_id(request) if key else None
+        if not key or user_id is None:
+            return await view(request, *args, **kwargs)
+        if len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            return JsonResponse({'message': 'Слишком длинный Idempotency-Key'}, status=400)
+
+        cache_key = f"idem:{user_id}:{hashlib.md5(key.encode()).hexdigest()}"
+        fingerprint = _fingerprint(request)
+        if not await cache.aadd(cache_key, {'fingerprint': fingerprint, 'status': None}, PENDING_TTL):
+            stored = await cache.aget(cache_key)
+            if stored is not None:
+                if stored['fingerprint'] != fingerprint:
+                    return JsonResponse(
+                        {'message': 'Idempotency-Key уже использован для другого запроса'}, status=422,
+                    )
+                if stored['status'] is None:
+                    return JsonResponse({'message': 'Запрос с этим ключом еще выполняется'}, status=409)
+                throttle_stats.record_replayed()
+                response = JsonResponse(stored['body'], status=stored['status'])
+                response['Idempotent-Replayed'] = 'true'
+                return response
+            # Запись успела истечь между add и get — просто выполняем
+        try:
+            response = await view(request, *args, **kwargs)
+        except BaseException:
+            await cache.adelete(cache_key)
+            raise
+
+        if response.status_code >= 500 or response.status_code == 429 or response.get('Content-Type') != 'application/json':
+            await cache.adelete(cache_key)
+        else:
+            await cache.aset(cache_key, {
+                'fingerprint': fingerprint, 'status': response.status_code, 'body': json.loads(response.content),
+            }, settings.BOOKING_IDEMPOTENCY_TTL)
+        return response
+    return wrapper
@@ -1,14 +1,46 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import JsonResponse
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.core.cache import cache
 from django.db import transaction
 from django.contrib.auth import login
 from django.contrib.auth.decorators import login_required
 from asgiref.sync import sync_to_async
-from .models import Instrument, Rental, Category, Brand, UserProfile
+from .models import Instrument, Rental, UserProfile, Maintenance
 from .forms import UserRegistrationForm, ReviewForm
-from django.core.serializers import serialize
-from django.db.models import Prefetch # <-- Добавь этот импорт в начало файла!
+from .status_feed import feed, publish_on_commit
+from .metrics import registry as metrics_registry
+from .image_worker import VARIANTS_DIR
+from .search import search_instruments
+from .pricing import price_rental, rental_total
+from .history import active_rentals, decode_cursor, rental_history, rental_row
+from .db_routing import read_alias, replica_reads
+from .throttling import idempotent, rate_limited
+from .stock import STOCK_GROUPS, branches_with_stock, record_status_change, stock_rows
+from .recommendations import TOP_K as RECOMMENDATIONS_LIMIT, recommendations_for
+from .accounting import (
+    ENCODERS, KIND_FIELDS as EXPORT_KINDS, aencode_stream, aexport_batches, encode_stream, export_batches,
+)
+from .rollups import GROUPS as REPORT_GROUPS, record_rentals_started, revenue_report, utilization_report
+from .caching import (
+    areference_version, cache_stats, get_filter_lists, get_object, invalidate_objects, reference_version,
+    CATALOG_CARD_CACHE_TIMEOUT,
+)
+from .availability import (
+    free_instruments, has_conflict, is_busy_today, overlapping_rentals, parse_period,
+)
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import Prefetch, Count, Max, prefetch_related_objects # <-- Добавь этот импорт в начало файла!
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils import timezone
+from django.utils.http import http_date, quote_etag
+import datetime
+import hashlib
 import json
+import os
 
 # --- 1. РЕГИСТРАЦИЯ ---
 def register(request):
@@ -28,48 +60,250 @@ def register(request):
     return render(request, 'registration/register.html', {'form': form})
 
 # --- 2. КАТАЛОГ (С новыми фильтрами) ---
+CATALOG_PAGE_SIZE = 24
+CATALOG_SEARCH_LIMIT = 60
+
+
+@replica_reads
 def catalog(request):
     # Используем select_related для оптимизации (меньше запросов к БД)
-    instruments = Instrument.objects.select_related('category', 'brand', 'location').all()
+    instruments = Instrument.objects.select_related('category', 'brand', 'location').order_by('id')
     
     # Фильтрация
     cat_id = request.GET.get('category')
     brand_id = request.GET.get('brand')
+    location_id = request.GET.get('location', '')
+    
+    min_rating = request.GET.get('min_rating', '')
+    query = request.GET.get('q', '').strip()
     
     if cat_id:
         instruments = instruments.filter(category_id=cat_id)
     if brand_id:
         instruments = instruments.filter(brand_id=brand_id)
+    if location_id.isdigit():
+        instruments = instruments.filter(location_id=int(location_id))
+    if min_rating.isdigit():
+        instruments = instruments.filter(rating_avg__gte=int(min_rating))
+
+    if query:
+        # Поиск: показываем лучшие совпадения в порядке релевантности, без курсора
+        ranked = [hit.id for hit in search_instruments(query, limit=CATALOG_SEARCH_LIMIT)]
+        found = {item.id: item for item in instruments.filter(id__in=ranked)}
+        page = [found[inst_id] for inst_id in ranked if inst_id in found]
+        has_more = False
+    else:
+        # Пагинация по курсору: ?after=<id последней карточки>.
+        # Берем на одну запись больше, чтобы понять, есть ли следующая страница
+        after = request.GET.get('after', '')
+        if after.isdigit():
+            instruments = instruments.filter(id__gt=int(after))
+        page = list(instruments[:CATALOG_PAGE_SIZE + 1])
+        has_more = len(page) > CATALOG_PAGE_SIZE
+        page = page[:CATALOG_PAGE_SIZE]
+
+    next_query = None
+    if has_more:
+        params = request.GET.copy()
+        params.pop('partial', None)
+        params['after'] = page[-1].id
+        next_query = params.urlencode()
 
     context = {
-        'instruments': instruments,
-        'categories': Category.objects.all(),
-        'brands': Brand.objects.all(),
+        'instruments': page,
+        'next_query': next_query,
+        'card_cache_timeout': CATALOG_CARD_CACHE_TIMEOUT,
+        'reference_version': reference_version(),
     }
+
+    # Подгрузка при прокрутке: отдаем только карточки
+    if request.GET.get('partial'):
+        response = render(request, 'includes/catalog_cards.html', context)
+        response['X-Next-Query'] = next_query or ''
+        return response
+
+    context.update(get_filter_lists())
+    # Версия ленты статусов, от которой страница начнет слушать изменения
+    context['status_version'] = feed.version
     return render(request, 'catalog.html', context)
 
 # --- 3. ЛИЧНЫЙ КАБИНЕТ ---
 @login_required
 def profile(request):
-    # Используем prefetch_related для подгрузки платежей к каждой аренде
-    rentals = Rental.objects.filter(user=request.user)\
-        .select_related('instrument')\
-        .prefetch_related('payments')\
-        .order_by('-created_at')
-        
-    return render(request, 'profile.html', {'rentals': rentals})
+    # Активные аренды целиком, история — страницами по курсору ?cursor=
+    cursor = decode_cursor(request.GET.get('cursor'))
+    history, next_cursor = rental_history(request.user, cursor)
+    return render(request, 'profile.html', {
+        'active_rentals': active_rentals(request.user),
+        'history': history,
+        'next_cursor': next_cursor,
+        'is_first_page': cursor is None,
+    })
+
+
+@login_required
+def api_profile_history(request):
+    """История аренд текущего пользователя: ?cursor=<next_cursor из прошлого ответа>."""
+    raw = request.GET.get('cursor')
+    cursor = decode_cursor(raw)
+    if raw and cursor is None:
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+    history, next_cursor = rental_history(request.user, cursor)
+    payload = {'results': [rental_row(r) for r in history], 'next_cursor': next_cursor}
+    if cursor is None:
+        payload['active'] = [rental_row(r) for r in active_rentals(request.user)]
+    return JsonResponse(payload)
 
 # --- 4. REST API (Требование преподавателя) ---
-def api_instruments(request):
+API_PAGE_SIZE = 100
+API_MAX_PAGE_SIZE = 500
+API_EXPORT_CHUNK = 2000
+API_FIELDS = ('id', 'name', 'price_per_day', 'status', 'category__name', 'brand__name')
+
+# GET-параметр -> поле модели (те же фильтры, что и в каталоге)
+INSTRUMENT_FILTERS = {
+    'category': 'category_id',
+    'brand': 'brand_id',
+    'location': 'location_id',
+    'status': 'status',
+    'min_rating': 'rating_avg__gte',
+}
+
+
+def filter_instruments(queryset, params):
+    """Применяет фильтры из GET. Возвращает None, если параметры кривые."""
+    statuses = dict(Instrument.STATUS_CHOICES)
+    for param, field in INSTRUMENT_FILTERS.items():
+        value = params.get(param)
+        if not value:
+            continue
+        if param == 'status' and value not in statuses:
+            return None
+        if param != 'status' and not value.isdigit():
+            return None
+        queryset = queryset.filter(**{field: value})
+    return queryset
+
+
+async def _stamp(request, queryset):
+    """
+    Считает валидаторы для ETag/Last-Modified одним агрегатным запросом,
+    не вытаскивая сами строки. В ETag входит и версия справочников: в строках
+    есть названия категории и бренда. Возвращает (etag, last_modified).
+    """
+    stamp = await queryset.order_by().aaggregate(
+        last=Max('updated_at'), count=Count('id'), max_id=Max('id')
+    )
+    last_modified = stamp['last'].timestamp() if stamp['last'] else None
+    references = await areference_version()
+    raw = f"{request.get_full_path()}|{stamp['count']}|{stamp['max_id']}|{last_modified}|{references}"
+    return quote_etag(hashlib.md5(raw.encode()).hexdigest()), last_modified
+
+
+def _not_modified(request, etag, last_modified):
+    return get_conditional_response(
+        request, etag=etag, last_modified=int(last_modified) if last_modified else None
+    )
+
+
+def _with_validators(response, etag, last_modified):
+    response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+async def _ndjson_rows(queryset):
+    lines = []
+    async for row in queryset.aiterator(chunk_size=API_EXPORT_CHUNK):
+        lines.append(json.dumps(row, cls=DjangoJSONEncoder))
+        if len(lines) >= API_EXPORT_CHUNK:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def _ndjson_rows_sync(queryset):
+    # Для WSGI: async-генератор там собрался бы в список целиком
+    lines = []
+    for row in queryset.iterator(chunk_size=API_EXPORT_CHUNK):
+        lines.append(json.dumps(row, cls=DjangoJSONEncoder))
+        if len(lines) >= API_EXPORT_CHUNK:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+# Готовая страница API живет в кэше несколько секунд: поллеры с одинаковыми
+# параметрами не ходят в БД вообще
+API_PAGE_CACHE_TIMEOUT = 5
+
+
+@replica_reads
+async def api_instruments(request):
     """
     Возвращает список инструментов в формате JSON.
     Это реализует требование 'REST API'.
+
+    Постраничный вывод по курсору: ?cursor=<id последнего>&limit=100,
+    ответ содержит next_cursor. ?format=ndjson отдает всю выборку потоком.
+    Фильтры: category, brand, location, status.
+    Поддерживает ETag/Last-Modified: неизмененная страница вернет 304.
+
+    Вьюха асинхронная (async ORM + cache.aget). Учти: в Django 5.2 async ORM
+    и кэш сами выполняют запросы через sync_to_async, так что поток на время
+    запроса к БД все равно берется. Выигрыш — страницы из кэша и 304
+    обслуживаются прямо в event loop.
     """
-    instruments = Instrument.objects.all().values(
-        'id', 'name', 'price_per_day', 'status', 
-        'category__name', 'brand__name'
-    )
-    return JsonResponse({'results': list(instruments)}, safe=False)
+    instruments = filter_instruments(Instrument.objects.all(), request.GET)
+    cursor = request.GET.get('cursor', '0')
+    limit = request.GET.get('limit', str(API_PAGE_SIZE))
+    if instruments is None or not cursor.isdigit() or not limit.isdigit():
+        return JsonResponse({'error': 'Некорректные параметры запроса'}, status=400)
+    limit = max(1, min(int(limit), API_MAX_PAGE_SIZE))
+    instruments = instruments.order_by('id')
+
+    if request.GET.get('format') == 'ndjson':
+        etag, last_modified = await _stamp(request, instruments)
+        not_modified = _not_modified(request, etag, last_modified)
+        if not_modified is not None:
+            return not_modified
+        rows = _ndjson_rows if is_asgi(request) else _ndjson_rows_sync
+        # Поток читается уже после выхода из вьюхи (и из @replica_reads):
+        # закрепляем его за той же базой, по которой посчитан ETag
+        response = StreamingHttpResponse(
+            rows(instruments.values(*API_FIELDS).using(read_alias())),
+            content_type='application/x-ndjson',
+        )
+        return _with_validators(response, etag, last_modified)
+
+    cache_key = 'api:instruments:' + hashlib.md5(request.get_full_path().encode()).hexdigest()
+    page = await cache.aget(cache_key)
+    cache_stats.record('api_instruments', hit=page is not None)
+    if page is None:
+        # Ровно те id, что попадут на страницу (подзапрос, строки не грузим)
+        window = Instrument.objects.filter(
+            id__in=instruments.filter(id__gt=int(cursor)).values('id')[:limit]
+        )
+        etag, last_modified = await _stamp(request, window)
+        not_modified = _not_modified(request, etag, last_modified)
+        if not_modified is not None:
+            return not_modified
+
+        rows = [row async for row in window.order_by('id').values(*API_FIELDS)]
+        page = {
+            'etag': etag, 'last_modified': last_modified,
+            'body': {'results': rows, 'next_cursor': rows[-1]['id'] if len(rows) == limit else None},
+        }
+        await cache.aset(cache_key, page, API_PAGE_CACHE_TIMEOUT)
+    else:
+        not_modified = _not_modified(request, page['etag'], page['last_modified'])
+        if not_modified is not None:
+            return not_modified
+
+    return _with_validators(JsonResponse(page['body']), page['etag'], page['last_modified'])
 
 # --- 5. АСИНХРОННОЕ БРОНИРОВАНИЕ ---
 @sync_to_async
@@ -78,6 +312,8 @@ def get_user_safe(request):
         return request.user
     return None
 
+@idempotent
+@rate_limited
 async def create_booking_async(request):
     if request.method != 'POST':
         return JsonResponse({'error': 'Method not allowed'}, status=405)
@@ -87,36 +323,146 @@ async def create_booking_async(request):
          return JsonResponse({'message': 'Пожалуйста, войдите в систему!'}, status=403)
 
     instrument_id = request.POST.get('id')
-    result_msg = await process_booking_transaction(instrument_id, user)
+    # Даты необязательны: без них бронь начинается сегодня и длится до возврата
+    start, end, error = parse_period(request.POST.get('start_date'), request.POST.get('end_date'))
+    if error:
+        return JsonResponse({'message': error}, status=400)
+
+    result_msg = await process_booking_transaction(instrument_id, user, start, end)
     
     # Возвращаем статус в зависимости от сообщения
     status_code = 200 if "Успешно" in result_msg else 400
     return JsonResponse({'message': result_msg}, status=status_code)
 
 @sync_to_async
-def process_booking_transaction(inst_id, user):
+def process_booking_transaction(inst_id, user, start=None, end=None):
+    today = datetime.date.today()
+    start = start or today
     try:
+        # Сначала проверяем пересечения без блокировки: занятые даты
+        # отсекаются сразу, не выстраиваясь в очередь за row lock
+        if has_conflict(inst_id, start, end):
+            return "❌ Инструмент уже занят на эти даты!"
+
         with transaction.atomic():
             instrument = Instrument.objects.select_for_update().get(id=inst_id)
             
-            if instrument.status != 'available':
-                return "❌ Инструмент уже занят или на обслуживании!"
+            if instrument.status == 'maintenance':
+                return "❌ Инструмент на обслуживании!"
+            # Под блокировкой перепроверяем: кто-то мог успеть раньше нас
+            if has_conflict(instrument.id, start, end):
+                return "❌ Инструмент уже занят на эти даты!"
             
-            instrument.status = 'rented'
-            instrument.save()
+            # Статус отражает "занят сегодня"; будущая бронь его не меняет
+            if start <= today:
+                record_status_change([instrument], 'rented')
+                instrument.status = 'rented'
+                instrument.save(update_fields=['status', 'updated_at'])
+                publish_on_commit({instrument.id: 'rented'})
             
-            # В новой структуре start_date обязателен, ставим сегодня
-            import datetime
             Rental.objects.create(
                 instrument=instrument, 
                 user=user,
-                start_date=datetime.date.today()
+                start_date=start,
+                end_date=end,
+                total_price=rental_total(instrument.price_per_day, start, end, today=today),
             )
             return "✅ Успешно забронировано!"
             
-    except Instrument.DoesNotExist:
+    except (Instrument.DoesNotExist, ValueError):
         return "Ошибка: Инструмент не найден"
     
+# --- 5.1. ПАКЕТНОЕ БРОНИРОВАНИЕ (весь бэклайн одним запросом) ---
+BATCH_BOOKING_LIMIT = 20
+
+BATCH_MESSAGES = {
+    'booked': "✅ Успешно забронировано!",
+    'busy': "❌ Инструмент уже занят на эти даты!",
+    'maintenance': "❌ Инструмент на обслуживании!",
+    'not_found': "Ошибка: Инструмент не найден",
+}
+
+
+@idempotent
+@rate_limited
+async def create_batch_booking_async(request):
+    """
+    POST ids=1,2,3 (+ start_date/end_date). Все или ничего: если хоть один
+    инструмент недоступен, ничего не бронируется, а в ответе видно, какой именно.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+
+    user = await get_user_safe(request)
+    if not user:
+        return JsonResponse({'message': 'Пожалуйста, войдите в систему!'}, status=403)
+
+    raw_ids = ','.join(request.POST.getlist('ids')).split(',')
+    if not all(x.strip().isdigit() for x in raw_ids):
+        return JsonResponse({'message': 'Ошибка: некорректный список инструментов'}, status=400)
+    inst_ids = sorted({int(x) for x in raw_ids})
+    if len(inst_ids) > BATCH_BOOKING_LIMIT:
+        return JsonResponse({'message': f'Не больше {BATCH_BOOKING_LIMIT} инструментов за раз'}, status=400)
+
+    start, end, error = parse_period(request.POST.get('start_date'), request.POST.get('end_date'))
+    if error:
+        return JsonResponse({'message': error}, status=400)
+
+    booked, results = await process_batch_booking(inst_ids, user, start, end)
+    return JsonResponse({
+        'message': "✅ Успешно забронировано!" if booked else "❌ Часть инструментов недоступна, ничего не забронировано",
+        'results': results,
+    }, status=200 if booked else 409)
+
+@sync_to_async
+def process_batch_booking(inst_ids, user, start=None, end=None):
+    today = datetime.date.today()
+    start = start or today
+    with transaction.atomic():
+        # Один SELECT ... FOR UPDATE с сортировкой по id: все пакеты берут
+        # блокировки в одинаковом порядке, поэтому взаимоблокировок не бывает
+        locked = {
+            inst.id: inst
+            for inst in Instrument.objects.select_for_update().filter(id__in=inst_ids).order_by('id')
+        }
+        busy = set(
+            overlapping_rentals(start, end)
+            .filter(instrument_id__in=inst_ids)
+            .values_list('instrument_id', flat=True)
+        )
+
+        results = []
+        for inst_id in inst_ids:
+            if inst_id not in locked:
+                state = 'not_found'
+            elif locked[inst_id].status == 'maintenance':
+                state = 'maintenance'
+            elif inst_id in busy:
+                state = 'busy'
+            else:
+                state = 'booked'
+            results.append({'id': inst_id, 'status': state, 'message': BATCH_MESSAGES[state]})
+
+        if any(item['status'] != 'booked' for item in results):
+            return False, results
+
+        rentals = Rental.objects.bulk_create([
+            Rental(
+                instrument_id=inst_id, user=user, start_date=start, end_date=end,
+                total_price=rental_total(locked[inst_id].price_per_day, start, end, today=today),
+            )
+            for inst_id in inst_ids
+        ])
+        # bulk_create не шлет post_save, поэтому сводки обновляем сами
+        record_rentals_started(rentals)
+        if start <= today:
+            # update() не трогает ни auto_now, ни сигналы: updated_at и остатки филиалов сами
+            record_status_change([locked[inst_id] for inst_id in inst_ids], 'rented')
+            Instrument.objects.filter(id__in=inst_ids).update(status='rented', updated_at=timezone.now())
+            invalidate_objects(Instrument, inst_ids)
+            publish_on_commit({inst_id: 'rented' for inst_id in inst_ids})
+        return True, results
+
 # --- 6. ОТМЕНА БРОНИРОВАНИЯ ---
 @login_required
 def cancel_rental(request, rental_id):
@@ -125,28 +471,47 @@ def cancel_rental(request, rental_id):
     
     if request.method == 'POST':
         with transaction.atomic():
-            # 1. Деактивируем аренду
+            # 1. Деактивируем аренду и считаем итог по фактической дате возврата
+            instrument = rental.instrument
             rental.is_active = False
+            rental.returned_at = datetime.date.today()
+            rental.total_price = price_rental(rental, instrument.price_per_day)
             rental.save()
             
-            # 2. Освобождаем инструмент
-            instrument = rental.instrument
-            instrument.status = 'available'
-            instrument.save()
+            # 2. Освобождаем инструмент, если на сегодня его больше никто не держит
+            if instrument.status == 'rented' and not is_busy_today(instrument.id):
+                record_status_change([instrument], 'available')
+                instrument.status = 'available'
+                instrument.save(update_fields=['status', 'updated_at'])
+                publish_on_commit({instrument.id: 'available'})
             
     return redirect('profile')
 
 # --- 7. ДЕТАЛЬНАЯ СТРАНИЦА + ОТЗЫВЫ ---
+REVIEWS_PAGE_SIZE = 10
+
+
+@replica_reads
 def instrument_detail(request, pk):
-    instrument = get_object_or_404(Instrument, pk=pk)
-    reviews = instrument.reviews.select_related('user').all()
-    
-    # --- НОВОЕ: Достаем фото и историю ремонтов ---
-    photos = instrument.photos.all() 
-    # Обрати внимание: maintenance_set - это стандартное имя для обратной связи, 
-    # если не указан related_name
-    maintenance_log = instrument.maintenance_set.all().order_by('-date')
-    # ---------------------------------------------
+    # Фиксированное число запросов: инструмент со справочниками (из кэша объектов),
+    # фото, журнал ТО и одна страница отзывов (количество берем из review_count)
+    try:
+        instrument = get_object(Instrument, pk, Instrument.objects.select_related('category', 'brand', 'location'))
+    except Instrument.DoesNotExist:
+        raise Http404("Инструмент не найден")
+    prefetch_related_objects(
+        [instrument],
+        'photos',
+        # Обрати внимание: maintenance_set - это стандартное имя для обратной связи,
+        # если не указан related_name
+        Prefetch('maintenance_set', queryset=Maintenance.objects.order_by('-date')),
+    )
+
+    page_count = max(1, -(-instrument.review_count // REVIEWS_PAGE_SIZE))
+    page_param = request.GET.get('reviews_page', '1')
+    page = min(int(page_param), page_count) if page_param.isdigit() and int(page_param) > 0 else 1
+    offset = (page - 1) * REVIEWS_PAGE_SIZE
+    reviews = instrument.reviews.select_related('user').order_by('-created_at', '-id')[offset:offset + REVIEWS_PAGE_SIZE]
 
     if request.method == 'POST':
         if not request.user.is_authenticated:
@@ -156,7 +521,7 @@ def instrument_detail(request, pk):
             review = form.save(commit=False)
             review.instrument = instrument
             review.user = request.user
-            review.save()
+            review.save()  # рейтинг инструмента пересчитает сигнал
             return redirect('instrument_detail', pk=pk)
     else:
         form = ReviewForm()
@@ -164,31 +529,338 @@ def instrument_detail(request, pk):
     return render(request, 'instrument_detail.html', {
         'instrument': instrument,
         'reviews': reviews,
-        'photos': photos,           # <-- Передаем в шаблон
-        'maintenance_log': maintenance_log, # <-- Передаем в шаблон
+        'reviews_page': page,
+        'reviews_pages': page_count,
+        'photos': instrument.photos.all(),           # <-- уже загружены prefetch
+        'maintenance_log': instrument.maintenance_set.all(), # <-- уже загружены prefetch
+        'recommendations': recommendations_for(instrument.id),
         'form': form
     })
+
+# --- 7.1. РЕКОМЕНДАЦИИ ("ЧАСТО БЕРУТ ВМЕСТЕ") ---
+RECOMMENDATION_FIELDS = (
+    'recommended_id', 'recommended__name', 'recommended__price_per_day', 'recommended__status', 'score',
+)
+
+
+@replica_reads
+async def api_recommendations(request, pk):
+    """
+    ?limit=4 — соседи инструмента, заранее посчитанные build_recommendations
+    (без инструментов на ТО). Один запрос по индексу (instrument, rank);
+    для неизвестного id — пустой список.
+    """
+    limit = request.GET.get('limit', str(RECOMMENDATIONS_LIMIT))
+    if not limit.isdigit() or int(limit) < 1:
+        return JsonResponse({'error': 'Некорректный limit'}, status=400)
+
+    rows = recommendations_for(pk, min(int(limit), RECOMMENDATIONS_LIMIT))
+    results = [
+        {
+            'id': row['recommended_id'],
+            'name': row['recommended__name'],
+            'price_per_day': row['recommended__price_per_day'],
+            'status': row['recommended__status'],
+            'score': row['score'],
+        }
+        async for row in rows.values(*RECOMMENDATION_FIELDS)
+    ]
+    return JsonResponse({'instrument': pk, 'results': results})
     
 # --- 8. API ДЛЯ ОБНОВЛЕНИЯ СТАТУСОВ (POLLING) ---
-def api_check_availability(request):
+STATUS_MAX_IDS = 500
+
+
+@replica_reads
+async def api_check_availability(request):
     """
     Принимает список ID (например: ?ids=1,2,5)
     Возвращает JSON: { "1": "available", "2": "rented", ... }
+
+    Статусы читаются из БД на каждый запрос (один SELECT по первичному
+    ключу): перед бронью клиент должен видеть точный статус, а не снимок,
+    отставший от других воркеров. Удаленные инструменты в ответ не попадают.
+
+    Без пула потоков опрос не обходится: async-итерация по queryset в
+    Django 5.2 сама гоняет SELECT через sync_to_async, так что на время
+    запроса каждый опрос занимает поток. В event loop остаются только
+    разбор параметров и сборка ответа.
     """
     ids_param = request.GET.get('ids', '')
     if not ids_param:
         return JsonResponse({})
     
-    # Превращаем строку "1,2,5" в список чисел
-    try:
-        ids_list = [int(x) for x in ids_param.split(',') if x.isdigit()]
-    except ValueError:
-        return JsonResponse({})
+    # Превращаем строку "1,2,5" в список чисел (не больше страницы-другой каталога)
+    ids_list = [int(x) for x in ids_param.split(',') if x.isdigit()][:STATUS_MAX_IDS]
 
-    # Запрашиваем из БД только id и status
-    instruments = Instrument.objects.filter(id__in=ids_list).values('id', 'status')
-    
     # Формируем словарь для удобства JS
-    status_map = {str(item['id']): item['status'] for item in instruments}
+    status_map = {
+        str(inst_id): status
+        async for inst_id, status in Instrument.objects.filter(id__in=ids_list).values_list('id', 'status')
+    }
     
-    return JsonResponse(status_map)
\ No newline at end of file
+    return JsonResponse(status_map)
+
+# --- 8.1. ПОИСК СВОБОДНЫХ ИНСТРУМЕНТОВ НА ДАТЫ ---
+@replica_reads
+async def api_free_instruments(request):
+    """
+    ?start=2025-01-10&end=2025-01-15 (+ фильтры как в /api/v1/instruments/)
+    Возвращает инструменты, свободные весь период, постранично по курсору.
+    """
+    start, end, error = parse_period(request.GET.get('start'), request.GET.get('end'))
+    instruments = filter_instruments(Instrument.objects.all(), request.GET)
+    cursor = request.GET.get('cursor', '0')
+    if error or instruments is None or not cursor.isdigit():
+        return JsonResponse({'error': error or 'Некорректные параметры запроса'}, status=400)
+
+    rows = [
+        row async for row in free_instruments(start, end, instruments)
+        .filter(id__gt=int(cursor))
+        .order_by('id')
+        .values(*API_FIELDS)[:API_PAGE_SIZE]
+    ]
+    next_cursor = rows[-1]['id'] if len(rows) == API_PAGE_SIZE else None
+    return JsonResponse({
+        'start': start,
+        'end': end,
+        'results': rows,
+        'next_cursor': next_cursor,
+    })
+
+# --- 8.1.1. ОСТАТКИ ПО ФИЛИАЛАМ ---
+@replica_reads
+async def api_branch_stock(request):
+    """
+    ?category=3&brand=1&model=strat&group=brand&lat=55.75&lon=37.62
+    Филиалы, где есть свободные инструменты под фильтр, в порядке филиалов
+    (с lat/lon — ближайшие первыми). group=category|brand|model добавляет
+    разбивку внутри филиала. Один запрос к таблице остатков LocationStock.
+    """
+    bad_request = JsonResponse({'error': 'Некорректные параметры запроса'}, status=400)
+    params = {param: request.GET.get(param, '') for param in ('category', 'brand', 'location')}
+    group = request.GET.get('group') or None
+    if any(value and not value.isdigit() for value in params.values()):
+        return bad_request
+    if group is not None and group not in STOCK_GROUPS:
+        return bad_request
+    try:
+        lat, lon = (float(request.GET[p]) if request.GET.get(p) else None for p in ('lat', 'lon'))
+    except ValueError:
+        return bad_request
+    if (lat is None) != (lon is None):
+        return bad_request
+
+    rows = stock_rows(model=request.GET.get('model', '').strip(), group=group, **params)
+    branches = branches_with_stock([row async for row in rows], group, lat, lon)
+    return JsonResponse({'results': branches})
+
+# --- 8.2. ПОИСК ---
+SEARCH_MAX_LIMIT = 100
+
+
+@replica_reads
+def api_search(request):
+    """
+    ?q=фендер страт — нечеткий поиск по названию, бренду, категории,
+    описанию и инвентарному номеру. Результаты по убыванию релевантности.
+    """
+    query = request.GET.get('q', '').strip()
+    limit = request.GET.get('limit', '20')
+    if not query or not limit.isdigit():
+        return JsonResponse({'error': 'Укажите строку поиска ?q='}, status=400)
+
+    hits = search_instruments(query, limit=min(int(limit), SEARCH_MAX_LIMIT))
+    rows = Instrument.objects.filter(id__in=[hit.id for hit in hits]).values(*API_FIELDS)
+    by_id = {row['id']: row for row in rows}
+    results = [dict(by_id[hit.id], score=hit.score) for hit in hits if hit.id in by_id]
+    return JsonResponse({'query': query, 'results': results})
+
+# --- 9. PUSH-ЛЕНТА СТАТУСОВ (SSE) ---
+def is_asgi(request):
+    """
+    Под WSGI async-генератор StreamingHttpResponse Django собирает в список
+    целиком — бесконечные и большие потоки там отдаем иначе.
+    """
+    return isinstance(request, ASGIRequest)
+
+
+STATUS_STREAM_HEARTBEAT = 20  # секунд между пингами, чтобы прокси не рвали соединение
+
+
+def _sse(event, version, payload):
+    return f"event: {event}\nid: {version}\ndata: {json.dumps(payload)}\n\n"
+
+
+async def api_status_stream(request):
+    """
+    Server-Sent Events: отдает только инструменты, изменившиеся после
+    версии клиента. Версию берем из заголовка Last-Event-ID (его браузер
+    сам шлет при переподключении) или из параметра ?since=.
+    Пока ничего не меняется, соединение просто ждет; БД за всех ожидающих
+    раз в секунду опрашивает лента (status_feed.py).
+    Рассчитано на запуск через ASGI (config/asgi.py). Под WSGI бесконечный
+    поток собрался бы в список и навсегда занял воркер, поэтому там отвечаем
+    204: браузер перестает переподключаться, а каталог переходит на опрос.
+    """
+    if not is_asgi(request):
+        return HttpResponse(status=204)
+    raw_version = request.headers.get('Last-Event-ID') or request.GET.get('since', '')
+    version = int(raw_version) if raw_version.isdigit() else -1
+
+    async def events():
+        nonlocal version
+        yield "retry: 3000\n\n"
+        # Догоняем БД: клиент мог получить версию от другого воркера
+        await feed.poll()
+        while True:
+            current, changed = feed.changes_since(version)
+            if changed is None:
+                # Клиент отстал слишком сильно — пусть перечитает статусы целиком
+                yield _sse('reset', current, {'version': current})
+                version = current
+            elif changed:
+                statuses = {str(inst_id): status for inst_id, status in changed.items()}
+                yield _sse('message', current, {'version': current, 'statuses': statuses})
+                version = current
+            else:
+                # Опрос БД мог сдвинуть версию без изменений
+                version = current
+                if not await feed.wait(version, STATUS_STREAM_HEARTBEAT):
+                    yield ": ping\n\n"
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # чтобы nginx не буферизовал поток
+    return response
+
+# --- 10. МЕТРИКИ ДЛЯ PROMETHEUS ---
+def metrics(request):
+    token = settings.METRICS_TOKEN
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return HttpResponse(status=403)
+    return HttpResponse(metrics_registry.render(), content_type='text/plain; version=0.0.4')
+
+# --- 11. РАЗДАЧА МЕДИА (вместо django.views.static.serve) ---
+MEDIA_IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+MEDIA_MAX_AGE = 60 * 60
+
+
+def media_file(request, path):
+    """
+    Отдает файл из MEDIA_ROOT через FileResponse (сервер может использовать
+    sendfile). Уменьшенные копии содержат хэш в имени и кэшируются навсегда,
+    оригиналы — на час с проверкой Last-Modified.
+    """
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404
+    if not os.path.isfile(full_path):
+        raise Http404
+
+    if path.startswith(f'{VARIANTS_DIR}/'):
+        cache_control = f'public, max-age={MEDIA_IMMUTABLE_MAX_AGE}, immutable'
+    else:
+        cache_control = f'public, max-age={MEDIA_MAX_AGE}'
+
+    mtime = int(os.stat(full_path).st_mtime)
+    response = get_conditional_response(request, last_modified=mtime)
+    if response is None:
+        response = FileResponse(open(full_path, 'rb'))
+    response['Last-Modified'] = http_date(mtime)
+    response['Cache-Control'] = cache_control
+    return response
+
+# --- 12. ОТЧЕТЫ ПО ДНЕВНЫМ СВОДКАМ (только для персонала) ---
+REPORT_DEFAULT_DAYS = 30
+REPORT_MAX_DAYS = 731
+
+
+def _report_params(request, default_group):
+    """Разбирает start/end/group/фильтры. Возвращает (параметры, ошибка)."""
+    today = datetime.date.today()
+    try:
+        end = datetime.date.fromisoformat(request.GET['end']) if request.GET.get('end') else today
+        start = (datetime.date.fromisoformat(request.GET['start']) if request.GET.get('start')
+                 else end - datetime.timedelta(days=REPORT_DEFAULT_DAYS - 1))
+    except ValueError:
+        return None, 'dates must be YYYY-MM-DD'
+    if end < start or (end - start).days >= REPORT_MAX_DAYS:
+        return None, f'range must be 1..{REPORT_MAX_DAYS} days'
+
+    group = request.GET.get('group', default_group)
+    if group not in REPORT_GROUPS:
+        return None, f'group must be one of: {", ".join(REPORT_GROUPS)}'
+
+    filters = {}
+    for dim in ('location', 'category', 'brand'):
+        value = request.GET.get(dim)
+        if value:
+            if not value.isdigit():
+                return None, f'{dim} must be an id'
+            filters[dim] = int(value)
+    return {'start': start, 'end': end, 'group': group, **filters}, None
+
+
+def _report_response(request, build, default_group):
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'Forbidden'}, status=403)
+    params, error = _report_params(request, default_group)
+    if error:
+        return JsonResponse({'error': error}, status=400)
+    return JsonResponse({
+        'start': params['start'], 'end': params['end'], 'group': params['group'],
+        'rows': build(**params),
+    })
+
+
+@replica_reads
+def api_report_revenue(request):
+    return _report_response(request, revenue_report, 'day')
+
+
+@replica_reads
+def api_report_utilization(request):
+    return _report_response(request, utilization_report, 'location')
+
+
+# --- 13. ВЫГРУЗКИ ДЛЯ БУХГАЛТЕРИИ (только для персонала) ---
+# Поток строк из серверного курсора вместо админки, которая грузит все в память.
+# Под ASGI — async-генератор, под WSGI — обычный (async WSGI собрал бы в список).
+# Не на реплике: поток читается уже после выхода из вьюхи, вне @replica_reads
+async def api_accounting_export(request, kind):
+    user = await request.auser()
+    if not user.is_staff:
+        return JsonResponse({'error': 'Forbidden'}, status=403)
+    if kind not in EXPORT_KINDS:
+        return JsonResponse({'error': f'kind must be one of: {", ".join(EXPORT_KINDS)}'}, status=404)
+    fmt = request.GET.get('format', 'csv')
+    if fmt not in ENCODERS:
+        return JsonResponse({'error': f'format must be one of: {", ".join(ENCODERS)}'}, status=400)
+    try:
+        start = datetime.date.fromisoformat(request.GET['start']) if request.GET.get('start') else None
+        end = datetime.date.fromisoformat(request.GET['end']) if request.GET.get('end') else None
+    except ValueError:
+        return JsonResponse({'error': 'dates must be YYYY-MM-DD'}, status=400)
+    if start and end and end < start:
+        return JsonResponse({'error': 'end must not be before start'}, status=400)
+    location = request.GET.get('location')
+    if location and not location.isdigit():
+        return JsonResponse({'error': 'location must be an id'}, status=400)
+
+    encoder = ENCODERS[fmt](EXPORT_KINDS[kind])
+    # XLSX уже сжат zip-ом, CSV жмем на лету, если клиент умеет
+    compress = fmt == 'csv' and 'gzip' in request.headers.get('Accept-Encoding', '')
+    location = int(location) if location else None
+    if is_asgi(request):
+        body = aencode_stream(encoder, aexport_batches(kind, start, end, location), compress)
+    else:
+        body = encode_stream(encoder, export_batches(kind, start, end, location), compress)
+    response = StreamingHttpResponse(body, content_type=encoder.content_type)
+    filename = f"{kind}_{start or 'all'}_{end or 'all'}.{encoder.extension}"
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response['Vary'] = 'Accept-Encoding'
+    if compress:
+        response['Content-Encoding'] = 'gzip'
+    return response